@@ -8,6 +8,7 @@ import json
 import sqlite3
 import asyncio
 import aiohttp
+from aiohttp import web
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import logging
@@ -15,6 +16,16 @@ from dataclasses import dataclass, asdict
 import uuid
 import hashlib
 
+from backend.app.metrics import install_aiohttp, timed_sqlite
+from backend.app.loop_monitor import monitor_aiohttp
+from backend.app.analytics_schema import migrate_analytics
+from backend.app.event_batch import (
+    ANALYTICS_BATCH_MAX_BYTES, BatchError, decode_batch, validate_event
+)
+from backend.app.rollups import AnalyticsRollups
+from backend.app.storage import get_storage
+from backend.app.write_behind import WriteBehindBuffer
+
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -71,234 +82,76 @@ class AnalyticsDatabase:
     def __init__(self, db_path: str = "analytics.db"):
         self.db_path = db_path
         self.init_database()
+        
+        # Escritura diferida: los eventos se escriben por lotes en una transacción
+        # y la sesión, que se reescribe en cada evento, sólo en su última versión.
+        # Cada lote marca sus días en los agregados y luego se recalculan los
+        # días cerrados afectados
+        self.rollups = AnalyticsRollups(get_storage(db_path))
+        self.writer = WriteBehindBuffer(get_storage(db_path), "analytics", {
+            "music_generations": '''
+                INSERT INTO music_generations 
+                (id, user_id, prompt, style, duration, tempo, scale, instruments, 
+                 mood, ai_enhanced, generation_time, success, error_message, 
+                 timestamp, ip_address, user_agent)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            "user_sessions": '''
+                INSERT OR REPLACE INTO user_sessions
+                (session_id, user_id, start_time, end_time, page_views, 
+                 music_generations, ai_usage, total_time, ip_address, user_agent)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            "user_interactions": '''
+                INSERT INTO user_interactions
+                (id, session_id, user_id, action, element, value, timestamp, metadata)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+        }, on_write=self.rollups.mark_dirty, after_flush=self.rollups.refresh)
+        self.writer.start()
     
     def init_database(self):
-        """Inicializar base de datos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Tabla de eventos de generación musical
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS music_generations (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                prompt TEXT NOT NULL,
-                style TEXT NOT NULL,
-                duration REAL NOT NULL,
-                tempo INTEGER NOT NULL,
-                scale TEXT NOT NULL,
-                instruments TEXT NOT NULL,
-                mood TEXT NOT NULL,
-                ai_enhanced BOOLEAN NOT NULL,
-                generation_time REAL NOT NULL,
-                success BOOLEAN NOT NULL,
-                error_message TEXT,
-                timestamp DATETIME NOT NULL,
-                ip_address TEXT NOT NULL,
-                user_agent TEXT NOT NULL
-            )
-        ''')
-        
-        # Tabla de sesiones de usuario
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                session_id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                start_time DATETIME NOT NULL,
-                end_time DATETIME,
-                page_views INTEGER DEFAULT 0,
-                music_generations INTEGER DEFAULT 0,
-                ai_usage INTEGER DEFAULT 0,
-                total_time REAL DEFAULT 0,
-                ip_address TEXT NOT NULL,
-                user_agent TEXT NOT NULL
-            )
-        ''')
-        
-        # Tabla de interacciones de usuario
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_interactions (
-                id TEXT PRIMARY KEY,
-                session_id TEXT NOT NULL,
-                user_id TEXT NOT NULL,
-                action TEXT NOT NULL,
-                element TEXT NOT NULL,
-                value TEXT,
-                timestamp DATETIME NOT NULL,
-                metadata TEXT NOT NULL,
-                FOREIGN KEY (session_id) REFERENCES user_sessions (session_id)
-            )
-        ''')
-        
-        # Tabla de métricas agregadas
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS aggregated_metrics (
-                date TEXT PRIMARY KEY,
-                total_generations INTEGER DEFAULT 0,
-                successful_generations INTEGER DEFAULT 0,
-                failed_generations INTEGER DEFAULT 0,
-                total_duration REAL DEFAULT 0,
-                avg_generation_time REAL DEFAULT 0,
-                ai_usage_count INTEGER DEFAULT 0,
-                unique_users INTEGER DEFAULT 0,
-                total_sessions INTEGER DEFAULT 0,
-                avg_session_duration REAL DEFAULT 0
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("✅ Base de datos de analytics inicializada")
+        """Inicializar base de datos (migraciones pendientes según PRAGMA user_version)"""
+        version = migrate_analytics(self.db_path)
+        logger.info(f"✅ Base de datos de analytics inicializada (esquema v{version})")
     
     def save_music_generation(self, event: MusicGenerationEvent):
-        """Guardar evento de generación musical"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO music_generations 
-            (id, user_id, prompt, style, duration, tempo, scale, instruments, 
-             mood, ai_enhanced, generation_time, success, error_message, 
-             timestamp, ip_address, user_agent)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        """Encolar evento de generación musical"""
+        self.writer.put("music_generations", (
             event.id, event.user_id, event.prompt, event.style, event.duration,
             event.tempo, event.scale, json.dumps(event.instruments), event.mood,
             event.ai_enhanced, event.generation_time, event.success, event.error_message,
             event.timestamp.isoformat(), event.ip_address, event.user_agent
         ))
-        
-        conn.commit()
-        conn.close()
-        logger.info(f"📊 Evento de generación guardado: {event.id}")
+        logger.debug(f"📊 Evento de generación encolado: {event.id}")
     
     def save_user_session(self, session: UserSession):
-        """Guardar sesión de usuario"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_sessions
-            (session_id, user_id, start_time, end_time, page_views, 
-             music_generations, ai_usage, total_time, ip_address, user_agent)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        """Encolar sesión de usuario (sustituye a la versión pendiente)"""
+        self.writer.put("user_sessions", (
             session.session_id, session.user_id, session.start_time.isoformat(),
             session.end_time.isoformat() if session.end_time else None,
             session.page_views, session.music_generations, session.ai_usage,
             session.total_time, session.ip_address, session.user_agent
-        ))
-        
-        conn.commit()
-        conn.close()
-        logger.info(f"📊 Sesión guardada: {session.session_id}")
+        ), key=session.session_id)
+        logger.debug(f"📊 Sesión encolada: {session.session_id}")
     
     def save_user_interaction(self, interaction: UserInteraction):
-        """Guardar interacción de usuario"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO user_interactions
-            (id, session_id, user_id, action, element, value, timestamp, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        """Encolar interacción de usuario"""
+        self.writer.put("user_interactions", (
             interaction.id, interaction.session_id, interaction.user_id,
             interaction.action, interaction.element, interaction.value,
             interaction.timestamp.isoformat(), json.dumps(interaction.metadata)
         ))
-        
-        conn.commit()
-        conn.close()
-        logger.info(f"📊 Interacción guardada: {interaction.id}")
+        logger.debug(f"📊 Interacción encolada: {interaction.id}")
     
+    def close(self):
+        """Escribir los eventos pendientes (llamar al apagar el servidor)"""
+        self.writer.close()
+    
+    @timed_sqlite("get_analytics_data")
     def get_analytics_data(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
-        """Obtener datos de analytics para un rango de fechas"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Métricas de generación musical
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_generations,
-                SUM(CASE WHEN success = 1 THEN 1 ELSE 0 END) as successful_generations,
-                SUM(CASE WHEN success = 0 THEN 1 ELSE 0 END) as failed_generations,
-                AVG(duration) as avg_duration,
-                AVG(generation_time) as avg_generation_time,
-                SUM(CASE WHEN ai_enhanced = 1 THEN 1 ELSE 0 END) as ai_usage_count
-            FROM music_generations
-            WHERE timestamp BETWEEN ? AND ?
-        ''', (start_date.isoformat(), end_date.isoformat()))
-        
-        music_metrics = cursor.fetchone()
-        
-        # Métricas de sesiones
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_sessions,
-                COUNT(DISTINCT user_id) as unique_users,
-                AVG(total_time) as avg_session_duration
-            FROM user_sessions
-            WHERE start_time BETWEEN ? AND ?
-        ''', (start_date.isoformat(), end_date.isoformat()))
-        
-        session_metrics = cursor.fetchone()
-        
-        # Estilos más populares
-        cursor.execute('''
-            SELECT style, COUNT(*) as count
-            FROM music_generations
-            WHERE timestamp BETWEEN ? AND ? AND success = 1
-            GROUP BY style
-            ORDER BY count DESC
-            LIMIT 10
-        ''', (start_date.isoformat(), end_date.isoformat()))
-        
-        popular_styles = cursor.fetchall()
-        
-        # Prompts más populares
-        cursor.execute('''
-            SELECT prompt, COUNT(*) as count
-            FROM music_generations
-            WHERE timestamp BETWEEN ? AND ? AND success = 1
-            GROUP BY prompt
-            ORDER BY count DESC
-            LIMIT 10
-        ''', (start_date.isoformat(), end_date.isoformat()))
-        
-        popular_prompts = cursor.fetchall()
-        
-        # Uso de IA por día
-        cursor.execute('''
-            SELECT DATE(timestamp) as date, COUNT(*) as count
-            FROM music_generations
-            WHERE timestamp BETWEEN ? AND ? AND ai_enhanced = 1
-            GROUP BY DATE(timestamp)
-            ORDER BY date
-        ''', (start_date.isoformat(), end_date.isoformat()))
-        
-        ai_usage_by_day = cursor.fetchall()
-        
-        conn.close()
-        
-        return {
-            'music_metrics': {
-                'total_generations': music_metrics[0] or 0,
-                'successful_generations': music_metrics[1] or 0,
-                'failed_generations': music_metrics[2] or 0,
-                'avg_duration': music_metrics[3] or 0,
-                'avg_generation_time': music_metrics[4] or 0,
-                'ai_usage_count': music_metrics[5] or 0
-            },
-            'session_metrics': {
-                'total_sessions': session_metrics[0] or 0,
-                'unique_users': session_metrics[1] or 0,
-                'avg_session_duration': session_metrics[2] or 0
-            },
-            'popular_styles': [{'style': style, 'count': count} for style, count in popular_styles],
-            'popular_prompts': [{'prompt': prompt, 'count': count} for prompt, count in popular_prompts],
-            'ai_usage_by_day': [{'date': date, 'count': count} for date, count in ai_usage_by_day]
-        }
+        """Obtener datos de analytics para un rango de fechas (días cerrados desde agregados)"""
+        return self.rollups.analytics(start_date, end_date)
 
 class AnalyticsCollector:
     """Recolector de analytics"""
@@ -308,9 +161,10 @@ class AnalyticsCollector:
         self.active_sessions = {}
         self.session_timeouts = {}
     
-    def start_session(self, user_id: str, ip_address: str, user_agent: str) -> str:
-        """Iniciar nueva sesión"""
-        session_id = str(uuid.uuid4())
+    def start_session(self, user_id: str, ip_address: str, user_agent: str,
+                      session_id: Optional[str] = None) -> str:
+        """Iniciar nueva sesión (con el id generado por el cliente si lo manda)"""
+        session_id = session_id or str(uuid.uuid4())
         session = UserSession(
             session_id=session_id,
             user_id=user_id,
@@ -335,8 +189,8 @@ class AnalyticsCollector:
         logger.info(f"📊 Nueva sesión iniciada: {session_id}")
         return session_id
     
-    def end_session(self, session_id: str):
-        """Finalizar sesión"""
+    def end_session(self, session_id: str) -> bool:
+        """Finalizar sesión (False si no había una activa con ese id)"""
         if session_id in self.active_sessions:
             session = self.active_sessions[session_id]
             session.end_time = datetime.now()
@@ -350,6 +204,8 @@ class AnalyticsCollector:
                 del self.session_timeouts[session_id]
             
             logger.info(f"📊 Sesión finalizada: {session_id}")
+            return True
+        return False
     
     def track_music_generation(self, session_id: str, user_id: str, prompt: str, 
                              style: str, duration: float, tempo: int, scale: str,
@@ -419,6 +275,32 @@ class AnalyticsCollector:
         logger.info(f"📊 Interacción rastreada: {interaction_id}")
         return interaction_id
     
+    def track_batch(self, events: List[Any], ip_address: str, user_agent: str) -> List[Dict[str, Any]]:
+        """Rastrear un lote de eventos mixtos: resultado por evento, todo en una transacción"""
+        results = []
+        with self.db.writer.atomic():
+            for index, event in enumerate(events):
+                try:
+                    kind, data = validate_event(event)
+                except ValueError as e:
+                    results.append({'index': index, 'success': False, 'error': str(e)})
+                    continue
+                if kind == 'generation':
+                    event_id = self.track_music_generation(
+                        ip_address=ip_address, user_agent=user_agent, **data)
+                elif kind == 'interaction':
+                    event_id = self.track_interaction(**data)
+                elif kind == 'session_start':
+                    event_id = self.start_session(
+                        ip_address=ip_address, user_agent=user_agent, **data)
+                elif self.end_session(data['session_id']):
+                    event_id = data['session_id']
+                else:
+                    results.append({'index': index, 'success': False, 'error': 'sesión desconocida'})
+                    continue
+                results.append({'index': index, 'success': True, 'type': kind, 'id': event_id})
+        return results
+    
     async def _session_timeout(self, session_id: str):
         """Timeout de sesión"""
         await asyncio.sleep(1800)  # 30 minutos
@@ -442,18 +324,24 @@ class AnalyticsServer:
         
     def init(self):
         """Inicializar servidor"""
-        from aiohttp import web
-        
-        self.app = web.Application()
+        self.app = web.Application(client_max_size=ANALYTICS_BATCH_MAX_BYTES)
         self.app.router.add_post('/api/track/generation', self.track_generation_endpoint)
         self.app.router.add_post('/api/track/interaction', self.track_interaction_endpoint)
+        self.app.router.add_post('/api/track/batch', self.track_batch_endpoint)
         self.app.router.add_post('/api/session/start', self.start_session_endpoint)
         self.app.router.add_post('/api/session/end', self.end_session_endpoint)
         self.app.router.add_get('/api/analytics', self.analytics_endpoint)
         self.app.router.add_get('/api/health', self.health_endpoint)
+        install_aiohttp(self.app, service="analytics")
+        monitor_aiohttp(self.app, service="analytics")
+        self.app.on_cleanup.append(self.cleanup)
         
         return self.app
     
+    async def cleanup(self, app):
+        """Escribir los eventos pendientes al apagar"""
+        await asyncio.to_thread(self.collector.db.close)
+    
     async def track_generation_endpoint(self, request):
         """Endpoint para rastrear generación musical"""
         try:
@@ -513,6 +401,39 @@ class AnalyticsServer:
                 'error': str(e)
             }, status=500)
     
+    async def track_batch_endpoint(self, request):
+        """Endpoint para rastrear un lote de eventos (NDJSON o array JSON, gzip opcional)"""
+        try:
+            try:
+                body = await request.read()
+            except web.HTTPRequestEntityTooLarge:
+                raise BatchError(f"lote mayor de {ANALYTICS_BATCH_MAX_BYTES} bytes", 413)
+            events = decode_batch(body)
+            results = self.collector.track_batch(
+                events,
+                ip_address=request.remote,
+                user_agent=request.headers.get('User-Agent', '')
+            )
+            accepted = sum(1 for result in results if result['success'])
+            
+            return web.json_response({
+                'success': True,
+                'accepted': accepted,
+                'rejected': len(results) - accepted,
+                'results': results,
+                'timestamp': datetime.now().isoformat()
+            })
+        except BatchError as e:
+            return web.json_response({
+                'success': False,
+                'error': str(e)
+            }, status=e.status)
+        except Exception as e:
+            return web.json_response({
+                'success': False,
+                'error': str(e)
+            }, status=500)
+    
     async def start_session_endpoint(self, request):
         """Endpoint para iniciar sesión"""
         try:
@@ -580,8 +501,6 @@ class AnalyticsServer:
 
 def main():
     """Función principal para ejecutar el servidor"""
-    from aiohttp import web
-    
     server = AnalyticsServer()
     app = server.init()
     
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Control de admisión para el upstream de generación
+Límite global y por usuario de llamadas concurrentes, cola justa ponderada
+por plan (WFQ) y rechazo rápido con Retry-After cuando la cola se satura.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+ADMISSION_PER_USER = int(os.getenv("ADMISSION_PER_USER", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+# Peso de cada plan en la cola: con todos saturados, enterprise recibe
+# 8 turnos por cada turno de free
+PLAN_WEIGHTS = {"free": 1.0, "pro": 4.0, "enterprise": 8.0, "admin": 8.0}
+DEFAULT_PLAN = "free"
+
+registry.describe("admission_active", "gauge", "Llamadas de generación en curso")
+registry.describe("admission_queue_depth", "gauge", "Peticiones esperando turno por plan")
+registry.describe("admission_wait_seconds", "histogram", "Espera en la cola de admisión")
+registry.describe("admission_rejected_total", "counter", "Peticiones rechazadas por saturación")
+
+
+class AdmissionRejected(Exception):
+    """La cola está saturada o se agotó el tiempo de espera"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Waiter:
+    user: Optional[str]
+    future: asyncio.Future
+
+
+@dataclass
+class _PlanQueue:
+    weight: float
+    waiters: Deque[_Waiter] = field(default_factory=deque)
+    # Tiempo virtual de la próxima admisión de este plan
+    finish: float = 0.0
+
+
+class AdmissionController:
+    """Semáforo con cola justa ponderada por plan y límite por usuario"""
+
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+                 per_user: int = ADMISSION_PER_USER, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._per_user: Dict[str, int] = {}
+        self._queues: Dict[str, _PlanQueue] = {}
+        self._virtual_time = 0.0
+        # Duración media de una llamada (EWMA) para estimar Retry-After
+        self._service_time: Optional[float] = None
+        self.admitted = 0
+        self.rejected = 0
+
+    def _queue(self, plan: str) -> _PlanQueue:
+        queue = self._queues.get(plan)
+        if queue is None:
+            queue = self._queues[plan] = _PlanQueue(PLAN_WEIGHTS.get(plan, PLAN_WEIGHTS[DEFAULT_PLAN]))
+        return queue
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q.waiters) for q in self._queues.values())
+
+    def _can_run(self, user: Optional[str]) -> bool:
+        return user is None or self._per_user.get(user, 0) < self.per_user
+
+    def _acquire(self, user: Optional[str]):
+        self.active += 1
+        self.admitted += 1
+        if user is not None:
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+        registry.gauge_set("admission_active", self.active)
+
+    def _release(self, user: Optional[str]):
+        self.active -= 1
+        if user is not None:
+            remaining = self._per_user.get(user, 1) - 1
+            if remaining:
+                self._per_user[user] = remaining
+            else:
+                self._per_user.pop(user, None)
+        registry.gauge_set("admission_active", self.active)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Despertar a los siguientes en orden de tiempo virtual de cada plan"""
+        while self.active < self.max_concurrency:
+            candidates = sorted(
+                ((q.finish, plan, q) for plan, q in self._queues.items() if q.waiters),
+                key=lambda item: item[0]
+            )
+            for finish, plan, queue in candidates:
+                waiter = next((w for w in queue.waiters
+                               if not w.future.done() and self._can_run(w.user)), None)
+                if waiter is not None:
+                    break
+            else:
+                return
+            queue.waiters.remove(waiter)
+            self._virtual_time = finish
+            queue.finish = finish + 1.0 / queue.weight
+            registry.gauge_set("admission_queue_depth", len(queue.waiters), plan=plan)
+            self._acquire(waiter.user)
+            waiter.future.set_result(True)
+
+    def retry_after(self) -> float:
+        """Segundos estimados hasta que haya hueco en la cola"""
+        pending = self.queued + self.active - self.max_concurrency + 1
+        service_time = self._service_time or self.queue_timeout
+        return max(1.0, round(pending * service_time / max(self.max_concurrency, 1)))
+
+    def _reject(self, plan: str, reason: str):
+        self.rejected += 1
+        registry.inc("admission_rejected_total", plan=plan, reason=reason)
+        raise AdmissionRejected(reason, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, plan: Optional[str] = None, user: Optional[Any] = None,
+                   timeout: Optional[float] = ADMISSION_QUEUE_TIMEOUT) -> AsyncIterator[None]:
+        """
+        Esperar turno para llamar al upstream.
+
+        ``timeout=None`` espera sin límite y sin rechazo por cola llena (trabajos
+        en segundo plano).
+        """
+        plan = plan if plan in PLAN_WEIGHTS else DEFAULT_PLAN
+        user = str(user) if user is not None else None
+        start = time.monotonic()
+
+        queue = self._queue(plan)
+        if self.active < self.max_concurrency and not self.queued and self._can_run(user):
+            self._acquire(user)
+        else:
+            if timeout is not None and self.queued >= self.max_queue:
+                self._reject(plan, "queue_full")
+            if not queue.waiters:
+                # Un plan que vuelve a tener cola no acumula turnos de su inactividad
+                queue.finish = max(queue.finish, self._virtual_time)
+            waiter = _Waiter(user, asyncio.get_running_loop().create_future())
+            queue.waiters.append(waiter)
+            registry.gauge_set("admission_queue_depth", len(queue.waiters), plan=plan)
+            # Puede haber hueco si sólo bloqueaba el límite por usuario de otros
+            self._dispatch()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Admitido justo al expirar: devolver el hueco
+                    self._release(user)
+                else:
+                    waiter.future.cancel()
+                    if waiter in queue.waiters:
+                        queue.waiters.remove(waiter)
+                    registry.gauge_set("admission_queue_depth", len(queue.waiters), plan=plan)
+                registry.observe("admission_wait_seconds", time.monotonic() - start,
+                                 plan=plan, outcome="timeout")
+                if isinstance(e, asyncio.TimeoutError):
+                    self._reject(plan, "queue_timeout")
+                raise
+
+        registry.observe("admission_wait_seconds", time.monotonic() - start,
+                         plan=plan, outcome="admitted")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._service_time = (elapsed if self._service_time is None
+                                  else 0.8 * self._service_time + 0.2 * elapsed)
+            self._release(user)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "per_user": self.per_user,
+            "queued": {plan: len(q.waiters) for plan, q in self._queues.items()},
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_service_seconds": round(self._service_time or 0.0, 3),
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Esquema de analytics.db
+Migraciones compartidas por analytics_system.py y simple_analytics_server.py
+"""
+
+from .migrations import Migration, migrate
+
+ANALYTICS_MIGRATIONS = (
+    Migration(1, "tablas de eventos, sesiones, interacciones y métricas agregadas", (
+        '''
+        CREATE TABLE IF NOT EXISTS music_generations (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            style TEXT NOT NULL,
+            duration REAL NOT NULL,
+            tempo INTEGER NOT NULL,
+            scale TEXT NOT NULL,
+            instruments TEXT NOT NULL,
+            mood TEXT NOT NULL,
+            ai_enhanced BOOLEAN NOT NULL,
+            generation_time REAL NOT NULL,
+            success BOOLEAN NOT NULL,
+            error_message TEXT,
+            timestamp DATETIME NOT NULL,
+            ip_address TEXT NOT NULL,
+            user_agent TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME,
+            page_views INTEGER DEFAULT 0,
+            music_generations INTEGER DEFAULT 0,
+            ai_usage INTEGER DEFAULT 0,
+            total_time REAL DEFAULT 0,
+            ip_address TEXT NOT NULL,
+            user_agent TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_interactions (
+            id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            element TEXT NOT NULL,
+            value TEXT,
+            timestamp DATETIME NOT NULL,
+            metadata TEXT NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES user_sessions (session_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS aggregated_metrics (
+            date TEXT PRIMARY KEY,
+            total_generations INTEGER DEFAULT 0,
+            successful_generations INTEGER DEFAULT 0,
+            failed_generations INTEGER DEFAULT 0,
+            total_duration REAL DEFAULT 0,
+            avg_generation_time REAL DEFAULT 0,
+            ai_usage_count INTEGER DEFAULT 0,
+            unique_users INTEGER DEFAULT 0,
+            total_sessions INTEGER DEFAULT 0,
+            avg_session_duration REAL DEFAULT 0
+        )
+        ''',
+    )),
+    Migration(2, "índices para las consultas del dashboard", (
+        # Rangos BETWEEN de get_analytics_data (con y sin success = 1)
+        "CREATE INDEX IF NOT EXISTS idx_music_generations_timestamp_success "
+        "ON music_generations (timestamp, success)",
+        # Sesiones por rango con COUNT(DISTINCT user_id) sin leer la tabla
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_start_time_user "
+        "ON user_sessions (start_time, user_id)",
+        # Recorrido de una sesión en orden
+        "CREATE INDEX IF NOT EXISTS idx_user_interactions_session_timestamp "
+        "ON user_interactions (session_id, timestamp)",
+        # Estadísticas para que el planificador elija entre índice y recorrido completo
+        "ANALYZE",
+    )),
+    Migration(3, "agregados diarios incrementales", (
+        # Sumas (no medias) para poder combinar días
+        "ALTER TABLE aggregated_metrics ADD COLUMN total_generation_time REAL DEFAULT 0",
+        "ALTER TABLE aggregated_metrics ADD COLUMN total_session_time REAL DEFAULT 0",
+        "ALTER TABLE aggregated_metrics ADD COLUMN updated_at TEXT",
+        '''
+        CREATE TABLE IF NOT EXISTS daily_style_counts (
+            date TEXT NOT NULL,
+            style TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (date, style)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_prompt_counts (
+            date TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (date, prompt)
+        ) WITHOUT ROWID
+        ''',
+        # Usuarios distintos por día: unique_users de un rango no es una suma
+        '''
+        CREATE TABLE IF NOT EXISTS daily_session_users (
+            date TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            PRIMARY KEY (date, user_id)
+        ) WITHOUT ROWID
+        ''',
+        # Días con eventos escritos después de su último cálculo
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_dirty_days (
+            date TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 1
+        ) WITHOUT ROWID
+        ''',
+        # Los días ya existentes se responden desde filas crudas hasta recalcularlos
+        '''
+        INSERT OR IGNORE INTO rollup_dirty_days (date)
+        SELECT DATE(timestamp) FROM music_generations GROUP BY 1
+        UNION SELECT DATE(start_time) FROM user_sessions GROUP BY 1
+        ''',
+    )),
+)
+
+
+def migrate_analytics(path: str) -> int:
+    """Llevar analytics.db a la última versión (no hace nada si ya lo está)"""
+    return migrate(path, ANALYTICS_MIGRATIONS)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Caché de JWT verificados
+LRU acotado: digest del token -> claims, válido hasta el `exp` del token
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Configuración
+JWT_CACHE_ENABLED = os.getenv("JWT_CACHE_ENABLED", "1") != "0"
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+
+
+class TokenCache:
+    """LRU de tokens ya verificados"""
+
+    def __init__(self, max_entries: int = JWT_CACHE_SIZE, enabled: bool = JWT_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[bytes, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Claims del token si está en caché y no ha expirado"""
+        if not self.enabled:
+            return None
+        key = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: Dict[str, Any]):
+        """Guardar claims verificados; sólo tokens con `exp`"""
+        if not self.enabled or "exp" not in claims:
+            return
+        key = self._digest(token)
+        with self._lock:
+            self._entries[key] = (claims, float(claims["exp"]))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+token_cache = TokenCache()
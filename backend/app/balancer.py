@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Balanceo entre varias instancias de un servicio
+Cada llamada va a la instancia lista con menos peticiones en curso; una
+instancia sólo recibe tráfico cuando su /health responde y sale del reparto
+en cuanto rechaza conexiones (proceso caído o reiniciándose).
+"""
+
+import os
+import logging
+import threading
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+from urllib.parse import urlsplit
+
+from .circuit import CircuitOpen
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+NODE_POOL_SIZE = int(os.getenv("NODE_POOL_SIZE", "1"))
+BALANCER_PROBE_INTERVAL = float(os.getenv("BALANCER_PROBE_INTERVAL", "2"))
+BALANCER_PROBE_TIMEOUT = float(os.getenv("BALANCER_PROBE_TIMEOUT", "2"))
+
+registry.describe("balancer_outstanding", "gauge", "Peticiones en curso por instancia")
+registry.describe("balancer_ready", "gauge", "Instancia lista para recibir tráfico (1 sí, 0 no)")
+
+
+def consecutive_urls(base_url: str, size: int) -> List[str]:
+    """``http://host:3001`` y 3 -> puertos 3001, 3002 y 3003"""
+    parts = urlsplit(base_url.rstrip("/"))
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return [f"{parts.scheme}://{parts.hostname}:{port + i}" for i in range(max(1, size))]
+
+
+class NoReadyEndpoint(CircuitOpen):
+    """Ninguna instancia del pool está lista"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(name, retry_after)
+        self.args = (f"Ninguna instancia de {name} lista",)
+
+
+@dataclass
+class Endpoint:
+    url: str
+    ready: bool = False
+    outstanding: int = 0
+    served: int = 0
+    failures: int = 0
+
+
+class LeastOutstandingBalancer:
+    """
+    Uso::
+
+        with balancer.lease() as endpoint:
+            response = await client.post(endpoint.url + "/generate-music", ...)
+
+    Mientras no se arranca el sondeo de salud todas las instancias se
+    consideran listas.
+    """
+
+    def __init__(self, name: str, urls: List[str], probe_path: str = "/health",
+                 probe_interval: float = BALANCER_PROBE_INTERVAL):
+        self.name = name
+        self.endpoints = [Endpoint(url.rstrip("/")) for url in urls]
+        self.probe_path = probe_path
+        self.probe_interval = probe_interval
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._prober: Optional[threading.Thread] = None
+
+    def _set_ready(self, endpoint: Endpoint, ready: bool):
+        if ready != endpoint.ready:
+            logger.info(f"{'✅' if ready else '⚠️'} {self.name} {endpoint.url}: "
+                        f"{'lista' if ready else 'fuera del reparto'}")
+            endpoint.ready = ready
+        registry.gauge_set("balancer_ready", int(ready), pool=self.name, endpoint=endpoint.url)
+
+    def ready_endpoints(self) -> List[Endpoint]:
+        return [e for e in self.endpoints if e.ready or self._prober is None]
+
+    def acquire(self) -> Endpoint:
+        """Reservar la instancia lista con menos peticiones en curso"""
+        with self._lock:
+            gated = self._prober is not None
+            # Empezar la búsqueda en una instancia distinta cada vez para repartir los empates
+            count = len(self.endpoints)
+            order = [self.endpoints[(self._next + i) % count] for i in range(count)]
+            self._next = (self._next + 1) % count
+            candidates = [e for e in order if e.ready or not gated]
+            if not candidates:
+                raise NoReadyEndpoint(self.name, self.probe_interval)
+            endpoint = min(candidates, key=lambda e: e.outstanding)
+            endpoint.outstanding += 1
+            endpoint.served += 1
+            registry.gauge_set("balancer_outstanding", endpoint.outstanding,
+                               pool=self.name, endpoint=endpoint.url)
+        return endpoint
+
+    def release(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+            registry.gauge_set("balancer_outstanding", endpoint.outstanding,
+                               pool=self.name, endpoint=endpoint.url)
+
+    @contextmanager
+    def lease(self) -> Iterator[Endpoint]:
+        endpoint = self.acquire()
+        try:
+            yield endpoint
+        finally:
+            self.release(endpoint)
+
+    def mark_down(self, endpoint: Endpoint):
+        """La instancia rechazó la conexión: sacarla hasta que el sondeo la vea sana"""
+        with self._lock:
+            endpoint.failures += 1
+            if self._prober is not None:
+                self._set_ready(endpoint, False)
+
+    # ------------------------------------------------------------------
+    # Sondeo de salud
+    # ------------------------------------------------------------------
+
+    def _healthy(self, endpoint: Endpoint) -> bool:
+        try:
+            with urllib.request.urlopen(endpoint.url + self.probe_path,
+                                        timeout=BALANCER_PROBE_TIMEOUT) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    def probe_once(self):
+        for endpoint in self.endpoints:
+            healthy = self._healthy(endpoint)
+            with self._lock:
+                self._set_ready(endpoint, healthy)
+
+    def _probe_loop(self):
+        while True:
+            self.probe_once()
+            if self._stop.wait(self.probe_interval):
+                return
+
+    def start_probing(self):
+        """Arrancar el sondeo: desde aquí sólo reciben tráfico las instancias sanas"""
+        if self._prober is not None:
+            return
+        self._stop.clear()
+        with self._lock:
+            for endpoint in self.endpoints:
+                self._set_ready(endpoint, False)
+            self._prober = threading.Thread(target=self._probe_loop, name=f"balancer-{self.name}",
+                                            daemon=True)
+        self._prober.start()
+
+    def stop_probing(self):
+        self._stop.set()
+        if self._prober is not None:
+            self._prober.join(timeout=self.probe_interval + BALANCER_PROBE_TIMEOUT)
+            self._prober = None
+
+    def stats(self):
+        return {
+            "endpoints": [
+                {"url": e.url, "ready": e.ready, "outstanding": e.outstanding,
+                 "served": e.served, "failures": e.failures}
+                for e in self.endpoints
+            ],
+            "ready": sum(e.ready for e in self.endpoints),
+        }
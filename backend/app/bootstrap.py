@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Arranque del frontend en un solo viaje
+GET /api/bootstrap junta las respuestas que la página pide al cargar
+(salud, uso, tracks, estados de NEXUS y Resistencia). Cada sección sale de
+una caché con TTL, ya serializada, con su ETag y su antigüedad; las que
+faltan se construyen a la vez.
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import inspect
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from .metrics import registry
+from .tracks import make_etag
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+BOOTSTRAP_TTL = float(os.getenv("BOOTSTRAP_TTL", "5"))
+BOOTSTRAP_USAGE_TTL = float(os.getenv("BOOTSTRAP_USAGE_TTL", "5"))
+# Usuarios distintos con la sección de uso en memoria
+BOOTSTRAP_MAX_USERS = int(os.getenv("BOOTSTRAP_MAX_USERS", "1024"))
+
+registry.describe("bootstrap_sections_total", "counter",
+                  "Secciones de /api/bootstrap por resultado (hit, miss, not_modified, error)")
+
+
+@dataclass
+class SectionPayload:
+    body: bytes
+    etag: str
+    # Instante (time.monotonic) en que se construyeron los datos
+    built_at: float
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.built_at
+
+
+def serialize(data: Any) -> SectionPayload:
+    body = json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode()
+    return SectionPayload(body, make_etag(body), time.monotonic())
+
+
+class CachedSection:
+    """
+    Sección con TTL construida por ``build`` (función síncrona, que se
+    ejecuta en un hilo, o corrutina). Con ``per_user`` se guarda una entrada
+    por usuario (LRU acotado) y ``build`` recibe el user_id.
+    """
+
+    def __init__(self, name: str, build: Callable[..., Any], ttl: float = BOOTSTRAP_TTL,
+                 per_user: bool = False, max_entries: int = BOOTSTRAP_MAX_USERS):
+        self.name = name
+        self.build = build
+        self.ttl = ttl
+        self.per_user = per_user
+        self.max_entries = max_entries if per_user else 1
+        self._entries: "OrderedDict[Any, SectionPayload]" = OrderedDict()
+        self._inflight: Dict[Any, asyncio.Future] = {}
+
+    def fresh(self, key: Any = None) -> Optional[SectionPayload]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.age < self.ttl:
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def invalidate(self, key: Any = None):
+        self._entries.pop(key, None)
+
+    async def _build(self, key: Any) -> SectionPayload:
+        args = (key,) if self.per_user else ()
+        if inspect.iscoroutinefunction(self.build):
+            data = await self.build(*args)
+        else:
+            data = await asyncio.to_thread(self.build, *args)
+        return serialize(data)
+
+    async def get(self, key: Any = None) -> SectionPayload:
+        while True:
+            entry = self.fresh(key)
+            if entry is not None:
+                registry.inc("bootstrap_sections_total", section=self.name, outcome="hit")
+                return entry
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Si sólo se canceló la construcción original, reintentar
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        registry.inc("bootstrap_sections_total", section=self.name, outcome="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            payload = await self._build(key)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Evitar el aviso "exception was never retrieved" si nadie esperaba
+            future.exception()
+            raise
+        else:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            future.set_result(payload)
+            return payload
+        finally:
+            self._inflight.pop(key, None)
+
+
+def parse_if_none_match(value: Optional[str]) -> Set[str]:
+    """Lista de ETags de If-None-Match (el cliente manda las de sus secciones)"""
+    if not value:
+        return set()
+    return {tag.strip().removeprefix("W/") for tag in value.split(",") if tag.strip()}
+
+
+class Bootstrap:
+    """Ensamblador de /api/bootstrap a partir de secciones independientes"""
+
+    def __init__(self):
+        self.sections: Dict[str, Tuple[Callable[[Any], Awaitable[SectionPayload]], bool]] = {}
+
+    def add(self, name: str, fetch: Callable[..., Awaitable[SectionPayload]], per_user: bool = False):
+        """``fetch`` devuelve el SectionPayload de la sección (p. ej. CachedSection.get)"""
+        self.sections[name] = (fetch, per_user)
+
+    def add_cached(self, section: CachedSection):
+        self.add(section.name, section.get, per_user=section.per_user)
+
+    async def collect(self, user_id: Any = None) -> Dict[str, Any]:
+        """Secciones en paralelo; una sección que falla no tumba las demás"""
+        names, calls = [], []
+        for name, (fetch, per_user) in self.sections.items():
+            if per_user and not user_id:
+                continue
+            names.append(name)
+            calls.append(fetch(user_id) if per_user else fetch())
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                registry.inc("bootstrap_sections_total", section=name, outcome="error")
+                logger.warning(f"⚠️ Sección {name} de bootstrap no disponible: {result}")
+        return dict(zip(names, results))
+
+    @staticmethod
+    def combined_etag(sections: Dict[str, Any]) -> str:
+        digest = hashlib.sha1()
+        for name, payload in sections.items():
+            etag = payload.etag if isinstance(payload, SectionPayload) else "error"
+            digest.update(f"{name}={etag};".encode())
+        return '"' + digest.hexdigest() + '"'
+
+    @staticmethod
+    def render(sections: Dict[str, Any], known: Iterable[str] = ()) -> bytes:
+        """
+        Cuerpo JSON ensamblado con los bytes ya serializados de cada sección.
+        Las secciones cuya ETag ya tiene el cliente van sin ``data``.
+        """
+        known = set(known)
+        parts = []
+        for name, payload in sections.items():
+            head = json.dumps(name) + ":"
+            if not isinstance(payload, SectionPayload):
+                parts.append((head + json.dumps({"error": "Sección no disponible"}, ensure_ascii=False)).encode())
+                continue
+            meta = f'{head}{{"etag":{json.dumps(payload.etag)},"age":{round(payload.age, 3)}'
+            if payload.etag in known:
+                registry.inc("bootstrap_sections_total", section=name, outcome="not_modified")
+                parts.append(f'{meta},"not_modified":true}}'.encode())
+            else:
+                parts.append(meta.encode() + b',"data":' + payload.body + b"}")
+        return b'{"sections":{' + b",".join(parts) + b"}}"
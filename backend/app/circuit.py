@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Circuit breaker para servicios externos
+Cerrado -> abierto tras fallos consecutivos; mientras está abierto se
+responde al instante y un hilo sondea la salud del servicio para pasar a
+semiabierto y dejar pasar una petición de prueba.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "10"))
+CIRCUIT_PROBE_INTERVAL = float(os.getenv("CIRCUIT_PROBE_INTERVAL", "2"))
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+registry.describe("circuit_state", "gauge", "Estado del circuito (0 cerrado, 1 semiabierto, 2 abierto)")
+registry.describe("circuit_rejected_total", "counter", "Llamadas rechazadas con el circuito abierto")
+
+
+class CircuitOpen(Exception):
+    """El circuito está abierto: no llamar al servicio"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito {name} abierto")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Uso::
+
+        with breaker:
+            response = session.post(...)
+
+    Cualquier excepción dentro del bloque cuenta como fallo. Si se pasa
+    ``probe``, la salida del estado abierto la decide el sondeo de salud
+    en lugar de ``reset_timeout``.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+                 probe: Optional[Callable[[], bool]] = None,
+                 probe_interval: float = CIRCUIT_PROBE_INTERVAL):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._prober: Optional[threading.Thread] = None
+        registry.gauge_set("circuit_state", 0, circuit=name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.info(f"🔌 Circuito {self.name}: {self.state} -> {state}")
+            self.state = state
+            registry.gauge_set("circuit_state", _STATE_VALUES[state], circuit=self.name)
+
+    def retry_after(self) -> float:
+        interval = self.probe_interval if self.probe else self.reset_timeout
+        return max(1.0, round(self.opened_at + interval - time.monotonic()))
+
+    def allow(self):
+        """Lanzar CircuitOpen si no se debe llamar al servicio ahora"""
+        with self._lock:
+            if self.state == OPEN and self.probe is None \
+                    and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                # Sólo una petición de prueba a la vez
+                self._trial_in_flight = True
+                return
+        registry.inc("circuit_rejected_total", circuit=self.name)
+        raise CircuitOpen(self.name, self.retry_after())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def abandon(self):
+        """Llamada interrumpida sin resultado (p. ej. cancelada): liberar la prueba"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def __enter__(self):
+        self.allow()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.record_success()
+        else:
+            self.record_failure()
+        return False
+
+    # ------------------------------------------------------------------
+    # Sondeo de salud
+    # ------------------------------------------------------------------
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            if self.state != OPEN:
+                continue
+            try:
+                healthy = self.probe()
+            except Exception:
+                healthy = False
+            if healthy:
+                with self._lock:
+                    if self.state == OPEN:
+                        self._set_state(HALF_OPEN)
+
+    def start_probing(self):
+        """Arrancar el hilo que sondea la salud mientras el circuito está abierto"""
+        if self.probe is None or self._prober is not None:
+            return
+        self._stop.clear()
+        self._prober = threading.Thread(target=self._probe_loop, name=f"circuit-{self.name}",
+                                        daemon=True)
+        self._prober.start()
+
+    def stop_probing(self):
+        self._stop.set()
+        if self._prober is not None:
+            self._prober.join(timeout=self.probe_interval + 1)
+            self._prober = None
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": self.retry_after() if self.state == OPEN else 0,
+        }
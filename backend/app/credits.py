@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Ledger de créditos con reservas atómicas
+Reserva -> commit/refund, sin transacciones abiertas durante la generación
+"""
+
+import os
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+CREDIT_SNAPSHOT_INTERVAL = float(os.getenv("CREDIT_SNAPSHOT_INTERVAL", "5"))
+CREDIT_SNAPSHOT_MAX_USERS = int(os.getenv("CREDIT_SNAPSHOT_MAX_USERS", "10000"))
+
+# Sólo el plan free consume créditos
+METERED_PLANS = ("free",)
+
+
+class CreditError(Exception):
+    """Error base del ledger"""
+
+
+class UserNotFound(CreditError):
+    """El usuario no existe"""
+
+
+class InsufficientCredits(CreditError):
+    """El usuario no tiene créditos disponibles"""
+
+
+@dataclass
+class Reservation:
+    """Crédito reservado antes de llamar al upstream"""
+    id: str
+    user_id: int
+    plan: str
+    debited: bool
+    remaining: Optional[int]
+
+    @property
+    def credits_remaining(self) -> Union[int, str]:
+        return self.remaining if self.debited else "unlimited"
+
+
+class CreditLedger:
+    """Reservas de créditos con auditoría en credit_events"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.db = storage
+        self._snapshots: "OrderedDict[str, Tuple[int, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init(self):
+        """Crear tablas del ledger"""
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS credit_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    reservation_id TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    delta INTEGER NOT NULL,
+                    reason TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_credit_events_user
+                ON credit_events (user_id, created_at)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_credit_events_reservation
+                ON credit_events (reservation_id)
+            """)
+
+    def reserve(self, user_id: int) -> Reservation:
+        """Descontar un crédito con un único UPDATE condicional"""
+        reservation_id = uuid.uuid4().hex
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE users SET credits = credits - 1
+                WHERE id = ? AND plan IN ({}) AND credits > 0
+                RETURNING credits, plan
+            """.format(", ".join("?" * len(METERED_PLANS))), (user_id, *METERED_PLANS))
+            row = cursor.fetchone()
+            if row:
+                remaining, plan = row
+                cursor.execute("""
+                    INSERT INTO credit_events (reservation_id, user_id, event, delta)
+                    VALUES (?, ?, 'reserve', -1)
+                """, (reservation_id, user_id))
+
+        if row:
+            self._store_snapshot(user_id, remaining, plan)
+            return Reservation(reservation_id, user_id, plan, True, remaining)
+
+        user_data = self.db.fetchone("SELECT credits, plan FROM users WHERE id = ?", (user_id,))
+        if not user_data:
+            raise UserNotFound(user_id)
+        credits, plan = user_data
+        self._store_snapshot(user_id, credits, plan)
+        if plan in METERED_PLANS:
+            raise InsufficientCredits(user_id)
+        return Reservation(reservation_id, user_id, plan, False, None)
+
+    def commit(self, reservation: Reservation):
+        """Confirmar el crédito reservado"""
+        if not reservation.debited:
+            return
+        self.db.execute("""
+            INSERT INTO credit_events (reservation_id, user_id, event, delta)
+            VALUES (?, ?, 'commit', 0)
+        """, (reservation.id, reservation.user_id))
+
+    def refund(self, reservation: Reservation, reason: Optional[str] = None):
+        """Devolver el crédito si la generación falló"""
+        if not reservation.debited:
+            return
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE users SET credits = credits + 1 WHERE id = ?
+                RETURNING credits, plan
+            """, (reservation.user_id,))
+            row = cursor.fetchone()
+            cursor.execute("""
+                INSERT INTO credit_events (reservation_id, user_id, event, delta, reason)
+                VALUES (?, ?, 'refund', 1, ?)
+            """, (reservation.id, reservation.user_id, reason))
+        if row:
+            self._store_snapshot(reservation.user_id, *row)
+        logger.info(f"💳 Crédito devuelto a usuario {reservation.user_id}: {reason}")
+
+    def balance(self, user_id) -> Optional[Tuple[int, str]]:
+        """Saldo y plan desde el snapshot; se refresca si tiene más de CREDIT_SNAPSHOT_INTERVAL"""
+        key = str(user_id)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot and time.monotonic() - snapshot[2] < CREDIT_SNAPSHOT_INTERVAL:
+                self._snapshots.move_to_end(key)
+                return snapshot[0], snapshot[1]
+
+        user_data = self.db.fetchone("SELECT credits, plan FROM users WHERE id = ?", (user_id,))
+        if not user_data:
+            return None
+        self._store_snapshot(user_id, *user_data)
+        return user_data
+
+    def _store_snapshot(self, user_id, credits: int, plan: str):
+        key = str(user_id)
+        with self._lock:
+            self._snapshots[key] = (credits, plan, time.monotonic())
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > CREDIT_SNAPSHOT_MAX_USERS:
+                self._snapshots.popitem(last=False)
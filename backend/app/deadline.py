@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Plazos de petición y cancelación por desconexión del cliente
+La cabecera X-Request-Deadline (instante Unix en segundos) indica hasta
+cuándo le sirve la respuesta al cliente. Las llamadas a upstream recortan
+sus timeouts al tiempo restante y la propagan; si el cliente cierra la
+conexión o vence el plazo, el handler en curso se cancela.
+"""
+
+import json
+import math
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+DEADLINE_HEADER = "X-Request-Deadline"
+# Código no estándar (nginx) para peticiones abandonadas por el cliente
+CLIENT_CLOSED_REQUEST = 499
+
+registry.describe("requests_cancelled_total", "counter",
+                  "Peticiones canceladas por desconexión del cliente o plazo vencido")
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """El plazo de la petición ya venció"""
+
+
+def parse_deadline(value: Optional[str]) -> Optional[float]:
+    """Instante Unix en segundos; None si falta o no es válido"""
+    try:
+        deadline = float(value)
+    except (TypeError, ValueError):
+        return None
+    return deadline if math.isfinite(deadline) and deadline > 0 else None
+
+
+def expired() -> bool:
+    deadline = _deadline.get()
+    return deadline is not None and time.time() >= deadline
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """
+    Segundos hasta el plazo, acotados por ``default`` (el timeout propio de
+    la llamada). Sin plazo devuelve ``default``; lanza DeadlineExceeded si
+    ya venció.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = deadline - time.time()
+    if left <= 0:
+        raise DeadlineExceeded("Plazo de la petición vencido")
+    return left if default is None else min(default, left)
+
+
+def propagate(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Cabeceras para una llamada a otro servicio propio, con el plazo actual"""
+    headers = dict(headers or {})
+    deadline = _deadline.get()
+    if deadline is not None:
+        headers[DEADLINE_HEADER] = f"{deadline:.3f}"
+    return headers
+
+
+class DeadlineMiddleware:
+    """
+    Middleware ASGI puro: fija el plazo de X-Request-Deadline y cancela el
+    handler si el cliente se desconecta o el plazo vence antes de responder.
+
+    La desconexión sólo se puede detectar una vez leído el cuerpo, así que
+    la vigilancia empieza cuando la aplicación lo ha consumido entero.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = DEADLINE_HEADER.lower().encode()
+        deadline = parse_deadline(next(
+            (v.decode("latin-1") for k, v in scope["headers"] if k == header), None))
+
+        body_done = asyncio.Event()
+        disconnected = asyncio.Event()
+        pending: asyncio.Queue = asyncio.Queue()
+        response_started = False
+
+        async def receive_wrapper():
+            if body_done.is_set():
+                if disconnected.is_set() and pending.empty():
+                    return {"type": "http.disconnect"}
+                return await pending.get()
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                body_done.set()
+            elif not message.get("more_body", False):
+                body_done.set()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def watch():
+            await body_done.wait()
+            if disconnected.is_set():
+                return
+            message = await receive()
+            await pending.put(message)
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+
+        token = _deadline.set(deadline)
+        # Las tareas copian el contexto: el handler ve el plazo
+        handler = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+        watcher = asyncio.ensure_future(watch())
+        gone = asyncio.ensure_future(disconnected.wait())
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            await asyncio.wait({handler, gone}, timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if handler.done():
+                handler.result()
+                return
+
+            reason = "client_disconnect" if disconnected.is_set() else "deadline"
+            if reason == "deadline" and response_started:
+                # La respuesta ya se está enviando: dejarla terminar
+                await handler
+                return
+
+            handler.cancel()
+            try:
+                await handler
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+            registry.inc("requests_cancelled_total", service=self.service, reason=reason)
+            logger.info(f"✂️ {scope['method']} {scope['path']} cancelada ({reason})")
+
+            if not response_started:
+                # Con el cliente ya desconectado el servidor descarta el envío
+                status = CLIENT_CLOSED_REQUEST if reason == "client_disconnect" else 504
+                body = json.dumps({"detail": "Plazo de la petición vencido"},
+                                  ensure_ascii=False).encode() if status == 504 else b""
+                await send({"type": "http.response.start", "status": status,
+                            "headers": [(b"content-type", b"application/json"),
+                                        (b"content-length", str(len(body)).encode())]})
+                await send({"type": "http.response.body", "body": body})
+        finally:
+            for task in (handler, watcher, gone):
+                if not task.done():
+                    task.cancel()
+            _deadline.reset(token)
+
+
+def install_deadlines(app, service: str):
+    """Añadir el middleware de plazos a una app FastAPI (antes que install_fastapi)"""
+    from fastapi.responses import JSONResponse
+
+    app.add_middleware(DeadlineMiddleware, service=service)
+
+    async def deadline_exceeded(request, exc):
+        return JSONResponse(status_code=504, content={"detail": "Plazo de la petición vencido"})
+
+    app.add_exception_handler(DeadlineExceeded, deadline_exceeded)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Lotes de eventos de analytics (POST /api/track/batch)
+Decodifica cuerpos NDJSON o array JSON, opcionalmente comprimidos con gzip,
+y valida cada evento por separado: un evento inválido se rechaza con su
+motivo sin tumbar el resto del lote. Compartido por analytics_system.py y
+simple_analytics_server.py.
+
+Tipos de evento (campo "type"):
+    generation     mismos campos que /api/track/generation
+    interaction    mismos campos que /api/track/interaction
+    session_start  user_id y, opcionalmente, session_id generado por el cliente
+    session_end    session_id
+"""
+
+import os
+import json
+import zlib
+from typing import Any, Dict, List, Tuple
+
+# Configuración
+ANALYTICS_BATCH_MAX_EVENTS = int(os.getenv("ANALYTICS_BATCH_MAX_EVENTS", "1000"))
+# Tope del cuerpo ya descomprimido
+ANALYTICS_BATCH_MAX_BYTES = int(os.getenv("ANALYTICS_BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+_NUMBER = (int, float)
+# campo: (tipos aceptados, obligatorio, valor por defecto)
+EVENT_FIELDS: Dict[str, Dict[str, Tuple[tuple, bool, Any]]] = {
+    "generation": {
+        "session_id": ((str, type(None)), False, None),
+        "user_id": ((str,), True, None),
+        "prompt": ((str,), True, None),
+        "style": ((str,), True, None),
+        "duration": (_NUMBER, True, None),
+        "tempo": ((int,), True, None),
+        "scale": ((str,), True, None),
+        "instruments": ((list,), False, []),
+        "mood": ((str,), True, None),
+        "ai_enhanced": ((bool,), False, False),
+        "generation_time": (_NUMBER, True, None),
+        "success": ((bool,), False, True),
+        "error_message": ((str, type(None)), False, None),
+    },
+    "interaction": {
+        "session_id": ((str,), True, None),
+        "user_id": ((str,), True, None),
+        "action": ((str,), True, None),
+        "element": ((str,), True, None),
+        "value": ((str, type(None)), False, None),
+        "metadata": ((dict,), False, {}),
+    },
+    "session_start": {
+        "user_id": ((str,), True, None),
+        "session_id": ((str, type(None)), False, None),
+    },
+    "session_end": {
+        "session_id": ((str,), True, None),
+    },
+}
+
+
+class BatchError(ValueError):
+    """El lote entero es inválido (status HTTP en ``status``)"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class InvalidEvent:
+    """Línea NDJSON que no es JSON válido: se rechaza sólo ese evento"""
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+def _gunzip(body: bytes, limit: int) -> bytes:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, limit + 1)
+    except zlib.error as e:
+        raise BatchError(f"gzip inválido: {e}")
+    if len(data) > limit or decompressor.unconsumed_tail:
+        raise BatchError(f"lote mayor de {limit} bytes descomprimido", 413)
+    return data
+
+
+def decode_batch(body: bytes, max_events: int = ANALYTICS_BATCH_MAX_EVENTS,
+                 max_bytes: int = ANALYTICS_BATCH_MAX_BYTES) -> List[Any]:
+    """Cuerpo (gzip o no) -> lista de eventos; las líneas rotas quedan como InvalidEvent"""
+    # Por la cabecera mágica y no por Content-Encoding: aiohttp ya descomprime
+    # el cuerpo si el cliente manda la cabecera
+    if body[:2] == GZIP_MAGIC:
+        body = _gunzip(body, max_bytes)
+    elif len(body) > max_bytes:
+        raise BatchError(f"lote mayor de {max_bytes} bytes", 413)
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise BatchError(f"el lote no es UTF-8: {e}")
+
+    if text.lstrip().startswith("["):
+        try:
+            events = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise BatchError(f"array JSON inválido: {e}")
+    else:
+        events = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                events.append(InvalidEvent(f"JSON inválido: {e}"))
+
+    if not events:
+        raise BatchError("lote vacío")
+    if len(events) > max_events:
+        raise BatchError(f"lote de {len(events)} eventos (máximo {max_events})", 413)
+    return events
+
+
+def validate_event(event: Any) -> Tuple[str, Dict[str, Any]]:
+    """Evento -> (tipo, argumentos para el método track_* del collector); ValueError si no vale"""
+    if isinstance(event, InvalidEvent):
+        raise ValueError(event.error)
+    if not isinstance(event, dict):
+        raise ValueError("el evento debe ser un objeto JSON")
+    kind = event.get("type")
+    fields = EVENT_FIELDS.get(kind)
+    if fields is None:
+        raise ValueError(f"type debe ser uno de {', '.join(EVENT_FIELDS)}")
+
+    data = {}
+    for name, (types, required, default) in fields.items():
+        if name not in event or (event[name] is None and type(None) not in types):
+            if required:
+                raise ValueError(f"falta el campo {name}")
+            data[name] = default.copy() if isinstance(default, (list, dict)) else default
+            continue
+        value = event[name]
+        # bool es subclase de int: no aceptarlo como número
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            raise ValueError(f"tipo inválido en {name}")
+        data[name] = value
+    if kind == "generation" and not all(isinstance(i, str) for i in data["instruments"]):
+        raise ValueError("instruments debe ser una lista de textos")
+    return kind, data
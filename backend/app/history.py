@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Historial de generaciones por usuario
+Índice de cobertura (user_id, created_at, id), URLs de audio normalizadas
+en generation_audio y proyección opcional de campos.
+"""
+
+import json
+import sqlite3
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from .storage import SQLiteStorage
+from .tracks import parse_cursor
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Campos que sirve el índice de cobertura; lyrics obliga a leer la tabla
+INDEXED_FIELDS = ("id", "created_at", "status", "style", "prompt")
+HISTORY_FIELDS = INDEXED_FIELDS + ("lyrics", "audio_urls")
+DEFAULT_FIELDS = ("id", "prompt", "style", "status", "created_at", "audio_urls")
+
+
+class InvalidFields(ValueError):
+    """Proyección con campos desconocidos"""
+
+
+def parse_fields(fields: Optional[str]) -> Sequence[str]:
+    """'id,prompt' -> ('id', 'prompt')"""
+    if not fields:
+        return DEFAULT_FIELDS
+    requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in HISTORY_FIELDS]
+    if unknown or not requested:
+        raise InvalidFields(", ".join(unknown))
+    return requested
+
+
+class GenerationHistory:
+    """Consultas paginadas sobre generations"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.db = storage
+
+    def init(self):
+        """Crear índice, tabla hija y migrar audio_urls existentes"""
+        with self.db.transaction() as cursor:
+            cursor.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_generations_user_created
+                ON generations (user_id, created_at DESC, id DESC, {', '.join(INDEXED_FIELDS[2:])})
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS generation_audio (
+                    generation_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    PRIMARY KEY (generation_id, position),
+                    FOREIGN KEY (generation_id) REFERENCES generations (id)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("SELECT 1 FROM generation_audio LIMIT 1")
+            if cursor.fetchone() is None:
+                migrated = 0
+                rows = cursor.execute(
+                    "SELECT id, audio_urls FROM generations WHERE audio_urls IS NOT NULL"
+                ).fetchall()
+                for generation_id, audio_urls in rows:
+                    try:
+                        urls = json.loads(audio_urls)
+                    except (TypeError, ValueError):
+                        continue
+                    if isinstance(urls, list) and urls:
+                        self.record_audio(cursor, generation_id, urls)
+                        migrated += 1
+                if migrated:
+                    logger.info(f"🎧 URLs de audio migradas para {migrated} generaciones")
+
+    @staticmethod
+    def record_audio(cursor: sqlite3.Cursor, generation_id: int, urls: Iterable[str]):
+        """Guardar URLs de audio; llamar en la transacción del INSERT en generations"""
+        cursor.executemany(
+            "INSERT OR REPLACE INTO generation_audio (generation_id, position, url) VALUES (?, ?, ?)",
+            [(generation_id, position, url) for position, url in enumerate(urls) if url]
+        )
+
+    def _audio_urls(self, generation_ids: List[int]) -> Dict[int, List[str]]:
+        if not generation_ids:
+            return {}
+        placeholders = ", ".join("?" * len(generation_ids))
+        rows = self.db.fetchall(f"""
+            SELECT generation_id, url FROM generation_audio
+            WHERE generation_id IN ({placeholders})
+            ORDER BY generation_id, position
+        """, generation_ids)
+        urls: Dict[int, List[str]] = {}
+        for generation_id, url in rows:
+            urls.setdefault(generation_id, []).append(url)
+        return urls
+
+    def page(self, user_id, before: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE,
+             fields: Sequence[str] = DEFAULT_FIELDS) -> Dict[str, Any]:
+        """Página de historial ordenada de más reciente a más antigua"""
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+        # id y created_at siempre se leen para construir el cursor
+        columns = ["id", "created_at"] + [f for f in fields
+                                          if f not in ("id", "created_at", "audio_urls")]
+        select = ", ".join(columns)
+        if before is None:
+            rows = self.db.fetchall(f"""
+                SELECT {select} FROM generations WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            """, (user_id, limit))
+        else:
+            created_at, generation_id = parse_cursor(before)
+            rows = self.db.fetchall(f"""
+                SELECT {select} FROM generations
+                WHERE user_id = ? AND (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            """, (user_id, created_at, generation_id, limit))
+
+        records = [dict(zip(columns, row)) for row in rows]
+        next_cursor = None
+        if len(records) == limit:
+            next_cursor = f"{records[-1]['created_at']},{records[-1]['id']}"
+
+        audio = self._audio_urls([r["id"] for r in records]) if "audio_urls" in fields else {}
+        generations = []
+        for record in records:
+            item = {f: record[f] for f in fields if f != "audio_urls"}
+            if "audio_urls" in fields:
+                item["audio_urls"] = audio.get(record["id"], [])
+            generations.append(item)
+
+        return {"generations": generations, "next_cursor": next_cursor}
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Idempotency-Key para los endpoints de generación
+Un reintento con la misma clave devuelve la respuesta de la primera
+ejecución en lugar de lanzar otro trabajo (y otro cargo de créditos). Las
+claves en curso se bloquean: un duplicado concurrente espera a la ejecución
+original. Las respuestas completadas se guardan comprimidas con zlib en
+SQLite hasta que caduca su TTL.
+"""
+
+import os
+import json
+import time
+import zlib
+import random
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+from .metrics import registry
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Tras este tiempo una ejecución sin terminar (proceso caído) deja de bloquear la clave
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "300"))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+# Cuerpos más pequeños se guardan sin comprimir
+IDEMPOTENCY_COMPRESS_MIN_BYTES = 128
+
+registry.describe("idempotency_requests_total", "counter",
+                  "Peticiones con Idempotency-Key por resultado")
+
+
+def fingerprint(*parts: Any) -> str:
+    """Huella de la petición: la misma clave con otro cuerpo es un error del cliente"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(json.dumps(jsonable_encoder(part), sort_keys=True).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    content_type: str
+    body: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def render(self, replayed: bool = False) -> Response:
+        headers = dict(self.headers)
+        if replayed:
+            headers["Idempotent-Replayed"] = "true"
+        return Response(self.body, status_code=self.status_code,
+                        media_type=self.content_type, headers=headers)
+
+
+def _capture(result: Any) -> StoredResponse:
+    if isinstance(result, Response):
+        return StoredResponse(result.status_code, result.media_type or "application/json",
+                              bytes(result.body))
+    body = json.dumps(jsonable_encoder(result), ensure_ascii=False, separators=(",", ":"))
+    return StoredResponse(200, "application/json", body.encode())
+
+
+def _capture_error(e: HTTPException) -> StoredResponse:
+    body = json.dumps({"detail": e.detail}, ensure_ascii=False).encode()
+    return StoredResponse(e.status_code, "application/json", body, dict(e.headers or {}))
+
+
+def _encode(body: bytes) -> Tuple[str, bytes]:
+    if len(body) < IDEMPOTENCY_COMPRESS_MIN_BYTES:
+        return "identity", body
+    return "zlib", zlib.compress(body, 6)
+
+
+def _decode(encoding: str, body: bytes) -> bytes:
+    return zlib.decompress(body) if encoding == "zlib" else bytes(body)
+
+
+class IdempotencyStore:
+    """Almacén clave -> respuesta con TTL y bloqueo de claves en curso"""
+
+    def __init__(self, storage: SQLiteStorage, ttl: float = IDEMPOTENCY_TTL,
+                 lock_timeout: float = IDEMPOTENCY_LOCK_TIMEOUT):
+        self.db = storage
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        # Ejecuciones en curso en este proceso: clave -> (huella, resultado)
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        # Referencias fuertes a las tareas de ejecución (el loop sólo guarda débiles)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def init(self):
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    status_code INTEGER,
+                    content_type TEXT,
+                    encoding TEXT,
+                    body BLOB,
+                    locked_until REAL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)")
+            cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (time.time(),))
+
+    @staticmethod
+    def _storage_key(scope: str, key: str) -> str:
+        return hashlib.sha256(f"{scope}\0{key}".encode()).hexdigest()
+
+    def _claim(self, storage_key: str, request_fingerprint: str) -> bool:
+        """Reservar la clave para ejecutar (también si caducó o su dueño murió)"""
+        now = time.time()
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO idempotency_keys (key, fingerprint, locked_until, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    fingerprint = excluded.fingerprint, status_code = NULL, content_type = NULL,
+                    encoding = NULL, body = NULL, locked_until = excluded.locked_until,
+                    expires_at = excluded.expires_at
+                WHERE idempotency_keys.expires_at < ?
+                   OR (idempotency_keys.status_code IS NULL AND idempotency_keys.locked_until < ?)
+            """, (storage_key, request_fingerprint, now + self.lock_timeout,
+                  now + self.ttl, now, now))
+            return cursor.rowcount == 1
+
+    def _complete(self, storage_key: str, response: StoredResponse):
+        encoding, body = _encode(response.body)
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE idempotency_keys
+                SET status_code = ?, content_type = ?, encoding = ?, body = ?, locked_until = NULL,
+                    expires_at = ?
+                WHERE key = ?
+            """, (response.status_code, response.content_type, encoding, body,
+                  time.time() + self.ttl, storage_key))
+            # Purga ocasional de claves caducadas
+            if random.random() < 0.01:
+                cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (time.time(),))
+
+    def _release(self, storage_key: str):
+        self.db.execute("DELETE FROM idempotency_keys WHERE key = ? AND status_code IS NULL",
+                        (storage_key,))
+
+    def _check(self, stored_fingerprint: str, request_fingerprint: str):
+        if stored_fingerprint != request_fingerprint:
+            registry.inc("idempotency_requests_total", outcome="mismatch")
+            raise HTTPException(
+                status_code=422,
+                detail=f"{IDEMPOTENCY_HEADER} ya usada con una petición distinta"
+            )
+
+    async def _execute(self, storage_key: str, future: asyncio.Future,
+                       producer: Callable[[], Awaitable[Any]]):
+        try:
+            try:
+                response = _capture(await producer())
+            except HTTPException as e:
+                response = _capture_error(e)
+        except BaseException as e:
+            self._release(storage_key)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+                raise
+            future.set_exception(e)
+            # Evitar el aviso "exception was never retrieved" si nadie esperaba
+            future.exception()
+            return
+        finally:
+            self._inflight.pop(storage_key, None)
+
+        # Los errores del servidor (5xx) no se guardan: el reintento vuelve a ejecutar
+        if response.status_code < 500:
+            self._complete(storage_key, response)
+        else:
+            self._release(storage_key)
+        future.set_result(response)
+
+    async def run(self, scope: str, key: Optional[str], request_fingerprint: str,
+                  producer: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecutar ``producer`` una sola vez por (scope, key).
+
+        ``scope`` identifica endpoint y usuario para que dos clientes no
+        compartan claves. Sin clave se ejecuta directamente. La ejecución no
+        depende de la conexión que la inició: si ese cliente se desconecta,
+        su reintento se engancha a ella.
+        """
+        if not key:
+            return await producer()
+        if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} demasiado larga")
+
+        storage_key = self._storage_key(scope, key)
+        while True:
+            inflight = self._inflight.get(storage_key)
+            if inflight is not None:
+                self._check(inflight[0], request_fingerprint)
+                registry.inc("idempotency_requests_total", outcome="attached")
+                try:
+                    return (await asyncio.shield(inflight[1])).render(replayed=True)
+                except asyncio.CancelledError:
+                    # Si sólo se canceló la ejecución original, reintentar
+                    if inflight[1].cancelled() and not asyncio.current_task().cancelling():
+                        continue
+                    raise
+
+            if self._claim(storage_key, request_fingerprint):
+                break
+
+            row = self.db.fetchone("""
+                SELECT fingerprint, status_code, content_type, encoding, body, locked_until
+                FROM idempotency_keys WHERE key = ?
+            """, (storage_key,))
+            if row is None:
+                continue
+            self._check(row[0], request_fingerprint)
+            if row[1] is not None:
+                registry.inc("idempotency_requests_total", outcome="replayed")
+                return StoredResponse(row[1], row[2], _decode(row[3], row[4])).render(replayed=True)
+            # En curso en otro proceso
+            registry.inc("idempotency_requests_total", outcome="conflict")
+            raise HTTPException(
+                status_code=409,
+                detail="Petición con la misma Idempotency-Key en curso",
+                headers={"Retry-After": str(max(1, int(min(row[5] - time.time(), 30))))}
+            )
+
+        registry.inc("idempotency_requests_total", outcome="executed")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[storage_key] = (request_fingerprint, future)
+        task = asyncio.create_task(self._execute(storage_key, future, producer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return (await asyncio.shield(future)).render()
+
+    async def close(self):
+        """Cancelar las ejecuciones en curso (al apagar); sus claves quedan liberadas"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        row = self.db.fetchone("""
+            SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM idempotency_keys
+            WHERE expires_at > ?
+        """, (time.time(),))
+        return {"keys": row[0], "stored_bytes": row[1], "inflight": len(self._inflight)}
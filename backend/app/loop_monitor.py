@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Monitor del event loop (opcional, LOOP_MONITOR=1)
+Mide continuamente el retraso del event loop y detecta los callbacks que lo
+bloquean más de un umbral (requests.post, sqlite3 o open().write() dentro
+de un async def). Un hilo vigilante captura la pila del hilo del loop
+mientras está bloqueado, así la captura apunta a la llamada culpable.
+Funciona igual con asyncio y con uvloop.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import sysconfig
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR", "0") == "1"
+# Cada cuánto se programa el latido; la duración medida de un bloqueo puede
+# quedarse corta hasta en un intervalo
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+# Un bloqueo mayor que esto cuenta como callback lento
+LOOP_MONITOR_THRESHOLD = float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.1"))
+LOOP_MONITOR_CAPTURES = int(os.getenv("LOOP_MONITOR_CAPTURES", "20"))
+LOOP_MONITOR_STACK_DEPTH = 12
+# Tope de valores distintos de la etiqueta site
+LOOP_MONITOR_MAX_SITES = 50
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_LIBRARY_PATHS = tuple({sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"],
+                        sysconfig.get_paths()["platlib"]})
+
+registry.describe("event_loop_lag_seconds", "histogram",
+                  "Retraso del event loop respecto al latido programado")
+registry.describe("event_loop_slow_callbacks_total", "counter",
+                  "Bloqueos del event loop por encima del umbral, por sitio del código")
+registry.describe("event_loop_slow_callback_seconds", "histogram",
+                  "Duración de los bloqueos del event loop por encima del umbral")
+
+
+def _is_application_frame(filename: str) -> bool:
+    """Código propio (no biblioteca estándar ni paquetes instalados)"""
+    return not filename.startswith(_LIBRARY_PATHS) and filename != __file__
+
+
+def _display_path(filename: str) -> str:
+    if filename.startswith(PROJECT_ROOT + os.sep):
+        return os.path.relpath(filename, PROJECT_ROOT)
+    return filename
+
+
+class LoopMonitor:
+    """Latido en el loop + hilo vigilante que captura la pila si el latido no llega"""
+
+    def __init__(self, service: str, interval: float = LOOP_MONITOR_INTERVAL,
+                 threshold: float = LOOP_MONITOR_THRESHOLD,
+                 max_captures: int = LOOP_MONITOR_CAPTURES):
+        self.service = service
+        self.interval = interval
+        self.threshold = threshold
+        self.captures: deque = deque(maxlen=max_captures)
+        self.slow_callbacks = 0
+        self.max_lag = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._last_beat = 0.0
+        self._pending_stack: Optional[traceback.StackSummary] = None
+        self._sites: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        """Llamar desde el event loop (evento de arranque de la app)"""
+        if self._handle is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name=f"loop-monitor-{self.service}",
+                                          daemon=True)
+        self._watchdog.start()
+        logger.info(f"🩺 Monitor del event loop activo en {self.service} "
+                    f"(umbral {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    def _beat(self):
+        now = time.monotonic()
+        with self._lock:
+            lag = max(0.0, now - self._last_beat - self.interval)
+            stack, self._pending_stack = self._pending_stack, None
+            self._last_beat = now
+        registry.observe("event_loop_lag_seconds", lag, service=self.service)
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.threshold:
+            self._record(lag, stack)
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(poll):
+            with self._lock:
+                stalled = time.monotonic() - self._last_beat - self.interval
+                if stalled < self.threshold or self._pending_stack is not None:
+                    continue
+                # Una captura por bloqueo, tomada mientras el loop sigue parado
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._pending_stack = traceback.extract_stack(frame)
+
+    def _site(self, stack: Optional[traceback.StackSummary]) -> str:
+        if not stack:
+            return "unknown"
+        # El frame propio más interno: la llamada bloqueante hecha desde nuestro código
+        frame = next((f for f in reversed(stack) if _is_application_frame(f.filename)), stack[-1])
+        site = f"{_display_path(frame.filename)}:{frame.lineno} {frame.name}"
+        if site not in self._sites:
+            if len(self._sites) >= LOOP_MONITOR_MAX_SITES:
+                return "other"
+            self._sites.add(site)
+        return site
+
+    def _record(self, duration: float, stack: Optional[traceback.StackSummary]):
+        site = self._site(stack)
+        self.slow_callbacks += 1
+        registry.inc("event_loop_slow_callbacks_total", service=self.service, site=site)
+        registry.observe("event_loop_slow_callback_seconds", duration, service=self.service)
+        frames: List[str] = traceback.format_list(stack[-LOOP_MONITOR_STACK_DEPTH:]) if stack else []
+        self.captures.append({
+            "at": datetime.now().isoformat(),
+            "duration_ms": round(duration * 1000, 1),
+            "site": site,
+            "stack": [line.rstrip() for line in frames],
+        })
+        logger.warning(f"🐢 Event loop de {self.service} bloqueado {duration * 1000:.0f} ms "
+                       f"en {site}\n{''.join(frames)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "service": self.service,
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "slow_callbacks": self.slow_callbacks,
+            "recent": list(self.captures),
+        }
+
+
+def monitor_fastapi(app, service: str) -> Optional[LoopMonitor]:
+    """Arrancar el monitor con la app FastAPI si LOOP_MONITOR=1"""
+    if not LOOP_MONITOR_ENABLED:
+        return None
+    monitor = LoopMonitor(service)
+    app.add_event_handler("startup", monitor.start)
+    app.add_event_handler("shutdown", monitor.stop)
+    return monitor
+
+
+def monitor_aiohttp(app, service: str) -> Optional[LoopMonitor]:
+    """Arrancar el monitor con la aplicación aiohttp si LOOP_MONITOR=1"""
+    if not LOOP_MONITOR_ENABLED:
+        return None
+    monitor = LoopMonitor(service)
+
+    async def start(_app):
+        monitor.start()
+
+    async def stop(_app):
+        monitor.stop()
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    return monitor
@@ -4,27 +4,55 @@ Son1kVers3 - Backend FastAPI Principal
 Sistema completo de generación musical con IA
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List, Dict, Any
-import sqlite3
+import asyncio
 import hashlib
 import jwt
 import os
 import time
-import requests
+import httpx
 import json
 from datetime import datetime, timedelta
 import logging
 
+from .storage import get_storage, close_all_storages
+from .upstream import node_client
+from .queue import GenerationQueue, create_job_store
+from .credits import CreditLedger, InsufficientCredits, UserNotFound
+from .auth_cache import token_cache
+from .tracks import TracksFeed, InvalidCursor, TRACKS_PAGE_SIZE
+from .result_cache import GenerationResultCache
+from .usage import UsageCounters
+from .history import GenerationHistory, InvalidFields, parse_fields, HISTORY_PAGE_SIZE
+from .metrics import install_fastapi, registry
+from .loop_monitor import monitor_fastapi
+from .admission import admission, AdmissionRejected, ADMISSION_QUEUE_TIMEOUT
+from .balancer import NoReadyEndpoint
+from .deadline import DeadlineExceeded, expired, install_deadlines, remaining
+from .idempotency import IdempotencyStore, fingerprint
+from .bootstrap import Bootstrap, CachedSection, SectionPayload, parse_if_none_match, BOOTSTRAP_USAGE_TTL
+
 # Configuración
 SECRET_KEY = os.getenv("SECRET_KEY", "son1k_ultra_secret_key_2024")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./son1k.db")
+DATABASE_PATH = DATABASE_URL[len("sqlite:///"):] if DATABASE_URL.startswith("sqlite:///") else "son1k.db"
+GENERATION_BATCH_MAX = int(os.getenv("GENERATION_BATCH_MAX", "10"))
+
+# Pool de conexiones SQLite compartido
+db = get_storage(DATABASE_PATH)
+credit_ledger = CreditLedger(db)
+tracks_feed = TracksFeed(db)
+result_cache = GenerationResultCache(db)
+usage_counters = UsageCounters(db)
+generation_history = GenerationHistory(db)
+idempotency = IdempotencyStore(db)
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -48,6 +76,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Plazos (X-Request-Deadline) y cancelación si el cliente se desconecta
+install_deadlines(app, service="backend")
+
+# Métricas Prometheus en /metrics
+install_fastapi(app, service="backend")
+
+# Retraso del event loop y llamadas bloqueantes (opcional, LOOP_MONITOR=1)
+loop_monitor = monitor_fastapi(app, service="backend")
+
 # Security
 security = HTTPBearer()
 
@@ -68,6 +105,15 @@ class MusicGenerationRequest(BaseModel):
     style: str = "profesional"
     user_id: Optional[str] = None
 
+class MusicVariant(BaseModel):
+    prompt: str
+    lyrics: Optional[str] = ""
+    style: str = "profesional"
+
+class MusicBatchRequest(BaseModel):
+    variants: List[MusicVariant]
+    user_id: Optional[str] = None
+
 class ChatRequest(BaseModel):
     message: str
     user_id: Optional[str] = None
@@ -81,55 +127,56 @@ class NexusRequest(BaseModel):
 # Base de datos
 def init_database():
     """Inicializar base de datos SQLite"""
-    conn = sqlite3.connect("son1k.db")
-    cursor = conn.cursor()
-    
-    # Tabla de usuarios
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            archetype TEXT DEFAULT 'resistance',
-            plan TEXT DEFAULT 'free',
-            credits INTEGER DEFAULT 10,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )
-    """)
-    
-    # Tabla de generaciones
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS generations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            prompt TEXT NOT NULL,
-            lyrics TEXT,
-            style TEXT,
-            audio_urls TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
+    with db.transaction() as cursor:
+        # Tabla de usuarios
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                archetype TEXT DEFAULT 'resistance',
+                plan TEXT DEFAULT 'free',
+                credits INTEGER DEFAULT 10,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_login TIMESTAMP
+            )
+        """)
     
-    # Tabla de tracks
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tracks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            artist TEXT,
-            audio_url TEXT NOT NULL,
-            duration INTEGER,
-            genre TEXT,
-            mood TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+        # Tabla de generaciones
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS generations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                prompt TEXT NOT NULL,
+                lyrics TEXT,
+                style TEXT,
+                audio_urls TEXT,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        """)
     
-    conn.commit()
-    conn.close()
+        # Tabla de tracks
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                artist TEXT,
+                audio_url TEXT NOT NULL,
+                duration INTEGER,
+                genre TEXT,
+                mood TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    credit_ledger.init()
+    tracks_feed.init()
+    result_cache.init()
+    usage_counters.init()
+    generation_history.init()
+    idempotency.init()
     logger.info("✅ Base de datos inicializada")
 
 # Utilidades
@@ -149,15 +196,21 @@ def create_access_token(data: dict) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Verificar token JWT"""
+    """Verificar token JWT (con caché de tokens ya verificados)"""
+    token = credentials.credentials
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+    
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token inválido"
         )
+    token_cache.put(token, payload)
+    return payload
 
 # Endpoints principales
 @app.get("/")
@@ -172,6 +225,8 @@ async def root():
             "docs": "/docs",
             "auth": "/api/auth",
             "music": "/api/generate-music",
+            "jobs": "/api/jobs/{job_id}",
+            "bootstrap": "/api/bootstrap",
             "nexus": "/api/nexus"
         }
     }
@@ -186,28 +241,50 @@ async def health_check():
         "version": "3.0.0"
     }
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Métricas internas de cachés"""
+    return {
+        "auth_cache": token_cache.stats(),
+        "generation_cache": result_cache.stats(),
+        "admission": admission.stats(),
+        "node_pool": node_client.balancer.stats(),
+        "idempotency": idempotency.stats(),
+        "event_loop": loop_monitor.stats() if loop_monitor else None,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def cache_metrics():
+    """Exportar contadores de las cachés en /metrics"""
+    for cache, stats in (("auth", token_cache.stats()), ("generation", result_cache.stats())):
+        labels = {"cache": cache}
+        yield "cache_hits_total", "counter", "Aciertos de caché", labels, stats["hits"]
+        yield "cache_misses_total", "counter", "Fallos de caché", labels, stats["misses"]
+        yield "cache_evictions_total", "counter", "Entradas desalojadas", labels, stats["evictions"]
+        yield "cache_entries", "gauge", "Entradas en caché", labels, stats["size"]
+    yield ("cache_coalesced_total", "counter", "Peticiones unidas a una generación en curso",
+           {"cache": "generation"}, result_cache.stats()["coalesced"])
+
+registry.add_collector(cache_metrics)
+
 # Autenticación
 @app.post("/api/auth/register")
 async def register_user(user: UserCreate):
     """Registrar nuevo usuario"""
-    conn = sqlite3.connect("son1k.db")
-    cursor = conn.cursor()
-    
     try:
-        # Verificar si el usuario ya existe
-        cursor.execute("SELECT id FROM users WHERE email = ?", (user.email,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="Email ya registrado")
-        
-        # Crear usuario
-        password_hash = hash_password(user.password)
-        cursor.execute("""
-            INSERT INTO users (username, email, password_hash, archetype)
-            VALUES (?, ?, ?, ?)
-        """, (user.username, user.email, password_hash, user.archetype))
-        
-        conn.commit()
-        user_id = cursor.lastrowid
+        with db.transaction() as cursor:
+            # Verificar si el usuario ya existe
+            cursor.execute("SELECT id FROM users WHERE email = ?", (user.email,))
+            if cursor.fetchone():
+                raise HTTPException(status_code=400, detail="Email ya registrado")
+            
+            # Crear usuario
+            password_hash = hash_password(user.password)
+            cursor.execute("""
+                INSERT INTO users (username, email, password_hash, archetype)
+                VALUES (?, ?, ?, ?)
+            """, (user.username, user.email, password_hash, user.archetype))
+            user_id = cursor.lastrowid
         
         # Crear token
         token = create_access_token({"user_id": user_id, "email": user.email})
@@ -227,25 +304,18 @@ async def register_user(user: UserCreate):
         }
         
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/api/auth/login")
 async def login_user(user: UserLogin):
     """Iniciar sesión"""
-    conn = sqlite3.connect("son1k.db")
-    cursor = conn.cursor()
-    
     try:
         # Buscar usuario
-        cursor.execute("""
+        user_data = db.fetchone("""
             SELECT id, username, email, password_hash, archetype, plan, credits
             FROM users WHERE email = ?
         """, (user.email,))
         
-        user_data = cursor.fetchone()
         if not user_data:
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
         
@@ -256,8 +326,7 @@ async def login_user(user: UserLogin):
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
         
         # Actualizar último login
-        cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user_id,))
-        conn.commit()
+        db.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user_id,))
         
         # Crear token
         token = create_access_token({"user_id": user_id, "email": email})
@@ -280,102 +349,265 @@ async def login_user(user: UserLogin):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 # Generación musical
-@app.post("/api/generate-music")
-async def generate_music(request: MusicGenerationRequest):
-    """Generar música con IA"""
+def resolve_plan(user_id) -> Optional[str]:
+    """Plan del usuario desde el snapshot de créditos (None si es anónimo)"""
+    if not user_id:
+        return None
+    balance = credit_ledger.balance(user_id)
+    return balance[1] if balance else None
+
+async def call_generation_upstream(request: MusicGenerationRequest, plan: Optional[str] = None,
+                                   user_id=None,
+                                   queue_timeout: Optional[float] = ADMISSION_QUEUE_TIMEOUT) -> dict:
+    """Llamar al servidor Node.js (cliente compartido, no bloquea el event loop)"""
+    # No esperar turno más allá del plazo del cliente
+    queue_timeout = remaining(queue_timeout)
     try:
-        # Llamar al servidor Node.js
-        node_server_url = os.getenv("NODE_SERVER_URL", "http://localhost:3001")
-        
-        response = requests.post(
-            f"{node_server_url}/generate-music",
-            json={
+        async with admission.slot(plan, user_id, timeout=queue_timeout):
+            response = await node_client.post_json("/generate-music", {
                 "prompt": request.prompt,
                 "lyrics": request.lyrics,
                 "style": request.style
-            },
-            timeout=120
+            })
+    except AdmissionRejected as e:
+        if expired():
+            raise DeadlineExceeded("Plazo de la petición vencido en la cola") from e
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio de generación saturado, inténtalo más tarde",
+            headers={"Retry-After": str(int(e.retry_after))}
         )
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Guardar en base de datos si hay user_id
-            if request.user_id:
-                conn = sqlite3.connect("son1k.db")
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO generations (user_id, prompt, lyrics, style, audio_urls, status)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    request.user_id,
-                    request.prompt,
-                    request.lyrics,
-                    request.style,
-                    json.dumps(data.get("audioUrls", [])),
-                    "completed"
-                ))
-                conn.commit()
-                conn.close()
-            
-            return data
-        else:
-            raise HTTPException(status_code=500, detail="Error en generación musical")
-            
-    except requests.exceptions.RequestException as e:
+    except NoReadyEndpoint as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio de generación no disponible",
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Error en generación musical")
+    return response.json()
+
+async def generate_result(request: MusicGenerationRequest, plan: Optional[str] = None,
+                          user_id=None,
+                          queue_timeout: Optional[float] = ADMISSION_QUEUE_TIMEOUT) -> dict:
+    """Generar (o reutilizar de caché) sin registrar nada en la base de datos"""
+    try:
+        return await result_cache.get_or_generate(
+            request.prompt, request.lyrics, request.style,
+            lambda: call_generation_upstream(request, plan, user_id, queue_timeout),
+            cacheable=lambda result: result.get("success", True) is not False
+        )
+    except (HTTPException, DeadlineExceeded):
+        raise
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Error de conexión: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def record_generations(user_id, generations: List[tuple]):
+    """Guardar generaciones (request, resultado) y los contadores de uso en una sola transacción"""
+    with db.transaction() as cursor:
+        for request, data in generations:
+            cursor.execute("""
+                INSERT INTO generations (user_id, prompt, lyrics, style, audio_urls, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                user_id,
+                request.prompt,
+                request.lyrics,
+                request.style,
+                json.dumps(data.get("audioUrls", [])),
+                "completed"
+            ))
+            generation_history.record_audio(cursor, cursor.lastrowid, data.get("audioUrls", []))
+        usage_counters.record_generation(cursor, user_id, count=len(generations))
+    usage_section.invalidate(str(user_id))
+
+async def run_generation(request: MusicGenerationRequest, plan: Optional[str] = None,
+                         user_id=None,
+                         queue_timeout: Optional[float] = ADMISSION_QUEUE_TIMEOUT) -> dict:
+    """Generar (o reutilizar de caché) y registrar la generación"""
+    if user_id is None:
+        user_id = request.user_id
+    if plan is None:
+        plan = resolve_plan(user_id)
+    data = await generate_result(request, plan, user_id, queue_timeout)
+    
+    # Guardar en base de datos si hay user_id (junto con los contadores de uso)
+    if user_id:
+        record_generations(user_id, [(request, data)])
+    
+    return data
+
+async def run_generation_job(payload: dict) -> dict:
+    """Ejecutar un trabajo de la cola de generación (espera turno sin límite)"""
+    return await run_generation(MusicGenerationRequest(**payload), queue_timeout=None)
+
+job_queue = GenerationQueue(create_job_store(db), handler=run_generation_job)
+
+@app.post("/api/generate-music")
+async def generate_music(request: MusicGenerationRequest, mode: str = "sync",
+                         idempotency_key: Optional[str] = Header(None)):
+    """Generar música con IA (mode=async devuelve un trabajo en cola)"""
+    async def produce():
+        if mode == "async":
+            job = await job_queue.submit(request.model_dump(), user_id=request.user_id)
+            return JSONResponse(status_code=202, content={
+                "success": True,
+                "job_id": job["id"],
+                "status": job["status"],
+                "status_url": f"/api/jobs/{job['id']}",
+                "events_url": f"/api/jobs/{job['id']}/events"
+            })
+        
+        return await run_generation(request)
+    
+    # Un reintento con la misma Idempotency-Key devuelve la respuesta original
+    return await idempotency.run(f"generate-music:{request.user_id or ''}", idempotency_key,
+                                 fingerprint(request, mode), produce)
+
+@app.post("/api/generate-music/batch")
+async def generate_music_batch(batch: MusicBatchRequest):
+    """
+    Generar varias variantes (prompt/estilo) a la vez. Cada resultado se envía
+    como una línea NDJSON en cuanto termina; al final se registran todas las
+    generaciones en una sola transacción y se envía una línea de resumen.
+    """
+    if not batch.variants:
+        raise HTTPException(status_code=400, detail="El lote no tiene variantes")
+    if len(batch.variants) > GENERATION_BATCH_MAX:
+        raise HTTPException(status_code=400,
+                            detail=f"Máximo {GENERATION_BATCH_MAX} variantes por lote")
+    
+    user_id = batch.user_id
+    plan = resolve_plan(user_id)
+    requests = [MusicGenerationRequest(**variant.model_dump(), user_id=user_id)
+                for variant in batch.variants]
+    # Sólo tantas variantes en vuelo como permite la admisión por usuario: el resto
+    # espera aquí y no agota el timeout de la cola de admisión
+    budget = asyncio.Semaphore(admission.per_user)
+    
+    async def generate(index: int, request: MusicGenerationRequest):
+        async with budget:
+            try:
+                return index, await generate_result(request, plan, user_id), None
+            except HTTPException as e:
+                return index, None, e
+            except DeadlineExceeded:
+                return index, None, HTTPException(status_code=504, detail="Plazo de la petición vencido")
+    
+    async def stream():
+        tasks = [asyncio.ensure_future(generate(i, r)) for i, r in enumerate(requests)]
+        completed = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, data, error = await next_done
+                if error is None:
+                    completed.append((requests[index], data))
+                    line = {"index": index, "status": 200, "result": data}
+                else:
+                    line = {"index": index, "status": error.status_code, "error": error.detail}
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+            
+            if user_id and completed:
+                record_generations(user_id, completed)
+            yield json.dumps({
+                "done": True,
+                "completed": len(completed),
+                "failed": len(requests) - len(completed)
+            }) + "\n"
+        finally:
+            # Cliente desconectado: no seguir generando variantes que nadie leerá
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Consultar el estado de un trabajo de generación"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Seguir el progreso de un trabajo por Server-Sent Events"""
+    return StreamingResponse(
+        job_queue.events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/generate-with-credits")
-async def generate_with_credits(request: MusicGenerationRequest, token_data: dict = Depends(verify_token)):
-    """Generar música con sistema de créditos"""
+async def generate_with_credits(request: MusicGenerationRequest, token_data: dict = Depends(verify_token),
+                                idempotency_key: Optional[str] = Header(None)):
+    """Generar música con sistema de créditos (un solo cargo por Idempotency-Key)"""
     user_id = token_data.get("user_id")
     
     if not user_id:
         raise HTTPException(status_code=401, detail="Usuario no autenticado")
     
-    conn = sqlite3.connect("son1k.db")
-    cursor = conn.cursor()
+    async def produce():
+        try:
+            # Reservar crédito antes de llamar al upstream (UPDATE condicional atómico)
+            try:
+                reservation = credit_ledger.reserve(user_id)
+            except UserNotFound:
+                raise HTTPException(status_code=404, detail="Usuario no encontrado")
+            except InsufficientCredits:
+                raise HTTPException(status_code=400, detail="Créditos insuficientes")
+            
+            # Generar música sin transacción abierta; devolver el crédito si falla
+            try:
+                music_response = await run_generation(request, plan=reservation.plan, user_id=user_id)
+            except BaseException as e:
+                credit_ledger.refund(reservation, reason=getattr(e, "detail", None) or type(e).__name__)
+                raise
+            credit_ledger.commit(reservation)
+            usage_section.invalidate(str(user_id))
+            
+            return {
+                **music_response,
+                "credits_remaining": reservation.credits_remaining,
+                "plan": reservation.plan
+            }
+            
+        except (HTTPException, DeadlineExceeded):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    return await idempotency.run(f"generate-with-credits:{user_id}", idempotency_key,
+                                 fingerprint(request), produce)
+
+@app.get("/api/generations")
+async def get_generations(
+    before: Optional[str] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+    fields: Optional[str] = None,
+    token_data: dict = Depends(verify_token)
+):
+    """Historial de generaciones del usuario (cursor ?before=<created_at,id>, ?fields=id,prompt)"""
+    user_id = token_data.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Usuario no autenticado")
     
     try:
-        # Verificar créditos
-        cursor.execute("SELECT credits, plan FROM users WHERE id = ?", (user_id,))
-        user_data = cursor.fetchone()
-        
-        if not user_data:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
-        credits, plan = user_data
-        
-        # Verificar si tiene créditos suficientes
-        if plan == "free" and credits <= 0:
-            raise HTTPException(status_code=400, detail="Créditos insuficientes")
-        
-        # Generar música
-        music_response = await generate_music(request)
-        
-        # Descontar crédito si es plan free
-        if plan == "free":
-            cursor.execute("UPDATE users SET credits = credits - 1 WHERE id = ?", (user_id,))
-            conn.commit()
-        
-        return {
-            **music_response,
-            "credits_remaining": credits - 1 if plan == "free" else "unlimited",
-            "plan": plan
-        }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+        return generation_history.page(user_id, before, limit, parse_fields(fields))
+    except InvalidFields as e:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {e}")
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
 # Sistema NEXUS
 @app.post("/api/nexus/chat")
@@ -662,40 +894,27 @@ async def chat_with_ai(request: ChatRequest):
 
 # Otros endpoints
 @app.get("/api/tracks")
-async def get_tracks():
-    """Obtener tracks disponibles"""
-    conn = sqlite3.connect("son1k.db")
-    cursor = conn.cursor()
+async def get_tracks(request: Request, before: Optional[str] = None, limit: int = TRACKS_PAGE_SIZE):
+    """Obtener tracks disponibles (cursor ?before=<created_at,id>)"""
+    if_none_match = request.headers.get("if-none-match")
     
-    cursor.execute("""
-        SELECT id, title, artist, audio_url, duration, genre, mood, created_at
-        FROM tracks ORDER BY created_at DESC LIMIT 50
-    """)
+    # Primera página: comparar con el snapshot en memoria, sin consultar SQLite
+    if before is None and if_none_match and if_none_match == tracks_feed.snapshot_etag():
+        return Response(status_code=304, headers={"ETag": if_none_match})
     
-    tracks = []
-    for row in cursor.fetchall():
-        tracks.append({
-            "id": row[0],
-            "title": row[1],
-            "artist": row[2],
-            "audio_url": row[3],
-            "duration": row[4],
-            "genre": row[5],
-            "mood": row[6],
-            "created_at": row[7]
-        })
-    
-    conn.close()
-    return {"tracks": tracks}
-
-@app.get("/api/user/usage")
-async def get_user_usage(user_id: str, user_tier: str = "free"):
-    """Obtener uso del usuario"""
-    conn = sqlite3.connect("son1k.db")
-    cursor = conn.cursor()
+    try:
+        body, etag = tracks_feed.page(before, limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
     
-    cursor.execute("SELECT credits, plan FROM users WHERE id = ?", (user_id,))
-    user_data = cursor.fetchone()
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def user_usage(user_id: str) -> dict:
+    """Créditos, plan y contadores de uso del usuario"""
+    user_data = credit_ledger.balance(user_id)
     
     if not user_data:
         return {"credits": 0, "plan": "free", "unlimited": False}
@@ -706,16 +925,64 @@ async def get_user_usage(user_id: str, user_tier: str = "free"):
         "credits": credits,
         "plan": plan,
         "unlimited": plan in ["admin", "enterprise"],
-        "generations_remaining": credits if plan == "free" else "unlimited"
+        "generations_remaining": credits if plan == "free" else "unlimited",
+        "usage": usage_counters.get(user_id)
     }
 
+@app.get("/api/user/usage")
+async def get_user_usage(user_id: str, user_tier: str = "free"):
+    """Obtener uso del usuario"""
+    return user_usage(user_id)
+
+# Arranque del frontend: todo lo que pide la página al cargar en un solo viaje
+usage_section = CachedSection("usage", user_usage, ttl=BOOTSTRAP_USAGE_TTL, per_user=True)
+
+async def tracks_section() -> SectionPayload:
+    """Primera página de tracks desde el snapshot de TracksFeed (SQLite sólo si caducó)"""
+    if tracks_feed.snapshot_etag() is None:
+        return SectionPayload(*await asyncio.to_thread(tracks_feed.snapshot))
+    return SectionPayload(*tracks_feed.snapshot())
+
+bootstrap = Bootstrap()
+bootstrap.add_cached(CachedSection("health", health_check))
+bootstrap.add_cached(usage_section)
+bootstrap.add("tracks", tracks_section)
+bootstrap.add_cached(CachedSection("nexus", nexus_status))
+bootstrap.add_cached(CachedSection("resistance", resistance_status))
+
+@app.get("/api/bootstrap")
+async def get_bootstrap(request: Request, user_id: Optional[str] = None):
+    """
+    Salud, uso (con ?user_id=), tracks y estados de NEXUS/Resistencia en una
+    respuesta. Cada sección lleva su ETag y su antigüedad en segundos; si el
+    cliente las manda en If-None-Match, las que no cambiaron van sin datos.
+    """
+    sections = await bootstrap.collect(user_id)
+    etag = Bootstrap.combined_etag(sections)
+    known = parse_if_none_match(request.headers.get("if-none-match"))
+    if etag in known:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=Bootstrap.render(sections, known), media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "no-cache"})
+
 # Inicializar base de datos al startup
 @app.on_event("startup")
 async def startup_event():
     """Evento de inicio"""
     init_database()
+    await node_client.start()
+    await job_queue.start()
     logger.info("🚀 Son1kVers3 API iniciada")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Evento de cierre"""
+    await job_queue.stop()
+    await idempotency.close()
+    await node_client.close()
+    close_all_storages()
+    logger.info("🛑 Son1kVers3 API detenida")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Métricas de latencia compartidas por todos los servicios
+Histogramas log-lineales estilo HDR, gauges de peticiones en curso,
+tiempos de upstream y de SQLite, y exposición en formato Prometheus.
+"""
+
+import os
+import time
+import asyncio
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Configuración
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_PREFIX = "son1k_"
+# Rango cubierto por los buckets: 100 µs - ~2 min
+HISTOGRAM_MIN_SECONDS = 0.0001
+HISTOGRAM_MAX_SECONDS = 120.0
+# Sub-buckets lineales por cada potencia de dos (error relativo <= 25%)
+HISTOGRAM_SUB_BUCKETS = 4
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def hdr_buckets(low: float = HISTOGRAM_MIN_SECONDS, high: float = HISTOGRAM_MAX_SECONDS,
+                sub_buckets: int = HISTOGRAM_SUB_BUCKETS) -> List[float]:
+    """Límites superiores: cada octava [2^k, 2^(k+1)) dividida en partes iguales"""
+    bounds = []
+    octave = low
+    while octave < high:
+        for i in range(sub_buckets):
+            bounds.append(round(octave * (1 + i / sub_buckets), 9))
+        octave *= 2
+    bounds.append(round(octave, 9))
+    return bounds
+
+
+DEFAULT_BUCKETS = hdr_buckets()
+
+
+class Histogram:
+    """Histograma acumulativo con límites fijos"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: List[float] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # La última posición es +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Cuantil aproximado (límite superior del bucket)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+
+def _labels(labels: Dict[str, Any]) -> LabelSet:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [
+        k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels
+    ]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """Contadores, gauges e histogramas etiquetados de un proceso"""
+
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[LabelSet, float]] = {}
+        self._gauges: Dict[str, Dict[LabelSet, float]] = {}
+        self._histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def gauge_add(self, name: str, delta: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + delta
+
+    def gauge_set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self._histograms.get(name, {}).get(_labels(labels))
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]):
+        """Registrar una función que devuelve (nombre, tipo, ayuda, labels, valor) al exportar"""
+        self._collectors.append(collector)
+
+    def _header(self, lines: List[str], name: str, kind: str, help_text: Optional[str] = None):
+        if help_text is None:
+            kind, help_text = self._help.get(name, (kind, name))
+        full = self.prefix + name
+        lines.append(f"# HELP {full} {help_text}")
+        lines.append(f"# TYPE {full} {kind}")
+
+    def render(self) -> str:
+        """Texto en formato de exposición de Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            gauges = {n: dict(s) for n, s in self._gauges.items()}
+            histograms = {
+                n: {k: (list(h.counts), h.sum, h.count, h.bounds) for k, h in s.items()}
+                for n, s in self._histograms.items()
+            }
+
+        for kind, families in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(families):
+                self._header(lines, name, kind)
+                for labels, value in sorted(families[name].items()):
+                    lines.append(f"{self.prefix}{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name in sorted(histograms):
+            self._header(lines, name, "histogram")
+            full = self.prefix + name
+            for labels, (counts, total, count, bounds) in sorted(histograms[name].items()):
+                cumulative = 0
+                # Todos los límites en cada serie para poder agregar con sum by (le)
+                for bound, n in zip(bounds + [float("inf")], counts):
+                    cumulative += n
+                    le = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{full}_bucket{_format_labels(le)} {cumulative}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{full}_count{_format_labels(labels)} {count}")
+
+        # Las muestras de una misma familia deben ir juntas
+        collected: Dict[str, Tuple[str, str, List[str]]] = {}
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                continue
+            for name, kind, help_text, labels, value in samples:
+                family = collected.setdefault(name, (kind, help_text, []))
+                family[2].append(f"{self.prefix}{name}{_format_labels(_labels(labels))} {_format_value(value)}")
+        for name, (kind, help_text, samples) in collected.items():
+            self._header(lines, name, kind, help_text)
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("http_request_duration_seconds", "histogram",
+                  "Latencia de peticiones HTTP por plantilla de ruta")
+registry.describe("http_requests_total", "counter", "Peticiones HTTP completadas")
+registry.describe("http_requests_in_flight", "gauge", "Peticiones HTTP en curso")
+registry.describe("upstream_request_duration_seconds", "histogram",
+                  "Latencia de llamadas a servicios externos (Node, Ollama, Hugging Face...)")
+registry.describe("sqlite_query_duration_seconds", "histogram", "Duración de operaciones SQLite")
+
+
+# ------------------------------------------------------------------
+# Medición de upstream y SQLite
+# ------------------------------------------------------------------
+
+@contextmanager
+def time_upstream(upstream: str) -> Iterator[None]:
+    """Medir una llamada a un servicio externo (válido también con await dentro)"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        registry.observe("upstream_request_duration_seconds", time.perf_counter() - start,
+                         upstream=upstream, outcome=outcome)
+
+
+def observe_sqlite(database: str, operation: str, seconds: float):
+    if METRICS_ENABLED:
+        registry.observe("sqlite_query_duration_seconds", seconds,
+                         database=database, operation=operation)
+
+
+def timed_sqlite(operation: str):
+    """Decorador para métodos de clases con atributo db_path"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                observe_sqlite(os.path.basename(self.db_path), operation, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# ------------------------------------------------------------------
+# Peticiones HTTP
+# ------------------------------------------------------------------
+
+def observe_request(service: str, method: str, route: str, status: int, seconds: float):
+    registry.observe("http_request_duration_seconds", seconds,
+                     service=service, method=method, route=route)
+    registry.inc("http_requests_total", service=service, method=method, route=route, status=status)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI puro: latencia por plantilla de ruta y peticiones en curso"""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        registry.gauge_add("http_requests_in_flight", 1, service=self.service)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            registry.gauge_add("http_requests_in_flight", -1, service=self.service)
+            # El router de Starlette deja la ruta resuelta en el scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            observe_request(self.service, scope["method"], route, status,
+                            time.perf_counter() - start)
+
+
+def install_fastapi(app, service: str, path: str = "/metrics"):
+    """Añadir el middleware y el endpoint /metrics a una app FastAPI"""
+    from fastapi import Response
+
+    app.add_middleware(MetricsMiddleware, service=service)
+
+    def metrics():
+        return Response(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    app.add_api_route(path, metrics, methods=["GET"], include_in_schema=False)
+
+
+def install_aiohttp(app, service: str, path: str = "/metrics"):
+    """Añadir el middleware y el endpoint /metrics a una aplicación aiohttp"""
+    from aiohttp import web
+
+    @web.middleware
+    async def metrics_middleware(request, handler):
+        if not METRICS_ENABLED:
+            return await handler(request)
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        status = 500
+        registry.gauge_add("http_requests_in_flight", 1, service=service)
+        start = time.perf_counter()
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            registry.gauge_add("http_requests_in_flight", -1, service=service)
+            observe_request(service, request.method, route, status, time.perf_counter() - start)
+
+    async def metrics(request):
+        return web.Response(body=registry.render().encode(),
+                            headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+    app.middlewares.append(metrics_middleware)
+    app.router.add_get(path, metrics)
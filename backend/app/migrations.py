@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Migraciones de esquema versionadas
+La versión aplicada se guarda en PRAGMA user_version; si la base de datos
+ya está al día el arranque sólo lee ese entero y no ejecuta DDL. Cada
+migración pendiente se aplica en su propia transacción junto con el cambio
+de versión, así que un fallo a mitad no deja el esquema a medias.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from dataclasses import dataclass
+from typing import Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+MIGRATIONS_BUSY_TIMEOUT = float(os.getenv("MIGRATIONS_BUSY_TIMEOUT", "30"))
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(path: str, migrations: Sequence[Migration]) -> int:
+    """Aplicar las migraciones pendientes y devolver la versión final"""
+    name = os.path.basename(path)
+    target = max((m.version for m in migrations), default=0)
+    conn = sqlite3.connect(path, timeout=MIGRATIONS_BUSY_TIMEOUT, isolation_level=None)
+    try:
+        current = schema_version(conn)
+        if current >= target:
+            return current
+
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version <= current:
+                continue
+            start = time.perf_counter()
+            # IMMEDIATE: otro proceso que arranque a la vez espera y luego ve la versión nueva
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if schema_version(conn) >= migration.version:
+                    conn.execute("ROLLBACK")
+                    continue
+                for statement in migration.statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            logger.info(f"🗄️ {name} migrada a la versión {migration.version}: "
+                        f"{migration.description} ({time.perf_counter() - start:.2f}s)")
+        return schema_version(conn)
+    finally:
+        conn.close()
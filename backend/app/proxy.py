@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Proxy inverso en streaming
+Reenvía peticiones a un proceso hijo (Node.js o uvicorn) pasando cuerpos y
+cabeceras como bytes, sin re-parsear JSON, sobre conexiones keep-alive. Con
+un balanceador, cada petición va a la instancia con menos peticiones en curso.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import aiohttp
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from .balancer import LeastOutstandingBalancer
+from .circuit import CircuitBreaker
+from .deadline import DeadlineExceeded, expired, remaining
+from .metrics import time_upstream
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+PROXY_CONNECT_TIMEOUT = float(os.getenv("PROXY_CONNECT_TIMEOUT", "2"))
+PROXY_READ_TIMEOUT = float(os.getenv("PROXY_READ_TIMEOUT", "120"))
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", "64"))
+PROXY_KEEPALIVE_TIMEOUT = float(os.getenv("PROXY_KEEPALIVE_TIMEOUT", "30"))
+
+# Cabeceras de un solo salto (RFC 7230 §6.1) que no se reenvían
+HOP_BY_HOP = frozenset({
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"trailers", b"transfer-encoding", b"upgrade",
+})
+
+
+def _filter_headers(raw: List[Tuple[bytes, bytes]], drop=frozenset()) -> List[Tuple[bytes, bytes]]:
+    return [(k, v) for k, v in raw if k.lower() not in HOP_BY_HOP and k.lower() not in drop]
+
+
+class UpstreamError(Exception):
+    """El upstream no respondió (conexión rechazada, timeout...)"""
+
+    def __init__(self, name: str, cause: Exception):
+        super().__init__(f"{name}: {cause or type(cause).__name__}")
+        self.name = name
+
+
+class _UpstreamResponse(StreamingResponse):
+    """Respuesta en streaming que libera el upstream aunque el envío se cancele"""
+
+    def __init__(self, content, status_code: int, on_close: Callable[[], None]):
+        super().__init__(content, status_code=status_code)
+        self._on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._on_close()
+
+
+class StreamingProxy:
+    """Proxy hacia un upstream (o un pool balanceado) con conexiones persistentes"""
+
+    def __init__(self, name: str, base_url: Optional[str] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 read_timeout: float = PROXY_READ_TIMEOUT,
+                 balancer: Optional[LeastOutstandingBalancer] = None):
+        self.name = name
+        # Con balanceador las URLs son absolutas y cambian en cada petición
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.breaker = breaker
+        self.balancer = balancer
+        self.read_timeout = read_timeout
+        self._client: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def client(self) -> aiohttp.ClientSession:
+        # Se crea dentro del event loop que sirve las peticiones
+        if self._client is None or self._client.closed:
+            self._client = aiohttp.ClientSession(
+                base_url=self.base_url,
+                connector=aiohttp.TCPConnector(limit=PROXY_MAX_CONNECTIONS,
+                                               keepalive_timeout=PROXY_KEEPALIVE_TIMEOUT),
+                timeout=aiohttp.ClientTimeout(sock_connect=PROXY_CONNECT_TIMEOUT,
+                                              sock_read=self.read_timeout),
+                # Los cuerpos comprimidos se pasan tal cual
+                auto_decompress=False,
+                skip_auto_headers=("User-Agent", "Accept-Encoding"),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def _request_headers(self, request: Request) -> List[Tuple[str, str]]:
+        headers = [(k.decode("latin-1"), v.decode("latin-1"))
+                   for k, v in _filter_headers(request.headers.raw, drop={b"host"})]
+        client_ip = request.client.host if request.client else ""
+        forwarded_for = request.headers.get("x-forwarded-for")
+        headers.append(("X-Forwarded-For", f"{forwarded_for}, {client_ip}" if forwarded_for else client_ip))
+        headers.append(("X-Forwarded-Proto", request.url.scheme))
+        if "host" in request.headers:
+            headers.append(("X-Forwarded-Host", request.headers["host"]))
+        return headers
+
+    async def forward(self, request: Request, path: Optional[str] = None) -> StreamingResponse:
+        """
+        Reenviar la petición y devolver la respuesta en streaming.
+
+        Lanza CircuitOpen si el circuito está abierto (o NoReadyEndpoint si
+        no hay ninguna instancia lista), UpstreamError si el upstream no
+        responde y DeadlineExceeded si vence el plazo de X-Request-Deadline.
+        """
+        if self.breaker is not None:
+            self.breaker.allow()
+
+        has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+        target = path or request.url.path
+        if request.url.query:
+            target = f"{target}?{request.url.query}"
+        attempts = len(self.balancer.endpoints) if self.balancer is not None else 1
+        for attempt in range(attempts):
+            try:
+                timeout = aiohttp.ClientTimeout(sock_connect=PROXY_CONNECT_TIMEOUT,
+                                                sock_read=remaining(self.read_timeout))
+                endpoint = self.balancer.acquire() if self.balancer is not None else None
+            except BaseException:
+                # Plazo vencido o NoReadyEndpoint: liberar la prueba de un circuito semiabierto
+                if self.breaker is not None:
+                    self.breaker.abandon()
+                raise
+            try:
+                with time_upstream(self.name):
+                    upstream_response = await self.client.request(
+                        request.method, endpoint.url + target if endpoint is not None else target,
+                        headers=self._request_headers(request),
+                        data=request.stream() if has_body else None,
+                        allow_redirects=False,
+                        timeout=timeout,
+                    )
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                if endpoint is not None:
+                    self.balancer.release(endpoint)
+                    if isinstance(e, aiohttp.ClientConnectorError):
+                        # Proceso caído o reiniciándose: fuera del reparto hasta que responda
+                        # /health. El cuerpo aún no se ha leído, así que se prueba otra instancia
+                        self.balancer.mark_down(endpoint)
+                        if attempt < attempts - 1 and self.balancer.ready_endpoints():
+                            continue
+                if isinstance(e, asyncio.TimeoutError) and expired():
+                    raise DeadlineExceeded("Plazo de la petición vencido") from e
+                raise UpstreamError(self.name, e) from e
+            except BaseException:
+                if self.breaker is not None:
+                    self.breaker.abandon()
+                if endpoint is not None:
+                    self.balancer.release(endpoint)
+                raise
+
+        if self.breaker is not None:
+            # Cualquier respuesta HTTP prueba que el upstream está vivo: sus 5xx
+            # (503 de admisión, 504 de plazo, 500 de generación) no abren el circuito
+            self.breaker.record_success()
+
+        def finish():
+            upstream_response.release()
+            if endpoint is not None:
+                # La petición cuenta como en curso hasta terminar de enviar el cuerpo
+                self.balancer.release(endpoint)
+
+        response = _UpstreamResponse(upstream_response.content.iter_any(),
+                                     upstream_response.status, finish)
+        # Conservar cabeceras repetidas (Set-Cookie) y el Content-Encoding original
+        response.raw_headers = _filter_headers(list(upstream_response.raw_headers),
+                                               drop={b"date", b"server"})
+        return response
+
+    async def broadcast(self, request: Request, path: Optional[str] = None) -> List[Tuple[str, int, bytes]]:
+        """
+        Enviar la misma petición a todas las instancias listas del pool (estado
+        que cada proceso guarda en memoria, como las cookies de Node.js).
+        Devuelve (url, status, cuerpo) por instancia.
+        """
+        body = await request.body()
+        headers = self._request_headers(request)
+        endpoints = self.balancer.ready_endpoints()
+
+        async def send(endpoint):
+            try:
+                async with self.client.request(request.method, endpoint.url + (path or request.url.path),
+                                               headers=headers, data=body) as response:
+                    return endpoint.url, response.status, await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"⚠️ {self.name} {endpoint.url}: {e}")
+                return endpoint.url, 502, b""
+
+        return list(await asyncio.gather(*(send(e) for e in endpoints)))
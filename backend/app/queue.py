@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Cola persistente de trabajos de generación
+Los trabajos se guardan en SQLite (tabla generation_jobs) o en Redis si
+REDIS_URL está definido, y un pool de workers asyncio los ejecuta.
+
+Worker independiente:
+    python -m backend.app.queue
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+REDIS_URL = os.getenv("REDIS_URL")
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# El worker que ejecuta un trabajo renueva su concesión (updated_at) con esta frecuencia
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 3
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+SSE_KEEPALIVE_SECONDS = 15
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+FINAL_STATES = (JOB_COMPLETED, JOB_FAILED)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+def _new_job(payload: Dict[str, Any], user_id: Optional[str]) -> Dict[str, Any]:
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "status": JOB_QUEUED,
+        "progress": 0,
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+class SQLiteJobStore:
+    """Trabajos persistidos en la tabla generation_jobs"""
+
+    COLUMNS = ("id", "user_id", "status", "progress", "payload", "result", "error",
+               "created_at", "updated_at", "started_at", "finished_at")
+
+    def __init__(self, storage: SQLiteStorage):
+        self.db = storage
+
+    async def init(self):
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS generation_jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    progress INTEGER DEFAULT 0,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_generation_jobs_status
+                ON generation_jobs (status, created_at)
+            """)
+
+    def _row_to_job(self, row) -> Dict[str, Any]:
+        job = dict(zip(self.COLUMNS, row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    async def create(self, job: Dict[str, Any]):
+        self.db.execute("""
+            INSERT INTO generation_jobs (id, user_id, status, progress, payload,
+                                         created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (job["id"], job["user_id"], job["status"], job["progress"],
+              json.dumps(job["payload"]), job["created_at"], job["updated_at"]))
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.fetchone(
+            f"SELECT {', '.join(self.COLUMNS)} FROM generation_jobs WHERE id = ?", (job_id,)
+        )
+        return self._row_to_job(row) if row else None
+
+    async def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.db.execute(f"UPDATE generation_jobs SET {assignments} WHERE id = ?",
+                        (*fields.values(), job_id))
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Tomar el trabajo más antiguo en cola de forma atómica"""
+        now = time.time()
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE generation_jobs
+                SET status = ?, progress = 10, started_at = ?, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM generation_jobs
+                    WHERE status = ? ORDER BY created_at LIMIT 1
+                )
+                RETURNING id
+            """, (JOB_RUNNING, now, now, JOB_QUEUED))
+            row = cursor.fetchone()
+        return await self.get(row[0]) if row else None
+
+    async def requeue(self, job_id: str):
+        await self.update(job_id, status=JOB_QUEUED, progress=0, started_at=None)
+
+    async def renew(self, job_id: str, started_at: float) -> bool:
+        """Extender la concesión si el trabajo sigue siendo de quien lo reclamó en started_at"""
+        cursor = self.db.execute("""
+            UPDATE generation_jobs SET updated_at = ?
+            WHERE id = ? AND status = ? AND started_at = ?
+        """, (time.time(), job_id, JOB_RUNNING, started_at))
+        return cursor.rowcount > 0
+
+    async def recover_stale(self) -> int:
+        """Devolver a la cola trabajos de workers caídos (concesión sin renovar)"""
+        cursor = self.db.execute("""
+            UPDATE generation_jobs SET status = ?, progress = 0, started_at = NULL
+            WHERE status = ? AND updated_at < ?
+        """, (JOB_QUEUED, JOB_RUNNING, time.time() - JOB_LEASE_SECONDS))
+        return cursor.rowcount
+
+    async def close(self):
+        pass
+
+
+class RedisJobStore:
+    """Trabajos en Redis: un hash por trabajo y una lista como cola"""
+
+    QUEUE_KEY = "son1k:generation_jobs:queued"
+    RUNNING_KEY = "son1k:generation_jobs:running"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url, decode_responses=True)
+
+    def _key(self, job_id: str) -> str:
+        return f"son1k:generation_job:{job_id}"
+
+    async def init(self):
+        await self.redis.ping()
+
+    async def create(self, job: Dict[str, Any]):
+        key = self._key(job["id"])
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={name: json.dumps(value) for name, value in job.items()})
+            pipe.expire(key, JOB_TTL_SECONDS)
+            pipe.lpush(self.QUEUE_KEY, job["id"])
+            await pipe.execute()
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        data = await self.redis.hgetall(self._key(job_id))
+        if not data:
+            return None
+        return {name: json.loads(value) for name, value in data.items()}
+
+    async def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        await self.redis.hset(self._key(job_id),
+                              mapping={name: json.dumps(value) for name, value in fields.items()})
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        job_id = await self.redis.lmove(self.QUEUE_KEY, self.RUNNING_KEY, "RIGHT", "LEFT")
+        if not job_id:
+            return None
+        now = time.time()
+        await self.update(job_id, status=JOB_RUNNING, progress=10, started_at=now)
+        return await self.get(job_id)
+
+    async def requeue(self, job_id: str):
+        await self.update(job_id, status=JOB_QUEUED, progress=0, started_at=None)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.RUNNING_KEY, 1, job_id)
+            pipe.rpush(self.QUEUE_KEY, job_id)
+            await pipe.execute()
+
+    async def finish(self, job_id: str):
+        await self.redis.lrem(self.RUNNING_KEY, 1, job_id)
+
+    async def renew(self, job_id: str, started_at: float) -> bool:
+        job = await self.get(job_id)
+        if job is None or job["status"] != JOB_RUNNING or job["started_at"] != started_at:
+            return False
+        await self.redis.hset(self._key(job_id), "updated_at", json.dumps(time.time()))
+        return True
+
+    async def recover_stale(self) -> int:
+        recovered = 0
+        cutoff = time.time() - JOB_LEASE_SECONDS
+        for job_id in await self.redis.lrange(self.RUNNING_KEY, 0, -1):
+            job = await self.get(job_id)
+            if job is None:
+                await self.redis.lrem(self.RUNNING_KEY, 1, job_id)
+            elif job["updated_at"] < cutoff:
+                await self.requeue(job_id)
+                recovered += 1
+        return recovered
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class GenerationQueue:
+    """Pool de workers asyncio que consume la cola de generaciones"""
+
+    def __init__(self, store, handler: JobHandler, concurrency: int = GENERATION_WORKERS):
+        self.store = store
+        self.handler = handler
+        self.concurrency = concurrency
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._changed: Optional[asyncio.Condition] = None
+
+    async def start(self):
+        """Inicializar el almacén y lanzar los workers"""
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Condition()
+        await self.store.init()
+        recovered = await self.store.recover_stale()
+        if recovered:
+            logger.info(f"♻️ {recovered} trabajos reencolados")
+        for i in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+        logger.info(f"🧵 Cola de generación iniciada con {self.concurrency} workers")
+
+    async def stop(self):
+        """Detener los workers; los trabajos en curso vuelven a la cola"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.store.close()
+
+    async def submit(self, payload: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Encolar un trabajo y devolverlo sin esperar a la generación"""
+        job = _new_job(payload, user_id)
+        await self.store.create(job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.store.get(job_id)
+
+    async def _notify(self):
+        if self._changed is not None:
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self.store.claim()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._notify()
+            await self._run(job)
+
+    async def _heartbeat(self, job_id: str, started_at: float):
+        """Renovar la concesión mientras el handler corre (puede esperar admisión sin límite)"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                if not await self.store.renew(job_id, started_at):
+                    logger.warning(f"⚠️ Trabajo {job_id} reclamado por otro worker")
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo renovar la concesión de {job_id}: {e}")
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, job["started_at"]))
+        try:
+            result = await self.handler(job["payload"])
+        except asyncio.CancelledError:
+            heartbeat.cancel()
+            await asyncio.shield(self.store.requeue(job_id))
+            raise
+        except Exception as e:
+            heartbeat.cancel()
+            error = getattr(e, "detail", None) or str(e)
+            logger.warning(f"⚠️ Trabajo {job_id} falló: {error}")
+            await self.store.update(job_id, status=JOB_FAILED, error=error,
+                                    finished_at=time.time())
+        else:
+            heartbeat.cancel()
+            await self.store.update(job_id, status=JOB_COMPLETED, progress=100,
+                                    result=result, finished_at=time.time())
+        if hasattr(self.store, "finish"):
+            await self.store.finish(job_id)
+        await self._notify()
+
+    async def events(self, job_id: str) -> AsyncIterator[str]:
+        """Stream SSE con el estado del trabajo hasta que termina"""
+        last_update = None
+        last_sent = time.monotonic()
+        while True:
+            job = await self.store.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Trabajo no encontrado'})}\n\n"
+                return
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                last_sent = time.monotonic()
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+                if job["status"] in FINAL_STATES:
+                    return
+            elif time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            # Despertar con cambios locales o sondear cambios de otros procesos
+            try:
+                async with self._changed:
+                    await asyncio.wait_for(self._changed.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+def create_job_store(storage: SQLiteStorage):
+    """Redis si REDIS_URL está definido, si no SQLite"""
+    if REDIS_URL:
+        return RedisJobStore(REDIS_URL)
+    return SQLiteJobStore(storage)
+
+
+async def run_worker():
+    """Ejecutar sólo los workers, sin servidor HTTP"""
+    from .main import init_database, job_queue, node_client
+
+    init_database()
+    await node_client.start()
+    await job_queue.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_queue.stop()
+        await node_client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        pass
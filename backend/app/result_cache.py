@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Caché de resultados de generación
+Direccionada por contenido (hash normalizado de prompt/lyrics/style), con
+TTL, LRU acotado, persistencia opcional en SQLite y coalescencia
+single-flight de peticiones idénticas concurrentes.
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") != "0"
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1000"))
+RESULT_CACHE_PERSIST = os.getenv("RESULT_CACHE_PERSIST", "1") != "0"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_request(prompt: str, lyrics: Optional[str], style: Optional[str]) -> Dict[str, str]:
+    """Normalizar para que variantes triviales compartan entrada"""
+    lyrics_lines = [_WHITESPACE.sub(" ", line).strip() for line in (lyrics or "").splitlines()]
+    return {
+        "prompt": _WHITESPACE.sub(" ", prompt or "").strip().casefold(),
+        "lyrics": "\n".join(line for line in lyrics_lines if line),
+        "style": _WHITESPACE.sub(" ", style or "").strip().casefold(),
+    }
+
+
+def cache_key(prompt: str, lyrics: Optional[str], style: Optional[str]) -> str:
+    normalized = normalize_request(prompt, lyrics, style)
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+class GenerationResultCache:
+    """LRU con TTL + single-flight para el upstream de generación"""
+
+    def __init__(self, storage: Optional[SQLiteStorage] = None,
+                 ttl: float = RESULT_CACHE_TTL, max_entries: int = RESULT_CACHE_SIZE,
+                 enabled: bool = RESULT_CACHE_ENABLED):
+        self.db = storage if RESULT_CACHE_PERSIST else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def init(self):
+        if self.db is None:
+            return
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS generation_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            cursor.execute("DELETE FROM generation_cache WHERE expires_at < ?", (time.time(),))
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[0]
+            del self._entries[key]
+
+        if self.db is not None:
+            row = self.db.fetchone(
+                "SELECT response, expires_at FROM generation_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            )
+            if row:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                return value
+        return None
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _store(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.db is not None:
+            with self.db.transaction() as cursor:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO generation_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                # Purga ocasional de entradas caducadas
+                if random.random() < 0.01:
+                    cursor.execute("DELETE FROM generation_cache WHERE expires_at < ?", (time.time(),))
+
+    async def get_or_generate(self, prompt: str, lyrics: Optional[str], style: Optional[str],
+                              producer: Callable[[], Awaitable[Dict[str, Any]]],
+                              cacheable: Callable[[Dict[str, Any]], bool] = lambda data: True
+                              ) -> Dict[str, Any]:
+        """Resultado en caché, el de una llamada idéntica en curso, o uno nuevo"""
+        if not self.enabled:
+            return await producer()
+
+        key = cache_key(prompt, lyrics, style)
+        while True:
+            cached = self._lookup(key)
+            if cached is not None:
+                self.hits += 1
+                return dict(cached)
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return dict(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                # Si sólo se canceló la llamada original, reintentar como líder
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await producer()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Evitar el aviso "exception was never retrieved" si nadie esperaba
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if cacheable(result):
+                self._store(key, result)
+            return dict(result)
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
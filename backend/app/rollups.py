@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Agregados diarios incrementales de analytics.db
+Cada lote de la escritura diferida marca como "sucio" el día de sus eventos
+en la misma transacción; tras el lote se recalculan desde las filas crudas
+los días cerrados que estén sucios. get_analytics_data responde los días
+completos y cerrados desde aggregated_metrics (más conteos por estilo,
+prompt y usuario) y sólo recorre filas crudas para hoy, los extremos
+parciales del rango y los días aún sucios.
+
+Reconstrucción completa, en paralelo por día:
+    python -m backend.app.rollups --db analytics.db --workers 8
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .metrics import registry
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+# Días cerrados que se recalculan como mucho tras cada lote de escritura
+ROLLUP_REFRESH_MAX_DAYS = int(os.getenv("ROLLUP_REFRESH_MAX_DAYS", "7"))
+ROLLUP_REBUILD_BATCH_DAYS = 50
+
+# Posición de las columnas usadas en las filas del escritor de analytics.db
+GENERATION_TIMESTAMP_COLUMN = 13
+SESSION_START_COLUMN = 2
+
+DAY = timedelta(days=1)
+
+registry.describe("rollup_refresh_seconds", "histogram", "Recalcular los agregados de un día")
+registry.describe("rollup_dirty_days", "gauge", "Días cerrados pendientes de recalcular")
+
+
+@dataclass
+class DayRollup:
+    day: str
+    # total, correctas, fallidas, suma de duración, suma de tiempo de generación, con IA
+    generations: Tuple[int, int, int, float, float, int] = (0, 0, 0, 0.0, 0.0, 0)
+    # sesiones, suma de total_time
+    sessions: Tuple[int, float] = (0, 0.0)
+    users: List[str] = field(default_factory=list)
+    styles: List[Tuple[str, int]] = field(default_factory=list)
+    prompts: List[Tuple[str, int]] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not self.generations[0] and not self.sessions[0]
+
+
+def compute_day(conn: sqlite3.Connection, day: str) -> DayRollup:
+    """Agregados de un día desde las filas crudas (sólo lecturas)"""
+    bounds = (day, (date.fromisoformat(day) + DAY).isoformat())
+    generations = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(success = 1), 0), COALESCE(SUM(success = 0), 0),
+               COALESCE(SUM(duration), 0), COALESCE(SUM(generation_time), 0),
+               COALESCE(SUM(ai_enhanced = 1), 0)
+        FROM music_generations WHERE timestamp >= ? AND timestamp < ?
+    ''', bounds).fetchone()
+    sessions = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(total_time), 0)
+        FROM user_sessions WHERE start_time >= ? AND start_time < ?
+    ''', bounds).fetchone()
+    users = [row[0] for row in conn.execute('''
+        SELECT DISTINCT user_id FROM user_sessions WHERE start_time >= ? AND start_time < ?
+    ''', bounds)]
+    styles = conn.execute('''
+        SELECT style, COUNT(*) FROM music_generations
+        WHERE timestamp >= ? AND timestamp < ? AND success = 1 GROUP BY style
+    ''', bounds).fetchall()
+    prompts = conn.execute('''
+        SELECT prompt, COUNT(*) FROM music_generations
+        WHERE timestamp >= ? AND timestamp < ? AND success = 1 GROUP BY prompt
+    ''', bounds).fetchall()
+    return DayRollup(day, tuple(generations), tuple(sessions), users, styles, prompts)
+
+
+def store_day(cursor: sqlite3.Cursor, rollup: DayRollup):
+    """Sustituir los agregados guardados de un día"""
+    for table in ("aggregated_metrics", "daily_style_counts", "daily_prompt_counts",
+                  "daily_session_users"):
+        cursor.execute(f"DELETE FROM {table} WHERE date = ?", (rollup.day,))
+    if rollup.empty:
+        return
+
+    total, successful, failed, duration, generation_time, ai_usage = rollup.generations
+    sessions, session_time = rollup.sessions
+    cursor.execute('''
+        INSERT INTO aggregated_metrics
+        (date, total_generations, successful_generations, failed_generations, total_duration,
+         avg_generation_time, ai_usage_count, unique_users, total_sessions, avg_session_duration,
+         total_generation_time, total_session_time, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (rollup.day, total, successful, failed, duration,
+          generation_time / total if total else 0, ai_usage, len(rollup.users), sessions,
+          session_time / sessions if sessions else 0, generation_time, session_time,
+          datetime.now().isoformat()))
+    cursor.executemany("INSERT INTO daily_style_counts (date, style, count) VALUES (?, ?, ?)",
+                       [(rollup.day, style, count) for style, count in rollup.styles])
+    cursor.executemany("INSERT INTO daily_prompt_counts (date, prompt, count) VALUES (?, ?, ?)",
+                       [(rollup.day, prompt, count) for prompt, count in rollup.prompts])
+    cursor.executemany("INSERT INTO daily_session_users (date, user_id) VALUES (?, ?)",
+                       [(rollup.day, user) for user in rollup.users])
+
+
+def _contiguous(days: List[date]) -> List[Tuple[str, str]]:
+    """[d1, d2, d3, d5] -> [(d1, d3), (d5, d5)]"""
+    ranges = []
+    for day in days:
+        if ranges and ranges[-1][1] + DAY == day:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [(first.isoformat(), last.isoformat()) for first, last in ranges]
+
+
+class AnalyticsRollups:
+    """Agregados diarios de analytics.db y consultas del dashboard sobre ellos"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.db = storage
+
+    # ------------------------------------------------------------------
+    # Ingesta
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def mark_dirty(cursor: sqlite3.Cursor, rows: Dict[str, List[tuple]],
+                   keyed: Dict[str, Dict[Any, tuple]]):
+        """Hook de WriteBehindBuffer: marcar los días del lote dentro de su transacción"""
+        days = {row[GENERATION_TIMESTAMP_COLUMN][:10] for row in rows.get("music_generations", ())}
+        days.update(row[SESSION_START_COLUMN][:10] for row in keyed.get("user_sessions", {}).values())
+        cursor.executemany('''
+            INSERT INTO rollup_dirty_days (date) VALUES (?)
+            ON CONFLICT (date) DO UPDATE SET version = version + 1
+        ''', [(day,) for day in days])
+
+    def refresh(self, max_days: Optional[int] = ROLLUP_REFRESH_MAX_DAYS) -> int:
+        """Recalcular días cerrados sucios; devuelve cuántos se recalcularon"""
+        today = date.today().isoformat()
+        dirty = self.db.fetchall(
+            "SELECT date, version FROM rollup_dirty_days WHERE date < ? ORDER BY date DESC LIMIT ?",
+            (today, -1 if max_days is None else max_days))
+        for day, version in dirty:
+            start = time.perf_counter()
+            with self.db.connection() as conn:
+                rollup = compute_day(conn, day)
+            with self.db.transaction() as cursor:
+                store_day(cursor, rollup)
+                # Si entró otro evento de ese día mientras tanto, sigue sucio
+                cursor.execute("DELETE FROM rollup_dirty_days WHERE date = ? AND version = ?",
+                               (day, version))
+            registry.observe("rollup_refresh_seconds", time.perf_counter() - start)
+        if dirty:
+            remaining = self.db.fetchone("SELECT COUNT(*) FROM rollup_dirty_days WHERE date < ?",
+                                         (today,))[0]
+            registry.gauge_set("rollup_dirty_days", remaining)
+        return len(dirty)
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def plan(start: datetime, end: datetime, today: date,
+             dirty: Iterable[str]) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str, bool]]]:
+        """
+        Dividir [start, end] en rangos de días agregados (fechas inclusivas) y
+        rangos crudos (desde, hasta, hasta_inclusivo) sobre el timestamp.
+        """
+        dirty = set(dirty)
+        first_full = start.date() if start.time() == datetime.min.time() else start.date() + DAY
+        last_full = min(end.date() - DAY, today - DAY)
+        rolled: List[date] = []
+        day = first_full
+        while day <= last_full:
+            if day.isoformat() not in dirty:
+                rolled.append(day)
+            day += DAY
+
+        raw: List[Tuple[str, str, bool]] = []
+        cursor = start.isoformat()
+        for first, last in _contiguous(rolled):
+            if cursor < first:
+                raw.append((cursor, first, False))
+            cursor = (date.fromisoformat(last) + DAY).isoformat()
+        if cursor <= end.isoformat():
+            raw.append((cursor, end.isoformat(), True))
+        return _contiguous(rolled), raw
+
+    @staticmethod
+    def _union(rolled_sql: str, raw_sql: str, rolled: Sequence[Tuple[str, str]],
+               raw: Sequence[Tuple[str, str, bool]], column: str) -> Tuple[str, list]:
+        parts, params = [], []
+        for first, last in rolled:
+            parts.append(rolled_sql.format(where="date BETWEEN ? AND ?"))
+            params.extend((first, last))
+        for low, high, inclusive in raw:
+            parts.append(raw_sql.format(where=f"{column} >= ? AND {column} {'<=' if inclusive else '<'} ?"))
+            params.extend((low, high))
+        return " UNION ALL ".join(parts), params
+
+    def analytics(self, start: datetime, end: datetime,
+                  ai_usage_by_day: bool = True) -> Dict[str, Any]:
+        """
+        Mismo resultado que recorrer las filas crudas de [start, end]. Con
+        ai_usage_by_day=False no se calcula (ni se devuelve) esa serie.
+        """
+        with self.db.connection() as conn:
+            # Una sola instantánea de lectura (WAL) para agregados y filas crudas
+            conn.execute("BEGIN")
+            try:
+                dirty = [row[0] for row in conn.execute(
+                    "SELECT date FROM rollup_dirty_days WHERE date BETWEEN ? AND ?",
+                    (start.date().isoformat(), end.date().isoformat()))]
+                rolled, raw = self.plan(start, end, date.today(), dirty)
+                return self._query(conn, rolled, raw, ai_usage_by_day)
+            finally:
+                conn.rollback()
+
+    def _query(self, conn: sqlite3.Connection, rolled, raw,
+               ai_usage_by_day: bool = True) -> Dict[str, Any]:
+        union = lambda rolled_sql, raw_sql, column="timestamp": self._union(
+            rolled_sql, raw_sql, rolled, raw, column)
+
+        sql, params = union('''
+            SELECT total_generations AS n, successful_generations AS ok, failed_generations AS ko,
+                   total_duration AS duration, total_generation_time AS gen_time, ai_usage_count AS ai
+            FROM aggregated_metrics WHERE {where}
+        ''', '''
+            SELECT COUNT(*) AS n, SUM(success = 1) AS ok, SUM(success = 0) AS ko,
+                   SUM(duration) AS duration, SUM(generation_time) AS gen_time,
+                   SUM(ai_enhanced = 1) AS ai
+            FROM music_generations WHERE {where}
+        ''')
+        total, successful, failed, duration, generation_time, ai_usage = conn.execute(f'''
+            SELECT SUM(n), SUM(ok), SUM(ko), SUM(duration), SUM(gen_time), SUM(ai) FROM ({sql})
+        ''', params).fetchone()
+
+        sql, params = union('''
+            SELECT total_sessions AS n, total_session_time AS session_time
+            FROM aggregated_metrics WHERE {where}
+        ''', '''
+            SELECT COUNT(*) AS n, SUM(total_time) AS session_time FROM user_sessions WHERE {where}
+        ''', "start_time")
+        sessions, session_time = conn.execute(
+            f"SELECT SUM(n), SUM(session_time) FROM ({sql})", params).fetchone()
+
+        # Un usuario con sesiones en varios días cuenta una vez
+        sql, params = union(
+            "SELECT user_id FROM daily_session_users WHERE {where}",
+            "SELECT user_id FROM user_sessions WHERE {where}", "start_time")
+        unique_users = conn.execute(
+            f"SELECT COUNT(DISTINCT user_id) FROM ({sql})", params).fetchone()[0]
+
+        def top(column: str, table: str) -> List[Tuple[str, int]]:
+            sql, params = union(
+                f"SELECT {column} AS key, count FROM {table} WHERE {{where}}",
+                f"SELECT {column} AS key, COUNT(*) AS count FROM music_generations "
+                f"WHERE {{where}} AND success = 1 "
+                f"GROUP BY {column}")
+            return conn.execute(f'''
+                SELECT key, SUM(count) AS total FROM ({sql})
+                GROUP BY key ORDER BY total DESC LIMIT 10
+            ''', params).fetchall()
+
+        data = {
+            'music_metrics': {
+                'total_generations': total or 0,
+                'successful_generations': successful or 0,
+                'failed_generations': failed or 0,
+                'avg_duration': duration / total if total else 0,
+                'avg_generation_time': generation_time / total if total else 0,
+                'ai_usage_count': ai_usage or 0
+            },
+            'session_metrics': {
+                'total_sessions': sessions or 0,
+                'unique_users': unique_users or 0,
+                'avg_session_duration': session_time / sessions if sessions else 0
+            },
+            'popular_styles': [{'style': style, 'count': count}
+                               for style, count in top("style", "daily_style_counts")],
+            'popular_prompts': [{'prompt': prompt, 'count': count}
+                                for prompt, count in top("prompt", "daily_prompt_counts")]
+        }
+
+        if ai_usage_by_day:
+            sql, params = union('''
+                SELECT date AS day, ai_usage_count AS count FROM aggregated_metrics
+                WHERE {where} AND ai_usage_count > 0
+            ''', '''
+                SELECT DATE(timestamp) AS day, COUNT(*) AS count FROM music_generations
+                WHERE {where} AND ai_enhanced = 1 GROUP BY DATE(timestamp)
+            ''')
+            data['ai_usage_by_day'] = [{'date': day, 'count': count} for day, count in conn.execute(
+                f"SELECT day, SUM(count) FROM ({sql}) GROUP BY day ORDER BY day", params)]
+        return data
+
+
+# ----------------------------------------------------------------------
+# Reconstrucción completa (CLI)
+# ----------------------------------------------------------------------
+
+_worker_conn: Optional[sqlite3.Connection] = None
+
+
+def _compute_in_worker(task: Tuple[str, str]) -> DayRollup:
+    global _worker_conn
+    path, day = task
+    if _worker_conn is None:
+        _worker_conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    return compute_day(_worker_conn, day)
+
+
+def rebuild(path: str, workers: int = os.cpu_count() or 1, since: Optional[str] = None,
+            until: Optional[str] = None) -> int:
+    """Recalcular todos los días cerrados desde las filas crudas, repartidos entre procesos"""
+    from .analytics_schema import migrate_analytics
+
+    migrate_analytics(path)
+    storage = SQLiteStorage(path)
+    last = min(until or "9999-12-31", (date.today() - DAY).isoformat())
+    first = since or "0000-01-01"
+    bounds = (first, (date.fromisoformat(last) + DAY).isoformat())
+    days = [row[0] for row in storage.fetchall('''
+        SELECT DATE(timestamp) AS day FROM music_generations
+        WHERE timestamp >= ? AND timestamp < ? GROUP BY day
+        UNION
+        SELECT DATE(start_time) FROM user_sessions
+        WHERE start_time >= ? AND start_time < ? GROUP BY 1
+    ''', bounds + bounds)]
+    versions = dict(storage.fetchall("SELECT date, version FROM rollup_dirty_days"))
+
+    pending: List[DayRollup] = []
+
+    def store(batch: List[DayRollup]):
+        with storage.transaction() as cursor:
+            for rollup in batch:
+                store_day(cursor, rollup)
+                if rollup.day in versions:
+                    cursor.execute("DELETE FROM rollup_dirty_days WHERE date = ? AND version = ?",
+                                   (rollup.day, versions[rollup.day]))
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        for rollup in pool.map(_compute_in_worker, [(path, day) for day in days], chunksize=4):
+            pending.append(rollup)
+            if len(pending) >= ROLLUP_REBUILD_BATCH_DAYS:
+                store(pending)
+                pending = []
+    if pending:
+        store(pending)
+
+    # Agregados de días que ya no tienen filas crudas
+    with storage.transaction() as cursor:
+        for table in ("aggregated_metrics", "daily_style_counts", "daily_prompt_counts",
+                      "daily_session_users"):
+            cursor.execute(f'''
+                DELETE FROM {table} WHERE date BETWEEN ? AND ?
+                AND date NOT IN (SELECT value FROM json_each(?))
+            ''', (first, last, json.dumps(days)))
+    storage.close_all()
+    return len(days)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reconstruir los agregados diarios de analytics.db")
+    parser.add_argument("--db", default="analytics.db")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--since", help="Primer día (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Último día (YYYY-MM-DD); como mucho ayer")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    days = rebuild(args.db, args.workers, args.since, args.until)
+    print(f"📊 {days} días reconstruidos en {time.perf_counter() - start:.1f}s "
+          f"con {args.workers} procesos")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
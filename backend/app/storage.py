@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Capa de almacenamiento SQLite compartida
+Conexiones reutilizadas por hilo con WAL y pragmas ajustados
+"""
+
+import os
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .metrics import observe_sqlite
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+SQLITE_POOL_ENABLED = os.getenv("SQLITE_POOL_ENABLED", "1") != "0"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
+
+class SQLiteStorage:
+    """
+    Pool de conexiones SQLite, una por hilo.
+
+    Los handlers async de FastAPI corren todos en el hilo del event loop y
+    comparten su conexión, así que una transacción nunca debe quedar abierta
+    a través de un ``await``.
+    """
+
+    def __init__(self, path: str, pooled: Optional[bool] = None):
+        self.path = path
+        self.pooled = SQLITE_POOL_ENABLED if pooled is None else pooled
+        self.name = os.path.basename(path)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Abrir una conexión nueva con los pragmas de rendimiento"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+        )
+        if self.pooled:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Obtener la conexión del hilo actual (o una efímera si el pool está desactivado)"""
+        if not self.pooled:
+            conn = self._connect()
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        yield conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Ejecutar un bloque en una transacción: commit al salir, rollback si falla"""
+        start = time.perf_counter()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                observe_sqlite(self.name, "transaction", time.perf_counter() - start)
+
+    def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        """Ejecutar una consulta y devolver la primera fila"""
+        start = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                return conn.execute(sql, params).fetchone()
+        finally:
+            observe_sqlite(self.name, "fetchone", time.perf_counter() - start)
+
+    def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        """Ejecutar una consulta y devolver todas las filas"""
+        start = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            observe_sqlite(self.name, "fetchall", time.perf_counter() - start)
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> sqlite3.Cursor:
+        """Ejecutar una sentencia de escritura en su propia transacción"""
+        start = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                try:
+                    cursor = conn.execute(sql, params)
+                    conn.commit()
+                    return cursor
+                except BaseException:
+                    conn.rollback()
+                    raise
+        finally:
+            observe_sqlite(self.name, "execute", time.perf_counter() - start)
+
+    def close_all(self):
+        """Cerrar todas las conexiones del pool"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Error cerrando conexión SQLite: {e}")
+        self._local = threading.local()
+
+
+_storages: Dict[str, SQLiteStorage] = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(path: str) -> SQLiteStorage:
+    """Obtener el pool compartido para una base de datos"""
+    key = os.path.abspath(path)
+    with _storages_lock:
+        storage = _storages.get(key)
+        if storage is None:
+            storage = SQLiteStorage(path)
+            _storages[key] = storage
+        return storage
+
+
+def close_all_storages():
+    """Cerrar todos los pools abiertos"""
+    with _storages_lock:
+        storages = list(_storages.values())
+    for storage in storages:
+        storage.close_all()
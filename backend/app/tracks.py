@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Feed de tracks
+Paginación por cursor (created_at, id), snapshot serializado de la
+primera página y ETags para responder 304 sin tocar SQLite.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .storage import SQLiteStorage
+
+# Configuración
+TRACKS_PAGE_SIZE = 50
+TRACKS_MAX_PAGE_SIZE = 100
+TRACKS_SNAPSHOT_TTL = float(os.getenv("TRACKS_SNAPSHOT_TTL", "30"))
+
+TRACK_COLUMNS = ("id", "title", "artist", "audio_url", "duration", "genre", "mood", "created_at")
+
+
+class InvalidCursor(ValueError):
+    """Cursor `before` mal formado"""
+
+
+def parse_cursor(cursor: str) -> Tuple[str, int]:
+    """'<created_at>,<id>' -> (created_at, id)"""
+    created_at, sep, track_id = cursor.rpartition(",")
+    if not sep or not created_at:
+        raise InvalidCursor(cursor)
+    try:
+        return created_at, int(track_id)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class TracksFeed:
+    """Lectura paginada de la tabla tracks con snapshot de la primera página"""
+
+    def __init__(self, storage: SQLiteStorage, ttl: float = TRACKS_SNAPSHOT_TTL):
+        self.db = storage
+        self.ttl = ttl
+        self._snapshot: Optional[Tuple[bytes, str, float]] = None
+        self._lock = threading.Lock()
+
+    def init(self):
+        """Índice para ORDER BY created_at DESC, id DESC"""
+        self.db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tracks_created_at
+            ON tracks (created_at DESC, id DESC)
+        """)
+
+    def _query(self, before: Optional[Tuple[str, int]], limit: int) -> List[Dict[str, Any]]:
+        columns = ", ".join(TRACK_COLUMNS)
+        if before is None:
+            rows = self.db.fetchall(f"""
+                SELECT {columns} FROM tracks
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            """, (limit,))
+        else:
+            rows = self.db.fetchall(f"""
+                SELECT {columns} FROM tracks
+                WHERE (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            """, (*before, limit))
+        return [dict(zip(TRACK_COLUMNS, row)) for row in rows]
+
+    def _render(self, tracks: List[Dict[str, Any]], limit: int) -> Tuple[bytes, str]:
+        next_cursor = None
+        if len(tracks) == limit:
+            last = tracks[-1]
+            next_cursor = f"{last['created_at']},{last['id']}"
+        body = json.dumps({"tracks": tracks, "next_cursor": next_cursor},
+                          ensure_ascii=False, separators=(",", ":")).encode()
+        return body, make_etag(body)
+
+    def snapshot_etag(self) -> Optional[str]:
+        """ETag de la primera página si el snapshot sigue vigente (sin tocar SQLite)"""
+        snapshot = self._snapshot
+        if snapshot and time.monotonic() - snapshot[2] < self.ttl:
+            return snapshot[1]
+        return None
+
+    def page(self, before: Optional[str] = None, limit: int = TRACKS_PAGE_SIZE) -> Tuple[bytes, str]:
+        """Cuerpo JSON serializado y ETag de una página"""
+        limit = max(1, min(limit, TRACKS_MAX_PAGE_SIZE))
+        if before is not None:
+            return self._render(self._query(parse_cursor(before), limit), limit)
+        if limit != TRACKS_PAGE_SIZE:
+            return self._render(self._query(None, limit), limit)
+
+        body, etag, _ = self.snapshot()
+        return body, etag
+
+    def snapshot(self) -> Tuple[bytes, str, float]:
+        """Primera página (cuerpo, ETag, instante monotonic de la lectura), renovada si caducó"""
+        with self._lock:
+            snapshot = self._snapshot
+            if not (snapshot and time.monotonic() - snapshot[2] < self.ttl):
+                body, etag = self._render(self._query(None, TRACKS_PAGE_SIZE), TRACKS_PAGE_SIZE)
+                snapshot = self._snapshot = (body, etag, time.monotonic())
+            return snapshot
+
+    def invalidate(self):
+        """Descartar el snapshot tras insertar tracks"""
+        with self._lock:
+            self._snapshot = None
+
+    def add_track(self, title: str, audio_url: str, artist: Optional[str] = None,
+                  duration: Optional[int] = None, genre: Optional[str] = None,
+                  mood: Optional[str] = None) -> int:
+        """Insertar un track e invalidar el snapshot"""
+        cursor = self.db.execute("""
+            INSERT INTO tracks (title, artist, audio_url, duration, genre, mood)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (title, artist, audio_url, duration, genre, mood))
+        self.invalidate()
+        return cursor.lastrowid
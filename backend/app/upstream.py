@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Cliente HTTP asíncrono hacia el wrapper Node.js
+Un único cliente por proceso con keep-alive y conexiones acotadas, repartido
+entre las instancias del pool de Node.js (NODE_POOL_SIZE puertos consecutivos)
+"""
+
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .balancer import NODE_POOL_SIZE, LeastOutstandingBalancer, consecutive_urls
+from .deadline import DeadlineExceeded, expired, propagate, remaining
+from .metrics import time_upstream
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+NODE_SERVER_URL = os.getenv("NODE_SERVER_URL", "http://localhost:3001")
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "120"))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "60"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "16"))
+
+
+class UpstreamClient:
+    """Cliente asíncrono reutilizable para el servidor Node.js"""
+
+    def __init__(self, base_urls: Optional[List[str]] = None):
+        self.balancer = LeastOutstandingBalancer(
+            "node", base_urls or consecutive_urls(NODE_SERVER_URL, NODE_POOL_SIZE))
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=UPSTREAM_CONNECT_TIMEOUT,
+                read=UPSTREAM_READ_TIMEOUT,
+                write=UPSTREAM_CONNECT_TIMEOUT,
+                pool=UPSTREAM_POOL_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            ),
+        )
+
+    async def start(self):
+        """Crear el cliente al arrancar la aplicación"""
+        if self._client is None:
+            self._client = self._build_client()
+            urls = ", ".join(e.url for e in self.balancer.endpoints)
+            logger.info(f"🔗 Cliente upstream listo para {urls}")
+        if len(self.balancer.endpoints) > 1:
+            # Con un pool sólo se envía tráfico a las instancias que responden /health
+            self.balancer.start_probing()
+
+    async def close(self):
+        """Cerrar conexiones al detener la aplicación"""
+        self.balancer.stop_probing()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    async def post_json(self, path: str, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        POST JSON a la instancia de Node.js con menos peticiones en curso.
+
+        Si la instancia rechaza la conexión (proceso caído) se reintenta en
+        otra; lanza NoReadyEndpoint si no queda ninguna lista. El timeout de
+        lectura se recorta al plazo de la petición (X-Request-Deadline).
+        """
+        for attempt in range(len(self.balancer.endpoints)):
+            timeout = httpx.Timeout(
+                connect=UPSTREAM_CONNECT_TIMEOUT,
+                read=remaining(UPSTREAM_READ_TIMEOUT),
+                write=UPSTREAM_CONNECT_TIMEOUT,
+                pool=remaining(UPSTREAM_POOL_TIMEOUT),
+            )
+            with self.balancer.lease() as endpoint:
+                try:
+                    with time_upstream("node"):
+                        return await self.client.post(endpoint.url + path, json=payload,
+                                                      headers=propagate(), timeout=timeout)
+                except httpx.TimeoutException as e:
+                    if expired():
+                        raise DeadlineExceeded("Plazo de la petición vencido") from e
+                    raise
+                except httpx.ConnectError:
+                    self.balancer.mark_down(endpoint)
+                    if attempt == len(self.balancer.endpoints) - 1:
+                        raise
+
+
+node_client = UpstreamClient()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Contadores de uso materializados
+Filas por usuario y mes (más una fila acumulada '*') que se actualizan en
+la misma transacción que el INSERT en generations.
+"""
+
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Any, Dict
+
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+TOTAL_MONTH = "*"
+
+
+class UsageCounters:
+    """Tabla user_usage_monthly: (user_id, month) -> generaciones"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.db = storage
+
+    def init(self):
+        """Crear la tabla y rellenarla desde generations la primera vez"""
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_usage_monthly (
+                    user_id INTEGER NOT NULL,
+                    month TEXT NOT NULL,
+                    generations INTEGER NOT NULL DEFAULT 0,
+                    last_generation_at TIMESTAMP,
+                    PRIMARY KEY (user_id, month)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("SELECT 1 FROM user_usage_monthly LIMIT 1")
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    INSERT INTO user_usage_monthly (user_id, month, generations, last_generation_at)
+                    SELECT user_id, strftime('%Y-%m', created_at), COUNT(*), MAX(created_at)
+                    FROM generations WHERE user_id IS NOT NULL
+                    GROUP BY user_id, strftime('%Y-%m', created_at)
+                """)
+                cursor.execute("""
+                    INSERT INTO user_usage_monthly (user_id, month, generations, last_generation_at)
+                    SELECT user_id, ?, COUNT(*), MAX(created_at)
+                    FROM generations WHERE user_id IS NOT NULL
+                    GROUP BY user_id
+                """, (TOTAL_MONTH,))
+                if cursor.rowcount > 0:
+                    logger.info(f"📈 Contadores de uso reconstruidos para {cursor.rowcount} usuarios")
+
+    @staticmethod
+    def record_generation(cursor: sqlite3.Cursor, user_id, count: int = 1):
+        """Sumar generaciones; llamar con el cursor de la transacción del INSERT"""
+        month = datetime.utcnow().strftime("%Y-%m")
+        cursor.executemany("""
+            INSERT INTO user_usage_monthly (user_id, month, generations, last_generation_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id, month) DO UPDATE SET
+                generations = generations + excluded.generations,
+                last_generation_at = excluded.last_generation_at
+        """, [(user_id, month, count), (user_id, TOTAL_MONTH, count)])
+
+    def get(self, user_id) -> Dict[str, Any]:
+        """Uso del mes actual y acumulado con un único rango de clave primaria"""
+        month = datetime.utcnow().strftime("%Y-%m")
+        rows = self.db.fetchall("""
+            SELECT month, generations, last_generation_at FROM user_usage_monthly
+            WHERE user_id = ? AND month IN (?, ?)
+        """, (user_id, month, TOTAL_MONTH))
+        by_month = {row[0]: row for row in rows}
+        current = by_month.get(month)
+        total = by_month.get(TOTAL_MONTH)
+        return {
+            "month": month,
+            "generations_this_month": current[1] if current else 0,
+            "total_generations": total[1] if total else 0,
+            "last_generation_at": total[2] if total else None,
+        }
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Son1kVers3 - Escritura diferida (write-behind) por lotes
+Las filas se encolan en memoria y un hilo las escribe con executemany en una
+sola transacción cuando se acumulan suficientes o pasa el intervalo. Las
+filas con clave (p. ej. la sesión, que se reescribe en cada evento) se
+sustituyen en la cola: sólo se escribe su última versión.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .metrics import registry
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0"))
+# Con la cola llena, put() espera a que el hilo escriba (contrapresión)
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+
+registry.describe("write_behind_queue_depth", "gauge", "Filas pendientes de escribir")
+registry.describe("write_behind_flush_seconds", "histogram",
+                  "Duración de cada escritura por lotes (una transacción)")
+registry.describe("write_behind_rows_total", "counter", "Filas escritas por tabla")
+registry.describe("write_behind_errors_total", "counter",
+                  "Lotes que fallaron y volvieron a la cola")
+registry.describe("write_behind_backpressure_total", "counter",
+                  "Llamadas a put() que esperaron por cola llena")
+
+Batch = Tuple[Dict[str, List[tuple]], Dict[str, Dict[Any, tuple]]]
+# on_write(cursor, rows, keyed) corre dentro de la transacción del lote
+WriteHook = Callable[[sqlite3.Cursor, Dict[str, List[tuple]], Dict[str, Dict[Any, tuple]]], None]
+
+
+class WriteBehindBuffer:
+    """
+    Uso::
+
+        buffer = WriteBehindBuffer(get_storage("analytics.db"), "analytics", {
+            "user_interactions": "INSERT INTO user_interactions (...) VALUES (?, ...)",
+            "user_sessions": "INSERT OR REPLACE INTO user_sessions (...) VALUES (?, ...)",
+        })
+        buffer.start()
+        buffer.put("user_interactions", row)
+        buffer.put("user_sessions", row, key=session_id)
+        ...
+        buffer.close()  # escribe lo pendiente
+    """
+
+    def __init__(self, storage: SQLiteStorage, name: str, statements: Dict[str, str],
+                 batch_size: int = WRITE_BEHIND_BATCH, interval: float = WRITE_BEHIND_INTERVAL,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING,
+                 on_write: Optional[WriteHook] = None,
+                 after_flush: Optional[Callable[[], Any]] = None):
+        self.storage = storage
+        self.name = name
+        self.statements = statements
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max(batch_size, max_pending)
+        self.on_write = on_write
+        # Trabajo derivado tras cada lote escrito, en el hilo del buffer
+        self.after_flush = after_flush
+        self._rows: Dict[str, List[tuple]] = {table: [] for table in statements}
+        self._keyed: Dict[str, Dict[Any, tuple]] = {table: {} for table in statements}
+        self._pending = 0
+        self._closed = False
+        self._atomic = False
+        # RLock (por defecto): put() puede llamarse dentro de atomic()
+        self._cond = threading.Condition()
+        # Serializa las escrituras del hilo con flush() explícitos desde otros hilos
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.name}",
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, table: str, row: tuple, key: Any = None):
+        """Encolar una fila; con ``key`` sustituye a la pendiente con la misma clave"""
+        with self._cond:
+            if not self._atomic:
+                self._wait_for_room()
+            if self._closed:
+                # Tras el cierre no hay hilo: escribir directamente
+                self._write(({table: [row]}, {}) if key is None else ({}, {table: {key: row}}))
+                return
+            if key is None:
+                self._rows[table].append(row)
+                self._pending += 1
+            else:
+                keyed = self._keyed[table]
+                if key not in keyed:
+                    self._pending += 1
+                keyed[key] = row
+            registry.gauge_set("write_behind_queue_depth", self._pending, buffer=self.name)
+            if self._pending >= self.batch_size:
+                self._cond.notify_all()
+
+    def _wait_for_room(self):
+        """Contrapresión (llamar con self._cond adquirido)"""
+        if self._pending >= self.max_pending and not self._closed:
+            registry.inc("write_behind_backpressure_total", buffer=self.name)
+            while self._pending >= self.max_pending and not self._closed:
+                self._cond.notify_all()
+                self._cond.wait()
+
+    @contextmanager
+    def atomic(self):
+        """Las filas encoladas dentro del bloque van al mismo lote (una transacción)"""
+        with self._cond:
+            # La espera por cola llena se hace antes: dentro, wait() soltaría el
+            # lock y el hilo podría escribir el bloque a medias
+            self._wait_for_room()
+            self._atomic = True
+            try:
+                yield self
+            finally:
+                self._atomic = False
+                if self._pending >= self.batch_size:
+                    self._cond.notify_all()
+
+    def _take(self) -> Batch:
+        """Vaciar la cola (llamar con self._cond adquirido)"""
+        rows = {table: pending for table, pending in self._rows.items() if pending}
+        keyed = {table: pending for table, pending in self._keyed.items() if pending}
+        self._rows = {table: [] for table in self.statements}
+        self._keyed = {table: {} for table in self.statements}
+        self._pending = 0
+        registry.gauge_set("write_behind_queue_depth", 0, buffer=self.name)
+        self._cond.notify_all()
+        return rows, keyed
+
+    def _requeue(self, batch: Batch):
+        """Devolver un lote fallido a la cola sin pisar versiones más nuevas"""
+        rows, keyed = batch
+        with self._cond:
+            for table, pending in rows.items():
+                self._rows[table][:0] = pending
+                self._pending += len(pending)
+            for table, pending in keyed.items():
+                current = self._keyed[table]
+                for key, row in pending.items():
+                    if key not in current:
+                        current[key] = row
+                        self._pending += 1
+            registry.gauge_set("write_behind_queue_depth", self._pending, buffer=self.name)
+
+    def _write(self, batch: Batch) -> bool:
+        rows, keyed = batch
+        start = time.perf_counter()
+        try:
+            with self.storage.transaction() as cursor:
+                for table, pending in rows.items():
+                    cursor.executemany(self.statements[table], pending)
+                for table, pending in keyed.items():
+                    cursor.executemany(self.statements[table], list(pending.values()))
+                if self.on_write is not None:
+                    self.on_write(cursor, rows, keyed)
+        except sqlite3.Error as e:
+            registry.inc("write_behind_errors_total", buffer=self.name)
+            logger.error(f"❌ Escritura diferida de {self.name} fallida, se reintentará: {e}")
+            return False
+        finally:
+            registry.observe("write_behind_flush_seconds", time.perf_counter() - start,
+                             buffer=self.name)
+        for table, pending in list(rows.items()) + list(keyed.items()):
+            registry.inc("write_behind_rows_total", len(pending), buffer=self.name, table=table)
+        return True
+
+    def flush(self) -> bool:
+        """Escribir ya todo lo pendiente (desde cualquier hilo). False si el lote falló"""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._take()
+            if not any(batch):
+                return True
+            if self._write(batch):
+                self._after_flush()
+                return True
+            if not self._closed:
+                self._requeue(batch)
+            return False
+
+    def _after_flush(self):
+        if self.after_flush is None:
+            return
+        try:
+            self.after_flush()
+        except Exception as e:
+            logger.error(f"❌ Error tras la escritura diferida de {self.name}: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.interval
+                while not self._closed and self._pending < self.batch_size:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                closing = self._closed
+            if closing:
+                return
+            self.flush()
+
+    def close(self):
+        """Parar el hilo y escribir lo pendiente (idempotente)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.flush():
+            logger.error(f"❌ Filas pendientes de {self.name} perdidas al cerrar")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": self._pending, "batch_size": self.batch_size,
+                "interval": self.interval, "closed": self._closed}
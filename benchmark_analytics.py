@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+📊 SON1KVERS3 - Benchmark de índices de analytics.db
+Llena una base de datos temporal con N generaciones, N interacciones y N/10
+sesiones repartidas en un año, mide las consultas del dashboard sin
+índices, aplica las migraciones (esquema v2) y las vuelve a medir
+
+Uso:
+    python benchmark_analytics.py --rows 10000000 --repeat 5
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from backend.app.analytics_schema import ANALYTICS_MIGRATIONS, migrate_analytics
+from backend.app.migrations import migrate
+
+STYLES = '["rock","pop","jazz","electronic","synthwave","ambient","hip-hop","classical"]'
+CHUNK = 1_000_000
+
+# Consultas de get_analytics_data (más el recorrido de una sesión)
+DASHBOARD_QUERIES = {
+    "resumen": '''
+        SELECT COUNT(*), SUM(CASE WHEN success = 1 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN success = 0 THEN 1 ELSE 0 END), AVG(duration),
+               AVG(generation_time), SUM(CASE WHEN ai_enhanced = 1 THEN 1 ELSE 0 END)
+        FROM music_generations WHERE timestamp BETWEEN :start AND :end
+    ''',
+    "sesiones": '''
+        SELECT COUNT(*), COUNT(DISTINCT user_id), AVG(total_time)
+        FROM user_sessions WHERE start_time BETWEEN :start AND :end
+    ''',
+    "estilos": '''
+        SELECT style, COUNT(*) AS count FROM music_generations
+        WHERE timestamp BETWEEN :start AND :end AND success = 1
+        GROUP BY style ORDER BY count DESC LIMIT 10
+    ''',
+    "prompts": '''
+        SELECT prompt, COUNT(*) AS count FROM music_generations
+        WHERE timestamp BETWEEN :start AND :end AND success = 1
+        GROUP BY prompt ORDER BY count DESC LIMIT 10
+    ''',
+    "ia_por_dia": '''
+        SELECT DATE(timestamp) AS date, COUNT(*) FROM music_generations
+        WHERE timestamp BETWEEN :start AND :end AND ai_enhanced = 1
+        GROUP BY DATE(timestamp) ORDER BY date
+    ''',
+    "sesion": '''
+        SELECT action, element, timestamp FROM user_interactions
+        WHERE session_id = :session ORDER BY timestamp
+    ''',
+}
+
+
+def populate(conn, rows, span_days):
+    """Insertar los datos sintéticos con CTE recursivas, por bloques de CHUNK filas"""
+    sessions = max(1, rows // 10)
+    start = time.time() - span_days * 86400
+    tables = (
+        ("music_generations", rows, '''
+            INSERT INTO music_generations
+            WITH RECURSIVE seq(n) AS (SELECT :first UNION ALL SELECT n + 1 FROM seq WHERE n < :last)
+            SELECT printf('gen-%010d', n), 'user-' || (n * 7919 % 50000), 'prompt ' || (n * 31 % 500),
+                   json_extract(:styles, '$[' || (n % 8) || ']'), 30 + n % 180, 60 + n % 120, 'C',
+                   '["piano"]', 'happy', n % 3 = 0, 0.5 + (n % 100) / 10.0, n % 20 != 0, NULL,
+                   strftime('%Y-%m-%dT%H:%M:%S', :start + n * :step, 'unixepoch'), '127.0.0.1', 'bench'
+            FROM seq
+        '''),
+        ("user_sessions", sessions, '''
+            INSERT INTO user_sessions
+            WITH RECURSIVE seq(n) AS (SELECT :first UNION ALL SELECT n + 1 FROM seq WHERE n < :last)
+            SELECT printf('sess-%010d', n), 'user-' || (n * 7919 % 50000),
+                   strftime('%Y-%m-%dT%H:%M:%S', :start + n * :step, 'unixepoch'), NULL,
+                   n % 12, n % 4, n % 2, n % 3600, '127.0.0.1', 'bench'
+            FROM seq
+        '''),
+        ("user_interactions", rows, '''
+            INSERT INTO user_interactions
+            WITH RECURSIVE seq(n) AS (SELECT :first UNION ALL SELECT n + 1 FROM seq WHERE n < :last)
+            SELECT printf('int-%010d', n), printf('sess-%010d', n * :sessions / :rows),
+                   'user-' || (n * 7919 % 50000), CASE n % 3 WHEN 0 THEN 'page_view' ELSE 'click' END,
+                   'button', NULL, strftime('%Y-%m-%dT%H:%M:%S', :start + n * :step, 'unixepoch'), '{}'
+            FROM seq
+        '''),
+    )
+    for table, count, sql in tables:
+        began = time.perf_counter()
+        for first in range(0, count, CHUNK):
+            conn.execute(sql, {
+                "first": first, "last": min(first + CHUNK, count) - 1, "styles": STYLES,
+                "start": start, "step": span_days * 86400 / count,
+                "sessions": sessions, "rows": rows,
+            })
+            conn.commit()
+        print(f"   {table:<18} {count:>12,} filas en {time.perf_counter() - began:.1f}s")
+    return sessions
+
+
+def measure(conn, windows, repeat, sessions):
+    """Mediana en ms de cada consulta para cada ventana de días"""
+    results = {}
+    now = time.time()
+    for days in windows:
+        params = {
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now - days * 86400)),
+            "end": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+            "session": f"sess-{sessions // 2:010d}",
+        }
+        for name, sql in DASHBOARD_QUERIES.items():
+            if name == "sesion" and days != windows[0]:
+                continue
+            timings = []
+            for _ in range(repeat):
+                began = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                timings.append((time.perf_counter() - began) * 1000)
+            label = name if name == "sesion" else f"{name} ({days}d)"
+            results[label] = statistics.median(timings)
+    return results
+
+
+def startup_cost(path, repeat):
+    """ms de arranque: DDL completo (antes) frente a leer PRAGMA user_version (después)"""
+    legacy = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        conn = sqlite3.connect(path)
+        for statement in ANALYTICS_MIGRATIONS[0].statements:
+            conn.execute(statement)
+        conn.commit()
+        conn.close()
+        legacy.append((time.perf_counter() - began) * 1000)
+    current = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        migrate_analytics(path)
+        current.append((time.perf_counter() - began) * 1000)
+    return statistics.median(legacy), statistics.median(current)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de índices de analytics.db")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--span-days", type=int, default=365)
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 7, 30])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="Ruta de la base de datos (por defecto, temporal)")
+    args = parser.parse_args()
+
+    directory = None
+    if args.db:
+        path = args.db
+    else:
+        directory = tempfile.TemporaryDirectory(prefix="son1k_analytics_bench_")
+        path = os.path.join(directory.name, "analytics.db")
+
+    try:
+        migrate(path, ANALYTICS_MIGRATIONS[:1])
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+
+        print(f"🔍 Generando datos ({args.rows:,} filas, {args.span_days} días)")
+        sessions = populate(conn, args.rows, args.span_days)
+
+        print("\n🔍 Consultas sin índices (esquema v1)")
+        before = measure(conn, args.windows, args.repeat, sessions)
+        conn.close()
+
+        began = time.perf_counter()
+        version = migrate_analytics(path)
+        print(f"\n🔧 Migración a v{version} (índices + ANALYZE) en {time.perf_counter() - began:.1f}s")
+
+        conn = sqlite3.connect(path)
+        after = measure(conn, args.windows, args.repeat, sessions)
+        conn.close()
+
+        print("\n" + "=" * 62)
+        print("📊 RESUMEN (mediana en ms)")
+        print("=" * 62)
+        for label, ms in before.items():
+            print(f"{label:<22} antes {ms:>10.1f}  después {after[label]:>10.1f}  "
+                  f"({ms / max(after[label], 1e-3):.1f}x)")
+
+        legacy, current = startup_cost(path, args.repeat)
+        print(f"\n🚀 Arranque: DDL completo {legacy:.2f} ms, esquema al día {current:.2f} ms")
+    finally:
+        if directory is not None:
+            directory.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+📊 SON1KVERS3 - Prueba de carga de simple_analytics_server
+Arranca el servidor (un solo hilo y pool de hilos) sobre una base de datos
+temporal con N generaciones sin agregados, así que cada informe recorre
+filas crudas. Mide el ritmo de ingesta de interacciones sola y mientras
+otros clientes piden informes pesados sin parar. Con --batch N cada
+petición de ingesta manda N interacciones a /api/track/batch.
+
+Uso:
+    python benchmark_analytics_concurrency.py --rows 1000000 --duration 10
+    python benchmark_analytics_concurrency.py --rows 100000 --batch 50
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from backend.app.analytics_schema import ANALYTICS_MIGRATIONS, migrate_analytics
+from backend.app.migrations import migrate
+from benchmark_analytics import populate
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def request(port, method, path, body=None, timeout=60):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        payload = body
+        if body is not None and not isinstance(body, bytes):
+            payload = json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"} if payload else {}
+        conn.request(method, path, payload, headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def start_server(directory, port, workers):
+    """Lanzar el servidor en otro proceso (analytics.db dentro de ``directory``)"""
+    # ROLLUP_REFRESH_MAX_DAYS=0: los informes siguen igual de pesados toda la prueba
+    env = dict(os.environ, ANALYTICS_HOST="127.0.0.1", ANALYTICS_PORT=str(port),
+               ANALYTICS_WORKERS=str(workers), ROLLUP_REFRESH_MAX_DAYS="0", PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "simple_analytics_server.py")],
+                               cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if request(port, "GET", "/api/health", timeout=1) == 200:
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("el servidor no arrancó")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_phase(port, duration, ingest_clients, report_clients, report_days, batch=1):
+    """Clientes de ingesta (y de informes) durante ``duration`` segundos"""
+    stop = threading.Event()
+    ingest_latencies, report_latencies, errors = [], [], []
+    lock = threading.Lock()
+
+    def ingest(n):
+        body = {"session_id": f"bench-{n}", "user_id": f"user-{n}", "action": "click",
+                "element": "button", "metadata": {}}
+        path = "/api/track/interaction"
+        if batch > 1:
+            path = "/api/track/batch"
+            body = "\n".join(json.dumps(dict(body, type="interaction")) for _ in range(batch)).encode()
+        while not stop.is_set():
+            began = time.perf_counter()
+            try:
+                status = request(port, "POST", path, body)
+            except OSError as e:
+                status = str(e)
+            with lock:
+                (ingest_latencies if status == 200 else errors).append(time.perf_counter() - began)
+
+    def report():
+        while not stop.is_set():
+            began = time.perf_counter()
+            try:
+                status = request(port, "GET", f"/api/analytics?days={report_days}", timeout=300)
+            except OSError as e:
+                status = str(e)
+            with lock:
+                (report_latencies if status == 200 else errors).append(time.perf_counter() - began)
+
+    threads = [threading.Thread(target=ingest, args=(n,)) for n in range(ingest_clients)]
+    threads += [threading.Thread(target=report) for _ in range(report_clients)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    def p(values, q):
+        return statistics.quantiles(values, n=100)[q - 1] * 1000 if len(values) > 1 else 0.0
+
+    return {
+        "ingest_rps": len(ingest_latencies) * batch / elapsed,
+        "ingest_p50": p(ingest_latencies, 50),
+        "ingest_p99": p(ingest_latencies, 99),
+        "ingest_max": max(ingest_latencies, default=0) * 1000,
+        "reports": len(report_latencies),
+        "report_p50": p(report_latencies, 50),
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de simple_analytics_server")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--span-days", type=int, default=365)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--ingest-clients", type=int, default=8)
+    parser.add_argument("--report-clients", type=int, default=2)
+    parser.add_argument("--report-days", type=int, default=365)
+    parser.add_argument("--workers", type=int, default=16,
+                        help="Hilos del modo concurrente (se compara con 0 = un solo hilo)")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="Interacciones por petición (>1 usa /api/track/batch)")
+    parser.add_argument("--port", type=int, default=8702)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="son1k_analytics_load_") as directory:
+        path = os.path.join(directory, "analytics.db")
+        migrate(path, ANALYTICS_MIGRATIONS[:2])
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        print(f"🔍 Generando datos ({args.rows:,} filas, {args.span_days} días)")
+        populate(conn, args.rows, args.span_days)
+        conn.close()
+        # Todos los días quedan sucios: los informes recorren filas crudas
+        migrate_analytics(path)
+
+        results = {}
+        for workers in (0, args.workers):
+            mode = "un solo hilo" if workers == 0 else f"{workers} hilos"
+            process = start_server(directory, args.port, workers)
+            try:
+                print(f"\n🔍 {mode}: sólo ingesta")
+                alone = run_phase(args.port, args.duration, args.ingest_clients, 0,
+                                  args.report_days, args.batch)
+                print(f"🔍 {mode}: ingesta + {args.report_clients} clientes de informes "
+                      f"({args.report_days} días)")
+                loaded = run_phase(args.port, args.duration, args.ingest_clients,
+                                   args.report_clients, args.report_days, args.batch)
+            finally:
+                stop_server(process)
+            results[mode] = (alone, loaded)
+
+        print("\n" + "=" * 78)
+        print(f"📊 RESUMEN (ingesta en eventos/s, {args.batch} por petición; latencias en ms)")
+        print("=" * 78)
+        for mode, (alone, loaded) in results.items():
+            print(f"{mode:<14} sola {alone['ingest_rps']:>7.0f} ev/s (p99 {alone['ingest_p99']:.1f})  "
+                  f"con informes {loaded['ingest_rps']:>7.0f} ev/s (p99 {loaded['ingest_p99']:.1f}, "
+                  f"máx {loaded['ingest_max']:.0f})  informes {loaded['reports']} "
+                  f"(p50 {loaded['report_p50']:.0f})  errores {alone['errors'] + loaded['errors']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
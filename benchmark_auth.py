@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+📊 SON1KVERS3 - Microbenchmark de autenticación
+Coste de verify_token por petición con la caché de JWT activada y desactivada
+
+Uso:
+    python benchmark_auth.py --iterations 50000 --tokens 100
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'son1k.db')}")
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+from backend.app.main import create_access_token, verify_token
+from backend.app.auth_cache import token_cache
+
+
+def measure(credentials, iterations):
+    """Microsegundos por llamada a verify_token"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        verify_token(credentials[i % len(credentials)])
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark de verify_token")
+    parser.add_argument("--iterations", type=int, default=50000)
+    parser.add_argument("--tokens", type=int, default=100, help="usuarios distintos en rotación")
+    args = parser.parse_args()
+
+    credentials = [
+        HTTPAuthorizationCredentials(
+            scheme="Bearer",
+            credentials=create_access_token({"user_id": i, "email": f"user{i}@son1k.dev"})
+        )
+        for i in range(args.tokens)
+    ]
+
+    token_cache.enabled = False
+    off = measure(credentials, args.iterations)
+
+    token_cache.enabled = True
+    token_cache.clear()
+    on = measure(credentials, args.iterations)
+
+    print("📊 Coste de autenticación por petición")
+    print(f"   sin caché  {off:8.2f} µs")
+    print(f"   con caché  {on:8.2f} µs  ({off / on:.1f}x)")
+    print(f"   {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+📊 SON1KVERS3 - Benchmark del proxy híbrido
+Compara el proxy anterior (requests.post + response.json() por petición)
+con el proxy inverso en streaming de main.py frente a un upstream simulado
+
+Uso:
+    python benchmark_proxy.py --requests 2000 --concurrency 16 --payload-kb 4 256
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+PAYLOAD_KB = 4
+
+# Upstream simulado: responde JSON del tamaño pedido en "kb"
+upstream_app = FastAPI()
+_payload_cache = {}
+
+
+def _payload(kb):
+    if kb not in _payload_cache:
+        urls = [f"https://cdn.son1k.dev/audio/{i:06d}.mp3" for i in range(max(1, kb * 1024 // 40))]
+        _payload_cache[kb] = json.dumps({"success": True, "audioUrls": urls}).encode()
+    return _payload_cache[kb]
+
+
+@upstream_app.get("/health")
+async def upstream_health():
+    return {"status": "healthy"}
+
+
+@upstream_app.post("/generate-music")
+async def upstream_generate(request: Request):
+    body = await request.json()
+    return Response(_payload(int(body.get("kb", PAYLOAD_KB))), media_type="application/json")
+
+
+# Proxy anterior, tal como estaba en start_hybrid_server
+legacy_app = FastAPI()
+UPSTREAM_PORT = int(os.environ.get("BENCH_UPSTREAM_PORT", "3901"))
+
+
+@legacy_app.get("/health")
+def legacy_health():
+    return {"status": "healthy"}
+
+
+@legacy_app.post("/generate-music")
+def legacy_generate(request: dict):
+    try:
+        import requests
+        response = requests.post(
+            f"http://localhost:{UPSTREAM_PORT}/generate-music",
+            json=request,
+            timeout=30
+        )
+        return response.json()
+    except Exception:
+        return {"success": False, "error": "Servicio de generación no disponible", "fallback": True}
+
+
+def http(url, kb):
+    """POST mínimo con urllib; devuelve bytes recibidos"""
+    body = json.dumps({"prompt": "bench", "style": "synthwave", "kb": kb}).encode()
+    req = urllib.request.Request(url, data=body, method="POST",
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return len(response.read())
+
+
+def wait_until_ready(base_url, timeout=30):
+    """Esperar a que el servidor responda /health"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def run_load(label, url, kb, total, concurrency):
+    """Lanzar `total` peticiones con `concurrency` hilos; devuelve (req/s, MB/s)"""
+    def call(_):
+        try:
+            return http(url, kb)
+        except Exception:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        sizes = list(pool.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    errors = sizes.count(None)
+    received = sum(size for size in sizes if size)
+    rps, mbps = total / elapsed, received / elapsed / 1e6
+    print(f"   {label:<10} {kb:>5} KB  {rps:>9.1f} req/s  {mbps:>8.1f} MB/s  ({errors} errores)")
+    return rps, mbps
+
+
+def spawn(args, env=None):
+    return subprocess.Popen(args, env={**os.environ, **(env or {})},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def uvicorn_cmd(app, port):
+    return [sys.executable, "-m", "uvicorn", f"benchmark_proxy:{app}",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del proxy híbrido")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--payload-kb", type=int, nargs="+", default=[4, 256])
+    parser.add_argument("--port", type=int, default=8770)
+    args = parser.parse_args()
+
+    upstream_port, legacy_port, hybrid_port = args.port, args.port + 1, args.port + 2
+    env = {"BENCH_UPSTREAM_PORT": str(upstream_port)}
+    processes = [
+        spawn(uvicorn_cmd("upstream_app", upstream_port), env),
+        spawn(uvicorn_cmd("legacy_app", legacy_port), env),
+        spawn([sys.executable, "main.py"], {
+            "PORT": str(hybrid_port), "START_CHILDREN": "0",
+            "NODE_SERVER_PORT": str(upstream_port), "PYTHON_SERVER_PORT": str(upstream_port),
+        }),
+    ]
+    try:
+        for port in (upstream_port, legacy_port, hybrid_port):
+            if not wait_until_ready(f"http://127.0.0.1:{port}"):
+                raise RuntimeError(f"El servidor en el puerto {port} no arrancó")
+
+        results = {}
+        for kb in args.payload_kb:
+            print(f"\n🔍 Respuesta de {kb} KB")
+            for label, port in (("anterior", legacy_port), ("streaming", hybrid_port)):
+                url = f"http://127.0.0.1:{port}/generate-music"
+                run_load(label, url, kb, min(50, args.requests), args.concurrency)  # calentamiento
+                results[label, kb] = run_load(label, url, kb, args.requests, args.concurrency)
+
+        print("\n" + "=" * 50)
+        print("📊 RESUMEN")
+        print("=" * 50)
+        for kb in args.payload_kb:
+            before, after = results["anterior", kb], results["streaming", kb]
+            print(f"{kb:>5} KB  antes {before[0]:>8.1f} req/s  después {after[0]:>8.1f} req/s  "
+                  f"({after[0] / before[0]:.2f}x)")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+📊 SON1KVERS3 - Benchmark de almacenamiento SQLite
+Compara req/s de /api/auth/login y /api/tracks con y sin el pool de conexiones
+
+Uso:
+    python benchmark_storage.py --requests 2000 --concurrency 16
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+EMAIL = "bench@son1k.dev"
+PASSWORD = "bench_password"
+
+
+def http(method, url, payload=None):
+    """Petición HTTP mínima con urllib"""
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, method=method,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        response.read()
+        return response.status
+
+
+def wait_until_ready(base_url, timeout=30):
+    """Esperar a que el servidor responda /health"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if http("GET", f"{base_url}/health") == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def seed(base_url, db_path, tracks):
+    """Crear usuario de prueba y tracks"""
+    http("POST", f"{base_url}/api/auth/register", {
+        "username": "bench", "email": EMAIL, "password": PASSWORD
+    })
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO tracks (title, artist, audio_url, duration, genre, mood) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"Track {i}", "Son1k", f"https://cdn.son1k.dev/{i}.mp3", 180, "synthwave", "epic")
+         for i in range(tracks)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_load(label, fn, total, concurrency):
+    """Lanzar `total` peticiones con `concurrency` hilos y devolver req/s"""
+    errors = 0
+
+    def call(_):
+        nonlocal errors
+        try:
+            fn()
+        except Exception:
+            errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    rps = total / elapsed
+    print(f"   {label:<8} {rps:>10.1f} req/s  ({errors} errores)")
+    return rps
+
+
+def bench_mode(pooled, port, total, concurrency, tracks):
+    """Arrancar el backend en un modo y medir ambos endpoints"""
+    tmpdir = tempfile.mkdtemp(prefix="son1k_bench_")
+    db_path = os.path.join(tmpdir, "son1k.db")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SQLITE_POOL_ENABLED": "1" if pooled else "0",
+    }
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.app.main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+    try:
+        if not wait_until_ready(base_url):
+            raise RuntimeError("El backend no arrancó")
+        seed(base_url, db_path, tracks)
+
+        print(f"\n🔍 Modo {'pool + WAL' if pooled else 'conexión por petición'}")
+        login = run_load("login", lambda: http("POST", f"{base_url}/api/auth/login",
+                                                {"email": EMAIL, "password": PASSWORD}),
+                         total, concurrency)
+        tracks_rps = run_load("tracks", lambda: http("GET", f"{base_url}/api/tracks"),
+                              total, concurrency)
+        return login, tracks_rps
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pool SQLite")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--tracks", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    before = bench_mode(False, args.port, args.requests, args.concurrency, args.tracks)
+    after = bench_mode(True, args.port + 1, args.requests, args.concurrency, args.tracks)
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN")
+    print("=" * 50)
+    for name, b, a in (("login", before[0], after[0]), ("tracks", before[1], after[1])):
+        print(f"{name:<8} antes {b:>9.1f}  después {a:>9.1f}  ({a / b:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,126 +6,355 @@ Sistema híbrido que combina FastAPI backend con Node.js wrapper
 
 import os
 import sys
+import socket
 import subprocess
 import threading
+import multiprocessing
 import time
 import signal
 from pathlib import Path
 
 # Configuración
 PORT = int(os.environ.get("PORT", 8000))
-NODE_SERVER_PORT = 3001
-PYTHON_SERVER_PORT = 8000
+NODE_SERVER_PORT = int(os.environ.get("NODE_SERVER_PORT", 3001))
+PYTHON_SERVER_PORT = int(os.environ.get("PYTHON_SERVER_PORT", 8010))
+NODE_CONNECT_TIMEOUT = float(os.environ.get("NODE_CONNECT_TIMEOUT", 2))
+NODE_READ_TIMEOUT = float(os.environ.get("NODE_READ_TIMEOUT", 120))
+# Arrancar los procesos hijo Node.js y uvicorn detrás del proxy
+START_CHILDREN = os.environ.get("START_CHILDREN", "1") != "0"
+
+# Rutas que van al backend FastAPI; el resto se envía a Node.js
+PYTHON_ROUTE_PREFIXES = ("/api/", "/docs", "/redoc", "/openapi.json")
+
+# Pre-fork: WEB_CONCURRENCY procesos del proxy (por defecto, uno por CPU disponible)
+AVAILABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", 0)) or AVAILABLE_CPUS
+# REUSE_PORT=1: cada worker abre su socket con SO_REUSEPORT (reparto en el kernel)
+REUSE_PORT = os.environ.get("REUSE_PORT", "0") == "1" and hasattr(socket, "SO_REUSEPORT")
+GRACEFUL_TIMEOUT = float(os.environ.get("GRACEFUL_TIMEOUT", 30))
+WORKER_HEARTBEAT_TIMEOUT = float(os.environ.get("WORKER_HEARTBEAT_TIMEOUT", 30))
+WORKER_STARTUP_TIMEOUT = float(os.environ.get("WORKER_STARTUP_TIMEOUT", 60))
+WORKER_MAX_BACKOFF = float(os.environ.get("WORKER_MAX_BACKOFF", 30))
+# Procesos uvicorn del backend FastAPI (por defecto, tantos como workers del proxy).
+# Cola de trabajos, claves de idempotencia y migraciones se coordinan en la base
+# de datos; admisión, single-flight y cachés en memoria son por proceso, así que
+# ADMISSION_MAX_CONCURRENCY y GENERATION_WORKERS se multiplican por este número
+PYTHON_WORKERS = int(os.environ.get("PYTHON_WORKERS", 0)) or WORKERS
+
+# Pool de wrappers Node.js en puertos consecutivos desde NODE_SERVER_PORT
+# (por defecto, uno por CPU disponible)
+NODE_POOL_SIZE = int(os.environ.get("NODE_POOL_SIZE", 0)) or AVAILABLE_CPUS
+NODE_PORTS = [NODE_SERVER_PORT + i for i in range(NODE_POOL_SIZE)]
+
+def create_hybrid_app(heartbeat=None):
+    """Construir el proxy inverso híbrido delante de Node.js y FastAPI"""
+    import asyncio
+    from fastapi import FastAPI, Request
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import JSONResponse, Response
+    import requests
+    from backend.app.metrics import install_fastapi
+    from backend.app.deadline import install_deadlines
+    from backend.app.loop_monitor import monitor_fastapi
+    from backend.app.balancer import LeastOutstandingBalancer
+    from backend.app.circuit import CircuitBreaker, CircuitOpen
+    from backend.app.proxy import StreamingProxy, UpstreamError
+    
+    # Sin /docs propios: se sirven los del backend a través del proxy
+    app = FastAPI(title="Son1kVers3 Hybrid Server",
+                  docs_url=None, redoc_url=None, openapi_url=None)
+    python_url = f"http://127.0.0.1:{PYTHON_SERVER_PORT}"
+    
+    def probe(url):
+        return lambda: requests.get(f"{url}/health", timeout=NODE_CONNECT_TIMEOUT).ok
+    
+    # Node.js: la instancia lista con menos peticiones en curso; las caídas
+    # salen del reparto hasta que vuelven a responder /health
+    node_pool = LeastOutstandingBalancer("node", [f"http://127.0.0.1:{port}" for port in NODE_PORTS])
+    # Con el backend caído se responde al instante en vez de esperar el timeout
+    python_breaker = CircuitBreaker("backend", probe=probe(python_url))
+    node_proxy = StreamingProxy("node", read_timeout=NODE_READ_TIMEOUT, balancer=node_pool)
+    python_proxy = StreamingProxy("backend", python_url, python_breaker)
+    
+    @app.on_event("startup")
+    async def startup():
+        node_pool.start_probing()
+        python_breaker.start_probing()
+        if heartbeat is not None:
+            # Latido para el supervisor: se detiene si el event loop se bloquea
+            async def beat():
+                while True:
+                    heartbeat.value = time.time()
+                    await asyncio.sleep(1)
+            app.state.heartbeat_task = asyncio.create_task(beat())
+    
+    @app.on_event("shutdown")
+    async def shutdown():
+        node_pool.stop_probing()
+        python_breaker.stop_probing()
+        await node_proxy.close()
+        await python_proxy.close()
+    
+    # CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    # Plazos (X-Request-Deadline) y cancelación si el cliente se desconecta;
+    # la cabecera se reenvía tal cual a Node.js y al backend
+    install_deadlines(app, service="hybrid")
+    
+    # Métricas Prometheus en /metrics
+    install_fastapi(app, service="hybrid")
+    
+    # Retraso del event loop y llamadas bloqueantes (opcional, LOOP_MONITOR=1)
+    monitor_fastapi(app, service="hybrid")
+    
+    @app.get("/")
+    def root():
+        return {
+            "message": "Son1kVers3 Hybrid Server",
+            "status": "running",
+            "version": "3.0.0",
+            "endpoints": {
+                "health": "/health",
+                "generate": "/generate-music",
+                "api": "/api/*",
+                "stats": "/stats",
+                "metrics": "/metrics"
+            }
+        }
+    
+    @app.get("/health")
+    def health():
+        return {
+            "status": "healthy",
+            "service": "Son1kVers3",
+            "node_ready": f"{len(node_pool.ready_endpoints())}/{len(node_pool.endpoints)}",
+            "backend_circuit": python_breaker.state,
+            "timestamp": time.time()
+        }
+    
+    @app.post("/generate-music")
+    async def generate_music(request: Request):
+        # Proxy en streaming al servidor Node.js si está disponible
+        try:
+            return await node_proxy.forward(request)
+        except CircuitOpen as e:
+            return {
+                "success": False,
+                "error": "Servicio de generación no disponible",
+                "fallback": True,
+                "retry_after": e.retry_after
+            }
+        except UpstreamError as e:
+            print(f"⚠️ Error llamando a Node.js: {e}")
+            return {
+                "success": False,
+                "error": "Servicio de generación no disponible",
+                "fallback": True
+            }
+    
+    @app.post("/add-cookie")
+    async def add_cookie(request: Request):
+        # Cada proceso Node.js tiene su propio pool de cookies: añadirla en todos
+        results = await node_proxy.broadcast(request)
+        answered = [(status, body) for _, status, body in results if status != 502]
+        if not answered:
+            return JSONResponse(status_code=503,
+                                content={"success": False, "error": "Servicio Node.js no disponible"})
+        ok = sum(status == 200 for status, _ in answered)
+        status, body = max(answered, key=lambda item: item[0] == 200)
+        return Response(body, status_code=status, media_type="application/json",
+                        headers={"X-Node-Instances": f"{ok}/{len(results)}"})
+    
+    @app.get("/stats")
+    def stats():
+        return {
+            "status": "running",
+            "uptime": time.time(),
+            "hybrid_mode": True,
+            "node_pool": node_pool.stats(),
+            "backend_circuit": python_breaker.stats()
+        }
+    
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"],
+                   include_in_schema=False)
+    async def proxy(request: Request, path: str):
+        upstream = python_proxy if request.url.path.startswith(PYTHON_ROUTE_PREFIXES) else node_proxy
+        try:
+            return await upstream.forward(request)
+        except CircuitOpen as e:
+            return JSONResponse(status_code=503, headers={"Retry-After": str(int(e.retry_after))},
+                                content={"detail": f"Servicio {upstream.name} no disponible"})
+        except UpstreamError as e:
+            print(f"⚠️ Error en proxy hacia {upstream.name}: {e}")
+            return JSONResponse(status_code=502,
+                                content={"detail": f"Servicio {upstream.name} no disponible"})
+    
+    return app
+
+def bind_socket(reuse_port=False):
+    """Socket de escucha compartido por los workers del proxy"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("0.0.0.0", PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def run_hybrid_worker(sock, heartbeat):
+    """Proceso worker: un servidor uvicorn sobre el socket compartido"""
+    import uvicorn
+    if sock is None:
+        sock = bind_socket(reuse_port=True)
+    config = uvicorn.Config(create_hybrid_app(heartbeat), timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+    # uvicorn instala sus manejadores: SIGTERM deja de aceptar y espera a las peticiones en curso
+    uvicorn.Server(config).run(sockets=[sock])
+
+class HybridWorker:
+    """Un proceso worker del proxy con su latido y su historial de reinicios"""
+    
+    def __init__(self, ctx, index, sock, backoff=0.0):
+        self.index = index
+        self.heartbeat = ctx.Value("d", 0.0, lock=False)
+        self.process = ctx.Process(target=run_hybrid_worker, args=(sock, self.heartbeat),
+                                   name=f"son1k-worker-{index}")
+        self.backoff = backoff
+        self.started_at = time.time()
+        self.stop_deadline = None
+        self.restart_at = None
+    
+    def start(self):
+        self.started_at = time.time()
+        self.process.start()
+        return self
+    
+    @property
+    def ready(self):
+        return self.heartbeat.value > 0
+    
+    def stalled(self, now):
+        """Sin latido reciente (event loop bloqueado) o sin arrancar a tiempo"""
+        if not self.ready:
+            return now - self.started_at > WORKER_STARTUP_TIMEOUT
+        return now - self.heartbeat.value > WORKER_HEARTBEAT_TIMEOUT
+    
+    def stop(self):
+        """Parada ordenada: el worker drena sus peticiones en curso"""
+        if self.process.is_alive() and self.stop_deadline is None:
+            self.stop_deadline = time.time() + GRACEFUL_TIMEOUT + 5
+            os.kill(self.process.pid, signal.SIGTERM)
+    
+    def reap(self, now):
+        """True cuando el proceso ya terminó; mata al que excede el plazo de drenaje"""
+        if not self.process.is_alive():
+            self.process.join(timeout=0)
+            return True
+        if self.stop_deadline is not None and now > self.stop_deadline:
+            print(f"⚠️ Worker {self.index} (pid {self.process.pid}) no terminó a tiempo, forzando cierre")
+            self.process.kill()
+        return False
 
 class Son1kServer:
     def __init__(self):
-        self.node_process = None
+        self.node_processes = {}
+        self.node_started = {}
         self.python_process = None
         self.running = True
+        self.reload_requested = False
+        self.workers = []
+        self.retiring = []
+        self.listen_sock = None
         
+    def spawn_node(self, port):
+        self.node_processes[port] = subprocess.Popen([
+            "node", "suno_wrapper_server.js"
+        ], env={**os.environ, "PORT": str(port)})
+        self.node_started[port] = time.time()
+    
     def start_node_server(self):
-        """Iniciar servidor Node.js (suno_wrapper_server.js)"""
+        """Iniciar el pool de servidores Node.js (suno_wrapper_server.js)"""
         try:
-            print("🚀 Iniciando servidor Node.js...")
-            self.node_process = subprocess.Popen([
-                "node", "suno_wrapper_server.js"
-            ], env={**os.environ, "PORT": str(NODE_SERVER_PORT)})
-            print(f"✅ Servidor Node.js iniciado en puerto {NODE_SERVER_PORT}")
+            print(f"🚀 Iniciando {NODE_POOL_SIZE} servidores Node.js...")
+            for port in NODE_PORTS:
+                self.spawn_node(port)
+            print(f"✅ Servidores Node.js iniciados en puertos {NODE_PORTS[0]}-{NODE_PORTS[-1]}")
+            threading.Thread(target=self.watch_node_servers, name="node-supervisor", daemon=True).start()
         except Exception as e:
             print(f"❌ Error iniciando servidor Node.js: {e}")
     
+    def watch_node_servers(self):
+        """Reemplazar los procesos Node.js que terminan, con backoff exponencial"""
+        backoff = {port: 0.0 for port in NODE_PORTS}
+        restart_at = {}
+        while self.running:
+            now = time.time()
+            for port, process in list(self.node_processes.items()):
+                if process.poll() is None:
+                    continue
+                if port not in restart_at:
+                    # Un proceso que cae nada más arrancar espera cada vez más antes de volver
+                    stable = now - self.node_started[port] > 2 * WORKER_MAX_BACKOFF
+                    backoff[port] = 0.0 if stable else min(max(1.0, backoff[port] * 2), WORKER_MAX_BACKOFF)
+                    restart_at[port] = now + backoff[port]
+                    print(f"💥 Node.js en puerto {port} terminó (código {process.returncode}), "
+                          f"reinicio en {backoff[port]:.0f}s")
+                if now >= restart_at[port] and self.running:
+                    del restart_at[port]
+                    try:
+                        self.spawn_node(port)
+                        print(f"✅ Node.js reiniciado en puerto {port}")
+                    except Exception as e:
+                        print(f"❌ Error reiniciando Node.js en puerto {port}: {e}")
+                        self.node_started[port] = now
+            time.sleep(0.5)
+    
     def start_python_server(self):
         """Iniciar servidor Python (FastAPI)"""
         try:
             print("🐍 Iniciando servidor Python...")
-            # Cambiar al directorio backend
+            # Ejecutar desde el directorio backend sin cambiar el cwd de este proceso
             backend_dir = Path("backend")
-            if backend_dir.exists():
-                os.chdir(backend_dir)
             
             # Activar entorno virtual si existe
-            venv_python = Path("../.venv/bin/python")
+            venv_python = Path(".venv/bin/python")
             if venv_python.exists():
-                python_cmd = str(venv_python)
+                python_cmd = str(venv_python.resolve())
             else:
                 python_cmd = "python3"
             
+            # --workers explícito: si no, uvicorn tomaría WEB_CONCURRENCY del entorno.
+            # Con más de uno, uvicorn reparte el socket entre sus procesos y los reinicia si caen
             self.python_process = subprocess.Popen([
                 python_cmd, "-m", "uvicorn", "app.main:app",
-                "--host", "0.0.0.0", "--port", str(PYTHON_SERVER_PORT)
-            ])
-            print(f"✅ Servidor Python iniciado en puerto {PYTHON_SERVER_PORT}")
+                "--host", "127.0.0.1", "--port", str(PYTHON_SERVER_PORT),
+                "--workers", str(PYTHON_WORKERS),
+                "--timeout-graceful-shutdown", str(int(GRACEFUL_TIMEOUT))
+            ], cwd=backend_dir if backend_dir.exists() else None, env={
+                **os.environ,
+                # El backend reparte sus llamadas entre el mismo pool de Node.js
+                "NODE_SERVER_URL": f"http://127.0.0.1:{NODE_SERVER_PORT}",
+                "NODE_POOL_SIZE": str(NODE_POOL_SIZE),
+            })
+            print(f"✅ Servidor Python iniciado en puerto {PYTHON_SERVER_PORT} "
+                  f"con {PYTHON_WORKERS} procesos")
         except Exception as e:
             print(f"❌ Error iniciando servidor Python: {e}")
     
     def start_hybrid_server(self):
-        """Iniciar servidor híbrido simple con FastAPI"""
+        """Iniciar el proxy inverso híbrido delante de Node.js y FastAPI"""
         try:
-            from fastapi import FastAPI
-            from fastapi.middleware.cors import CORSMiddleware
-            from fastapi.responses import JSONResponse
             import uvicorn
-            
-            app = FastAPI(title="Son1kVers3 Hybrid Server")
-            
-            # CORS
-            app.add_middleware(
-                CORSMiddleware,
-                allow_origins=["*"],
-                allow_credentials=True,
-                allow_methods=["*"],
-                allow_headers=["*"],
-            )
-            
-            @app.get("/")
-            def root():
-                return {
-                    "message": "Son1kVers3 Hybrid Server",
-                    "status": "running",
-                    "version": "3.0.0",
-                    "endpoints": {
-                        "health": "/health",
-                        "generate": "/generate-music",
-                        "stats": "/stats"
-                    }
-                }
-            
-            @app.get("/health")
-            def health():
-                return {
-                    "status": "healthy",
-                    "service": "Son1kVers3",
-                    "timestamp": time.time()
-                }
-            
-            @app.post("/generate-music")
-            def generate_music(request: dict):
-                # Proxy al servidor Node.js si está disponible
-                try:
-                    import requests
-                    response = requests.post(
-                        f"http://localhost:{NODE_SERVER_PORT}/generate-music",
-                        json=request,
-                        timeout=30
-                    )
-                    return response.json()
-                except:
-                    return {
-                        "success": False,
-                        "error": "Servicio de generación no disponible",
-                        "fallback": True
-                    }
-            
-            @app.get("/stats")
-            def stats():
-                return {
-                    "status": "running",
-                    "uptime": time.time(),
-                    "hybrid_mode": True
-                }
-            
+            app = create_hybrid_app()
             print(f"🚀 Iniciando servidor híbrido en puerto {PORT}")
-            uvicorn.run(app, host="0.0.0.0", port=PORT)
+            uvicorn.run(app, host="0.0.0.0", port=PORT, timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
             
         except Exception as e:
             print(f"❌ Error iniciando servidor híbrido: {e}")
@@ -183,13 +412,108 @@ class Son1kServer:
         """Manejar señales de terminación"""
         print(f"\n🛑 Recibida señal {signum}, cerrando servidores...")
         self.running = False
-        
-        if self.node_process:
-            self.node_process.terminate()
-        if self.python_process:
-            self.python_process.terminate()
-        
-        sys.exit(0)
+        if not self.workers:
+            # Sin supervisor de workers: drenar los hijos y salir
+            self.stop_children()
+            sys.exit(0)
+    
+    def reload_handler(self, signum, frame):
+        """SIGHUP: reinicio escalonado de los workers"""
+        print("🔄 SIGHUP recibido, reinicio escalonado de workers...")
+        self.reload_requested = True
+    
+    def stop_children(self):
+        """Parar los procesos hijo dejando que terminen sus peticiones en curso"""
+        # Sin reinicios de Node.js a partir de aquí
+        self.running = False
+        processes = [*self.node_processes.values(), self.python_process]
+        children = [p for p in processes if p and p.poll() is None]
+        for process in children:
+            process.terminate()
+        deadline = time.time() + GRACEFUL_TIMEOUT
+        for process in children:
+            try:
+                process.wait(timeout=max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                print(f"⚠️ Proceso {process.pid} no terminó a tiempo, forzando cierre")
+                process.kill()
+    
+    # ------------------------------------------------------------------
+    # Modo multi-worker (pre-fork)
+    # ------------------------------------------------------------------
+    
+    def spawn_worker(self, index, backoff=0.0):
+        ctx = multiprocessing.get_context("spawn")
+        worker = HybridWorker(ctx, index, self.listen_sock, backoff).start()
+        print(f"👷 Worker {index} iniciado (pid {worker.process.pid})")
+        return worker
+    
+    def supervise(self):
+        """Reemplazar workers caídos o bloqueados, con backoff exponencial"""
+        now = time.time()
+        for index, worker in enumerate(self.workers):
+            if worker.stop_deadline is None and worker.process.is_alive() and worker.stalled(now):
+                print(f"⚠️ Worker {index} sin latido, reiniciando")
+                worker.process.kill()
+            if not worker.reap(now):
+                continue
+            if worker.restart_at is None:
+                # Un worker que cae nada más arrancar espera cada vez más antes de volver
+                stable = now - worker.started_at > 2 * WORKER_MAX_BACKOFF
+                worker.backoff = 0.0 if stable else min(max(1.0, worker.backoff * 2), WORKER_MAX_BACKOFF)
+                worker.restart_at = now + worker.backoff
+                print(f"💥 Worker {index} terminó (código {worker.process.exitcode}), "
+                      f"reinicio en {worker.backoff:.0f}s")
+            if now >= worker.restart_at:
+                self.workers[index] = self.spawn_worker(index, worker.backoff)
+        self.retiring = [w for w in self.retiring if not w.reap(now)]
+    
+    def rolling_restart(self):
+        """Reemplazar los workers de uno en uno sin dejar de aceptar conexiones"""
+        self.reload_requested = False
+        for index, old in enumerate(list(self.workers)):
+            new = self.spawn_worker(index)
+            deadline = time.time() + WORKER_STARTUP_TIMEOUT
+            while self.running and not new.ready and new.process.is_alive() and time.time() < deadline:
+                time.sleep(0.2)
+            if not new.ready:
+                print(f"❌ El worker {index} nuevo no arrancó; se cancela el reinicio escalonado")
+                new.process.kill()
+                new.process.join()
+                return
+            self.workers[index] = new
+            old.stop()
+            self.retiring.append(old)
+        print("✅ Reinicio escalonado completado")
+    
+    def drain_workers(self):
+        """SIGTERM: los workers dejan de aceptar y terminan sus peticiones en curso"""
+        workers = self.workers + self.retiring
+        for worker in workers:
+            worker.stop()
+        while any(not worker.reap(time.time()) for worker in workers):
+            time.sleep(0.2)
+        print("✅ Workers detenidos")
+    
+    def start_workers(self):
+        """Supervisor pre-fork del proxy híbrido"""
+        if not REUSE_PORT:
+            self.listen_sock = bind_socket()
+        print(f"🚀 Iniciando servidor híbrido en puerto {PORT} con {WORKERS} workers"
+              f"{' (SO_REUSEPORT)' if REUSE_PORT else ''}")
+        self.workers = [self.spawn_worker(i) for i in range(WORKERS)]
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.reload_handler)
+        try:
+            while self.running:
+                if self.reload_requested:
+                    self.rolling_restart()
+                self.supervise()
+                time.sleep(0.5)
+        finally:
+            self.drain_workers()
+            if self.listen_sock is not None:
+                self.listen_sock.close()
     
     def run(self):
         """Ejecutar servidor principal"""
@@ -200,19 +524,28 @@ class Son1kServer:
         print("🎵 Son1kVers3 - Servidor Principal")
         print("=" * 40)
         print(f"Puerto principal: {PORT}")
-        print(f"Puerto Node.js: {NODE_SERVER_PORT}")
+        print(f"Puertos Node.js: {NODE_PORTS[0]}-{NODE_PORTS[-1]}")
         print(f"Puerto Python: {PYTHON_SERVER_PORT}")
+        print(f"Workers: {WORKERS} (backend: {PYTHON_WORKERS})")
         print("=" * 40)
         
-        # Verificar si estamos en Railway
-        if os.environ.get("RAILWAY_ENVIRONMENT"):
-            print("🚂 Detectado entorno Railway")
-            # En Railway, usar servidor híbrido
-            self.start_hybrid_server()
-        else:
-            print("💻 Entorno local detectado")
-            # En local, intentar servidor híbrido
-            self.start_hybrid_server()
+        if START_CHILDREN:
+            self.start_node_server()
+            self.start_python_server()
+        
+        try:
+            # Verificar si estamos en Railway
+            if os.environ.get("RAILWAY_ENVIRONMENT"):
+                print("🚂 Detectado entorno Railway")
+            else:
+                print("💻 Entorno local detectado")
+            if WORKERS > 1:
+                self.start_workers()
+            else:
+                self.start_hybrid_server()
+        finally:
+            # uvicorn instala sus propios manejadores de señales
+            self.stop_children()
 
 if __name__ == "__main__":
     server = Son1kServer()
@@ -12,15 +12,29 @@ from pydantic import BaseModel
 from typing import List, Dict, Optional
 import logging
 
+from backend.app.deadline import DeadlineExceeded, expired, install_deadlines, remaining
+from backend.app.metrics import install_fastapi, time_upstream
+from backend.app.loop_monitor import monitor_fastapi
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Nova Post Pilot API", version="1.0.0")
 
+# X-Request-Deadline support; cancel in-flight work when the client disconnects
+install_deadlines(app, service="nova_post_pilot")
+
+# Prometheus metrics on /metrics
+install_fastapi(app, service="nova_post_pilot")
+
+# Event-loop lag and blocking-call detection (opt-in, LOOP_MONITOR=1)
+monitor_fastapi(app, service="nova_post_pilot")
+
 # Ollama configuration
 OLLAMA_BASE_URL = "http://localhost:11434"
 OLLAMA_MODEL = "qwen2.5:7b"
+OLLAMA_TIMEOUT = 300.0
 
 class CreatorProfile(BaseModel):
     content_type: str
@@ -68,13 +82,23 @@ class OllamaClient:
                 "stream": False
             }
             
-            async with self.session.post(url, json=payload) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get("response", "")
-                else:
-                    logger.error(f"Ollama API error: {response.status}")
-                    return ""
+            with time_upstream("ollama"):
+                timeout = aiohttp.ClientTimeout(total=remaining(OLLAMA_TIMEOUT))
+                async with self.session.post(url, json=payload, timeout=timeout) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        return result.get("response", "")
+                    else:
+                        logger.error(f"Ollama API error: {response.status}")
+                        return ""
+        except DeadlineExceeded:
+            # Out of time: stop with 504 instead of making more upstream calls
+            raise
+        except asyncio.TimeoutError as e:
+            if expired():
+                raise DeadlineExceeded("Plazo de la petición vencido") from e
+            logger.error("Error calling Ollama: timeout")
+            return ""
         except Exception as e:
             logger.error(f"Error calling Ollama: {e}")
             return ""
@@ -283,6 +307,8 @@ async def analyze_profile(request: MarketAnalysisRequest):
     try:
         analysis = await analyze_market_trends(request.profile)
         return {"success": True, "analysis": analysis}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Profile analysis error: {e}")
         raise HTTPException(status_code=500, detail="Analysis failed")
@@ -293,6 +319,8 @@ async def generate_hooks(request: ContentGenerationRequest):
     try:
         hooks = await generate_viral_hooks(request.profile, request.hook_style)
         return {"success": True, "hooks": hooks}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Hook generation error: {e}")
         raise HTTPException(status_code=500, detail="Hook generation failed")
@@ -303,6 +331,8 @@ async def generate_content(request: ContentGenerationRequest):
     try:
         suggestions = await generate_content_suggestions(request.profile)
         return {"success": True, "suggestions": suggestions}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Content generation error: {e}")
         raise HTTPException(status_code=500, detail="Content generation failed")
@@ -313,6 +343,8 @@ async def optimize_schedule(request: MarketAnalysisRequest):
     try:
         schedule = await optimize_posting_schedule(request.profile)
         return {"success": True, "schedule": schedule}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Schedule optimization error: {e}")
         raise HTTPException(status_code=500, detail="Schedule optimization failed")
@@ -12,6 +12,9 @@ from typing import Dict, List, Optional, Any
 import logging
 from datetime import datetime
 
+from backend.app.metrics import install_aiohttp, time_upstream
+from backend.app.loop_monitor import monitor_aiohttp
+
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -209,17 +212,18 @@ Responde SOLO con el JSON.
                     }
                 }
                 
-                async with session.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('response', '').strip()
-                    else:
-                        logger.error(f"❌ Error en llamada a Ollama: {response.status}")
-                        return ""
+                with time_upstream("ollama"):
+                    async with session.post(
+                        f"{self.base_url}/api/generate",
+                        json=payload,
+                        timeout=aiohttp.ClientTimeout(total=30)
+                    ) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            return data.get('response', '').strip()
+                        else:
+                            logger.error(f"❌ Error en llamada a Ollama: {response.status}")
+                            return ""
         except Exception as e:
             logger.error(f"❌ Error en llamada a Ollama: {e}")
             return ""
@@ -355,6 +359,8 @@ class OllamaMusicAIServer:
         self.app.router.add_post('/api/classify', self.classify_endpoint)
         self.app.router.add_post('/api/optimize', self.optimize_endpoint)
         self.app.router.add_get('/api/health', self.health_endpoint)
+        install_aiohttp(self.app, service="ollama_music_ai")
+        monitor_aiohttp(self.app, service="ollama_music_ai")
         
         # Inicializar IA
         await self.ai.init()
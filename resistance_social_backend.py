@@ -10,12 +10,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import json
-import sqlite3
 import asyncio
 import random
 from datetime import datetime, timedelta
 import uuid
 
+from backend.app.storage import get_storage
+from backend.app.metrics import install_fastapi
+from backend.app.loop_monitor import monitor_fastapi
+
 app = FastAPI(title="Resistance Social Network API", version="1.0.0")
 
 @app.get("/health")
@@ -31,98 +34,101 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics on /metrics
+install_fastapi(app, service="resistance_social")
+
+# Event-loop lag and blocking-call detection (opt-in, LOOP_MONITOR=1)
+monitor_fastapi(app, service="resistance_social")
+
 # Database setup
+db = get_storage('resistance_social.db')
+
 def init_database():
-    conn = sqlite3.connect('resistance_social.db')
-    cursor = conn.cursor()
-    
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS resistance_members (
-            id TEXT PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            display_name TEXT NOT NULL,
-            plan TEXT NOT NULL,
-            level INTEGER DEFAULT 1,
-            xp INTEGER DEFAULT 0,
-            rank TEXT DEFAULT 'Recruit',
-            online_status TEXT DEFAULT 'offline',
-            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS resistance_messages (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            message TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            message_type TEXT DEFAULT 'chat',
-            FOREIGN KEY (user_id) REFERENCES resistance_members (id)
-        )
-    ''')
+    with db.transaction() as cursor:
+        # Create tables
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS resistance_members (
+                id TEXT PRIMARY KEY,
+                username TEXT UNIQUE NOT NULL,
+                display_name TEXT NOT NULL,
+                plan TEXT NOT NULL,
+                level INTEGER DEFAULT 1,
+                xp INTEGER DEFAULT 0,
+                rank TEXT DEFAULT 'Recruit',
+                online_status TEXT DEFAULT 'offline',
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS collaborations (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT NOT NULL,
-            type TEXT NOT NULL,
-            creator_id TEXT NOT NULL,
-            members_required INTEGER NOT NULL,
-            current_members INTEGER DEFAULT 1,
-            status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (creator_id) REFERENCES resistance_members (id)
-        )
-    ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS resistance_messages (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                message_type TEXT DEFAULT 'chat',
+                FOREIGN KEY (user_id) REFERENCES resistance_members (id)
+            )
+        ''')
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS operations (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT NOT NULL,
-            difficulty TEXT NOT NULL,
-            reward_xp INTEGER NOT NULL,
-            status TEXT DEFAULT 'planned',
-            scheduled_time TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS collaborations (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                description TEXT NOT NULL,
+                type TEXT NOT NULL,
+                creator_id TEXT NOT NULL,
+                members_required INTEGER NOT NULL,
+                current_members INTEGER DEFAULT 1,
+                status TEXT DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (creator_id) REFERENCES resistance_members (id)
+            )
+        ''')
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS resistance_stats (
-            id INTEGER PRIMARY KEY,
-            pro_members INTEGER DEFAULT 0,
-            premium_members INTEGER DEFAULT 0,
-            online_members INTEGER DEFAULT 0,
-            active_operations INTEGER DEFAULT 0,
-            completed_operations INTEGER DEFAULT 0,
-            success_rate REAL DEFAULT 0.0,
-            active_collaborations INTEGER DEFAULT 0,
-            completed_collaborations INTEGER DEFAULT 0,
-            threat_level TEXT DEFAULT 'MODERATE',
-            detections INTEGER DEFAULT 0,
-            protection_level INTEGER DEFAULT 85,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS operations (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                description TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                reward_xp INTEGER NOT NULL,
+                status TEXT DEFAULT 'planned',
+                scheduled_time TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    # Insert default stats if not exists
-    cursor.execute('SELECT COUNT(*) FROM resistance_stats')
-    if cursor.fetchone()[0] == 0:
         cursor.execute('''
-            INSERT INTO resistance_stats (
-                pro_members, premium_members, online_members,
-                active_operations, completed_operations, success_rate,
-                active_collaborations, completed_collaborations,
-                threat_level, detections, protection_level
-            ) VALUES (247, 89, 23, 12, 156, 94.2, 8, 43, 'ALTO', 3, 87)
+            CREATE TABLE IF NOT EXISTS resistance_stats (
+                id INTEGER PRIMARY KEY,
+                pro_members INTEGER DEFAULT 0,
+                premium_members INTEGER DEFAULT 0,
+                online_members INTEGER DEFAULT 0,
+                active_operations INTEGER DEFAULT 0,
+                completed_operations INTEGER DEFAULT 0,
+                success_rate REAL DEFAULT 0.0,
+                active_collaborations INTEGER DEFAULT 0,
+                completed_collaborations INTEGER DEFAULT 0,
+                threat_level TEXT DEFAULT 'MODERATE',
+                detections INTEGER DEFAULT 0,
+                protection_level INTEGER DEFAULT 85,
+                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
         ''')
     
-    conn.commit()
-    conn.close()
+        # Insert default stats if not exists
+        cursor.execute('SELECT COUNT(*) FROM resistance_stats')
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('''
+                INSERT INTO resistance_stats (
+                    pro_members, premium_members, online_members,
+                    active_operations, completed_operations, success_rate,
+                    active_collaborations, completed_collaborations,
+                    threat_level, detections, protection_level
+                ) VALUES (247, 89, 23, 12, 156, 94.2, 8, 43, 'ALTO', 3, 87)
+            ''')
 
 # Initialize database on startup
 init_database()
@@ -174,11 +180,7 @@ RESISTANCE_RANKS = [
 async def get_resistance_status():
     """Get current resistance network status"""
     try:
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM resistance_stats ORDER BY last_updated DESC LIMIT 1')
-        stats = cursor.fetchone()
+        stats = db.fetchone('SELECT * FROM resistance_stats ORDER BY last_updated DESC LIMIT 1')
         
         if stats:
             return {
@@ -226,9 +228,6 @@ async def get_resistance_status():
             "status": "error",
             "error": str(e)
         }
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 @app.post("/api/resistance/chat")
 async def resistance_chat(message_data: ResistanceMessage):
@@ -245,18 +244,12 @@ async def resistance_chat(message_data: ResistanceMessage):
         ai_response = random.choice(RESISTANCE_RESPONSES)
         
         # Store message in database
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
         message_id = str(uuid.uuid4())
-        cursor.execute('''
+        db.execute('''
             INSERT INTO resistance_messages (id, user_id, message, message_type)
             VALUES (?, ?, ?, ?)
         ''', (message_id, message_data.user_id, message_data.message, 'chat'))
         
-        conn.commit()
-        conn.close()
-        
         return {
             "status": "success",
             "response": ai_response,
@@ -281,29 +274,24 @@ async def create_collaboration(collab_data: CollaborationCreate):
             }
         
         # Create collaboration
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
         collab_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO collaborations (
-                id, name, description, type, creator_id, members_required, current_members
-            ) VALUES (?, ?, ?, ?, ?, ?, 1)
-        ''', (
-            collab_id, collab_data.name, collab_data.description,
-            collab_data.type, collab_data.creator_id, collab_data.members_required
-        ))
-        
-        # Update stats
-        cursor.execute('''
-            UPDATE resistance_stats 
-            SET active_collaborations = active_collaborations + 1,
-                last_updated = CURRENT_TIMESTAMP
-            WHERE id = 1
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with db.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO collaborations (
+                    id, name, description, type, creator_id, members_required, current_members
+                ) VALUES (?, ?, ?, ?, ?, ?, 1)
+            ''', (
+                collab_id, collab_data.name, collab_data.description,
+                collab_data.type, collab_data.creator_id, collab_data.members_required
+            ))
+            
+            # Update stats
+            cursor.execute('''
+                UPDATE resistance_stats 
+                SET active_collaborations = active_collaborations + 1,
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE id = 1
+            ''')
         
         return {
             "status": "success",
@@ -321,10 +309,7 @@ async def create_collaboration(collab_data: CollaborationCreate):
 async def get_collaborations():
     """Get active collaborations"""
     try:
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        rows = db.fetchall('''
             SELECT c.*, m.display_name as creator_name
             FROM collaborations c
             JOIN resistance_members m ON c.creator_id = m.id
@@ -333,7 +318,7 @@ async def get_collaborations():
         ''')
         
         collaborations = []
-        for row in cursor.fetchall():
+        for row in rows:
             collaborations.append({
                 "id": row[0],
                 "name": row[1],
@@ -345,8 +330,6 @@ async def get_collaborations():
                 "created_at": row[7]
             })
         
-        conn.close()
-        
         return {
             "status": "success",
             "collaborations": collaborations
@@ -362,17 +345,14 @@ async def get_collaborations():
 async def get_operations():
     """Get resistance operations"""
     try:
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        rows = db.fetchall('''
             SELECT * FROM operations 
             WHERE status IN ('planned', 'active')
             ORDER BY scheduled_time ASC
         ''')
         
         operations = []
-        for row in cursor.fetchall():
+        for row in rows:
             operations.append({
                 "id": row[0],
                 "name": row[1],
@@ -383,8 +363,6 @@ async def get_operations():
                 "scheduled_time": row[6]
             })
         
-        conn.close()
-        
         return {
             "status": "success",
             "operations": operations
@@ -400,10 +378,7 @@ async def get_operations():
 async def get_online_members():
     """Get online resistance members"""
     try:
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        rows = db.fetchall('''
             SELECT display_name, online_status, last_seen
             FROM resistance_members
             WHERE online_status = 'online'
@@ -412,15 +387,13 @@ async def get_online_members():
         ''')
         
         members = []
-        for row in cursor.fetchall():
+        for row in rows:
             members.append({
                 "name": row[0],
                 "status": row[1],
                 "last_seen": row[2]
             })
         
-        conn.close()
-        
         return {
             "status": "success",
             "members": members
@@ -436,16 +409,12 @@ async def get_online_members():
 async def join_collaboration(collab_id: str, user_id: str):
     """Join a collaboration"""
     try:
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
         # Check if collaboration exists and has space
-        cursor.execute('''
+        result = db.fetchone('''
             SELECT members_required, current_members FROM collaborations
             WHERE id = ? AND status = 'active'
         ''', (collab_id,))
-        
-        result = cursor.fetchone()
+
         if not result:
             return {
                 "status": "error",
@@ -460,15 +429,12 @@ async def join_collaboration(collab_id: str, user_id: str):
             }
         
         # Add member to collaboration
-        cursor.execute('''
+        db.execute('''
             UPDATE collaborations 
             SET current_members = current_members + 1
             WHERE id = ?
         ''', (collab_id,))
         
-        conn.commit()
-        conn.close()
-        
         return {
             "status": "success",
             "message": "Te has unido a la colaboración exitosamente"
@@ -484,10 +450,7 @@ async def join_collaboration(collab_id: str, user_id: str):
 async def get_leaderboard():
     """Get resistance leaderboard"""
     try:
-        conn = sqlite3.connect('resistance_social.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        rows = db.fetchall('''
             SELECT display_name, xp, level, rank
             FROM resistance_members
             ORDER BY xp DESC
@@ -495,7 +458,7 @@ async def get_leaderboard():
         ''')
         
         leaderboard = []
-        for i, row in enumerate(cursor.fetchall(), 1):
+        for i, row in enumerate(rows, 1):
             leaderboard.append({
                 "rank": i,
                 "name": row[0],
@@ -504,8 +467,6 @@ async def get_leaderboard():
                 "rank_title": row[3]
             })
         
-        conn.close()
-        
         return {
             "status": "success",
             "leaderboard": leaderboard
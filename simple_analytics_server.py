@@ -4,6 +4,7 @@
 Servidor de analytics simplificado sin conflictos de asyncio
 """
 
+import os
 import json
 import sqlite3
 import threading
@@ -14,12 +15,32 @@ import logging
 from dataclasses import dataclass, asdict
 import uuid
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
 
+from backend.app.metrics import (
+    registry, observe_request, timed_sqlite, METRICS_ENABLED, PROMETHEUS_CONTENT_TYPE
+)
+from backend.app.analytics_schema import migrate_analytics
+from backend.app.event_batch import (
+    ANALYTICS_BATCH_MAX_BYTES, BatchError, decode_batch, validate_event
+)
+from backend.app.rollups import AnalyticsRollups
+from backend.app.storage import get_storage
+from backend.app.write_behind import WriteBehindBuffer
+
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Configuración
+ANALYTICS_HOST = os.getenv("ANALYTICS_HOST", "localhost")
+ANALYTICS_PORT = int(os.getenv("ANALYTICS_PORT", "8002"))
+# Hilos que atienden peticiones; 0 = servidor de un solo hilo
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "16"))
+# Conexiones aceptadas que pueden esperar un hilo libre
+ANALYTICS_BACKLOG = int(os.getenv("ANALYTICS_BACKLOG", "64"))
+
 @dataclass
 class MusicGenerationEvent:
     """Evento de generación musical"""
@@ -73,215 +94,82 @@ class SimpleAnalyticsDatabase:
         self.db_path = db_path
         self.lock = threading.Lock()
         self.init_database()
-    
-    def init_database(self):
-        """Inicializar base de datos"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Tabla de eventos de generación musical
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS music_generations (
-                    id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL,
-                    prompt TEXT NOT NULL,
-                    style TEXT NOT NULL,
-                    duration REAL NOT NULL,
-                    tempo INTEGER NOT NULL,
-                    scale TEXT NOT NULL,
-                    instruments TEXT NOT NULL,
-                    mood TEXT NOT NULL,
-                    ai_enhanced BOOLEAN NOT NULL,
-                    generation_time REAL NOT NULL,
-                    success BOOLEAN NOT NULL,
-                    error_message TEXT,
-                    timestamp DATETIME NOT NULL,
-                    ip_address TEXT NOT NULL,
-                    user_agent TEXT NOT NULL
-                )
-            ''')
-            
-            # Tabla de sesiones de usuario
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    session_id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL,
-                    start_time DATETIME NOT NULL,
-                    end_time DATETIME,
-                    page_views INTEGER DEFAULT 0,
-                    music_generations INTEGER DEFAULT 0,
-                    ai_usage INTEGER DEFAULT 0,
-                    total_time REAL DEFAULT 0,
-                    ip_address TEXT NOT NULL,
-                    user_agent TEXT NOT NULL
-                )
-            ''')
-            
-            # Tabla de interacciones de usuario
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_interactions (
-                    id TEXT PRIMARY KEY,
-                    session_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    action TEXT NOT NULL,
-                    element TEXT NOT NULL,
-                    value TEXT,
-                    timestamp DATETIME NOT NULL,
-                    metadata TEXT NOT NULL,
-                    FOREIGN KEY (session_id) REFERENCES user_sessions (session_id)
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info("✅ Base de datos de analytics inicializada")
-    
-    def save_music_generation(self, event: MusicGenerationEvent):
-        """Guardar evento de generación musical"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+        
+        # Escritura diferida: los eventos se escriben por lotes en una transacción
+        # y la sesión, que se reescribe en cada evento, sólo en su última versión.
+        # Cada lote marca sus días en los agregados y luego se recalculan los
+        # días cerrados afectados
+        self.rollups = AnalyticsRollups(get_storage(db_path))
+        self.writer = WriteBehindBuffer(get_storage(db_path), "analytics", {
+            "music_generations": '''
                 INSERT INTO music_generations 
                 (id, user_id, prompt, style, duration, tempo, scale, instruments, 
                  mood, ai_enhanced, generation_time, success, error_message, 
                  timestamp, ip_address, user_agent)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                event.id, event.user_id, event.prompt, event.style, event.duration,
-                event.tempo, event.scale, json.dumps(event.instruments), event.mood,
-                event.ai_enhanced, event.generation_time, event.success, event.error_message,
-                event.timestamp.isoformat(), event.ip_address, event.user_agent
-            ))
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"📊 Evento de generación guardado: {event.id}")
-    
-    def save_user_session(self, session: UserSession):
-        """Guardar sesión de usuario"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            ''',
+            "user_sessions": '''
                 INSERT OR REPLACE INTO user_sessions
                 (session_id, user_id, start_time, end_time, page_views, 
                  music_generations, ai_usage, total_time, ip_address, user_agent)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                session.session_id, session.user_id, session.start_time.isoformat(),
-                session.end_time.isoformat() if session.end_time else None,
-                session.page_views, session.music_generations, session.ai_usage,
-                session.total_time, session.ip_address, session.user_agent
-            ))
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"📊 Sesión guardada: {session.session_id}")
-    
-    def save_user_interaction(self, interaction: UserInteraction):
-        """Guardar interacción de usuario"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            ''',
+            "user_interactions": '''
                 INSERT INTO user_interactions
                 (id, session_id, user_id, action, element, value, timestamp, metadata)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                interaction.id, interaction.session_id, interaction.user_id,
-                interaction.action, interaction.element, interaction.value,
-                interaction.timestamp.isoformat(), json.dumps(interaction.metadata)
-            ))
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"📊 Interacción guardada: {interaction.id}")
+            ''',
+        }, on_write=self.rollups.mark_dirty, after_flush=self.rollups.refresh)
+        self.writer.start()
     
-    def get_analytics_data(self, days: int = 7) -> Dict[str, Any]:
-        """Obtener datos de analytics para los últimos N días"""
+    def init_database(self):
+        """Inicializar base de datos (migraciones pendientes según PRAGMA user_version)"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Calcular fecha de inicio
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
-            
-            # Métricas de generación musical
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_generations,
-                    SUM(CASE WHEN success = 1 THEN 1 ELSE 0 END) as successful_generations,
-                    SUM(CASE WHEN success = 0 THEN 1 ELSE 0 END) as failed_generations,
-                    AVG(duration) as avg_duration,
-                    AVG(generation_time) as avg_generation_time,
-                    SUM(CASE WHEN ai_enhanced = 1 THEN 1 ELSE 0 END) as ai_usage_count
-                FROM music_generations
-                WHERE timestamp BETWEEN ? AND ?
-            ''', (start_date.isoformat(), end_date.isoformat()))
-            
-            music_metrics = cursor.fetchone()
-            
-            # Métricas de sesiones
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_sessions,
-                    COUNT(DISTINCT user_id) as unique_users,
-                    AVG(total_time) as avg_session_duration
-                FROM user_sessions
-                WHERE start_time BETWEEN ? AND ?
-            ''', (start_date.isoformat(), end_date.isoformat()))
-            
-            session_metrics = cursor.fetchone()
-            
-            # Estilos más populares
-            cursor.execute('''
-                SELECT style, COUNT(*) as count
-                FROM music_generations
-                WHERE timestamp BETWEEN ? AND ? AND success = 1
-                GROUP BY style
-                ORDER BY count DESC
-                LIMIT 10
-            ''', (start_date.isoformat(), end_date.isoformat()))
-            
-            popular_styles = cursor.fetchall()
-            
-            # Prompts más populares
-            cursor.execute('''
-                SELECT prompt, COUNT(*) as count
-                FROM music_generations
-                WHERE timestamp BETWEEN ? AND ? AND success = 1
-                GROUP BY prompt
-                ORDER BY count DESC
-                LIMIT 10
-            ''', (start_date.isoformat(), end_date.isoformat()))
-            
-            popular_prompts = cursor.fetchall()
-            
-            conn.close()
-            
-            return {
-                'music_metrics': {
-                    'total_generations': music_metrics[0] or 0,
-                    'successful_generations': music_metrics[1] or 0,
-                    'failed_generations': music_metrics[2] or 0,
-                    'avg_duration': music_metrics[3] or 0,
-                    'avg_generation_time': music_metrics[4] or 0,
-                    'ai_usage_count': music_metrics[5] or 0
-                },
-                'session_metrics': {
-                    'total_sessions': session_metrics[0] or 0,
-                    'unique_users': session_metrics[1] or 0,
-                    'avg_session_duration': session_metrics[2] or 0
-                },
-                'popular_styles': [{'style': style, 'count': count} for style, count in popular_styles],
-                'popular_prompts': [{'prompt': prompt, 'count': count} for prompt, count in popular_prompts]
-            }
+            version = migrate_analytics(self.db_path)
+            logger.info(f"✅ Base de datos de analytics inicializada (esquema v{version})")
+    
+    def save_music_generation(self, event: MusicGenerationEvent):
+        """Encolar evento de generación musical"""
+        self.writer.put("music_generations", (
+            event.id, event.user_id, event.prompt, event.style, event.duration,
+            event.tempo, event.scale, json.dumps(event.instruments), event.mood,
+            event.ai_enhanced, event.generation_time, event.success, event.error_message,
+            event.timestamp.isoformat(), event.ip_address, event.user_agent
+        ))
+        logger.debug(f"📊 Evento de generación encolado: {event.id}")
+    
+    def save_user_session(self, session: UserSession):
+        """Encolar sesión de usuario (sustituye a la versión pendiente)"""
+        self.writer.put("user_sessions", (
+            session.session_id, session.user_id, session.start_time.isoformat(),
+            session.end_time.isoformat() if session.end_time else None,
+            session.page_views, session.music_generations, session.ai_usage,
+            session.total_time, session.ip_address, session.user_agent
+        ), key=session.session_id)
+        logger.debug(f"📊 Sesión encolada: {session.session_id}")
+    
+    def save_user_interaction(self, interaction: UserInteraction):
+        """Encolar interacción de usuario"""
+        self.writer.put("user_interactions", (
+            interaction.id, interaction.session_id, interaction.user_id,
+            interaction.action, interaction.element, interaction.value,
+            interaction.timestamp.isoformat(), json.dumps(interaction.metadata)
+        ))
+        logger.debug(f"📊 Interacción encolada: {interaction.id}")
+    
+    def close(self):
+        """Escribir los eventos pendientes (llamar al apagar el servidor)"""
+        self.writer.close()
+    
+    @timed_sqlite("get_analytics_data")
+    def get_analytics_data(self, days: int = 7) -> Dict[str, Any]:
+        """Obtener datos de analytics para los últimos N días (días cerrados desde agregados)"""
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+        # Sin self.lock: cada hilo lee con su propia conexión WAL, que no bloquea
+        # ni es bloqueada por el hilo de escritura diferida
+        # El dashboard simple no muestra el uso de IA por día: no se calcula
+        return self.rollups.analytics(start_date, end_date, ai_usage_by_day=False)
 
 class SimpleAnalyticsCollector:
     """Recolector simple de analytics"""
@@ -289,11 +177,13 @@ class SimpleAnalyticsCollector:
     def __init__(self, db_path: str = "analytics.db"):
         self.db = SimpleAnalyticsDatabase(db_path)
         self.active_sessions = {}
-        self.lock = threading.Lock()
+        # Reentrante: track_batch la mantiene mientras llama a los track_*
+        self.lock = threading.RLock()
     
-    def start_session(self, user_id: str, ip_address: str, user_agent: str) -> str:
-        """Iniciar nueva sesión"""
-        session_id = str(uuid.uuid4())
+    def start_session(self, user_id: str, ip_address: str, user_agent: str,
+                      session_id: Optional[str] = None) -> str:
+        """Iniciar nueva sesión (con el id generado por el cliente si lo manda)"""
+        session_id = session_id or str(uuid.uuid4())
         session = UserSession(
             session_id=session_id,
             user_id=user_id,
@@ -314,8 +204,8 @@ class SimpleAnalyticsCollector:
         logger.info(f"📊 Nueva sesión iniciada: {session_id}")
         return session_id
     
-    def end_session(self, session_id: str):
-        """Finalizar sesión"""
+    def end_session(self, session_id: str) -> bool:
+        """Finalizar sesión (False si no había una activa con ese id)"""
         with self.lock:
             if session_id in self.active_sessions:
                 session = self.active_sessions[session_id]
@@ -326,6 +216,8 @@ class SimpleAnalyticsCollector:
                 del self.active_sessions[session_id]
                 
                 logger.info(f"📊 Sesión finalizada: {session_id}")
+                return True
+            return False
     
     def track_music_generation(self, session_id: str, user_id: str, prompt: str, 
                              style: str, duration: float, tempo: int, scale: str,
@@ -397,6 +289,33 @@ class SimpleAnalyticsCollector:
         logger.info(f"📊 Interacción rastreada: {interaction_id}")
         return interaction_id
     
+    def track_batch(self, events: List[Any], ip_address: str, user_agent: str) -> List[Dict[str, Any]]:
+        """Rastrear un lote de eventos mixtos: resultado por evento, todo en una transacción"""
+        results = []
+        # Mismo orden de locks que los track_* (sesiones y luego la cola de escritura)
+        with self.lock, self.db.writer.atomic():
+            for index, event in enumerate(events):
+                try:
+                    kind, data = validate_event(event)
+                except ValueError as e:
+                    results.append({'index': index, 'success': False, 'error': str(e)})
+                    continue
+                if kind == 'generation':
+                    event_id = self.track_music_generation(
+                        ip_address=ip_address, user_agent=user_agent, **data)
+                elif kind == 'interaction':
+                    event_id = self.track_interaction(**data)
+                elif kind == 'session_start':
+                    event_id = self.start_session(
+                        ip_address=ip_address, user_agent=user_agent, **data)
+                elif self.end_session(data['session_id']):
+                    event_id = data['session_id']
+                else:
+                    results.append({'index': index, 'success': False, 'error': 'sesión desconocida'})
+                    continue
+                results.append({'index': index, 'success': True, 'type': kind, 'id': event_id})
+        return results
+    
     def get_analytics(self, days: int = 7) -> Dict[str, Any]:
         """Obtener analytics de los últimos N días"""
         return self.db.get_analytics_data(days)
@@ -410,25 +329,57 @@ class AnalyticsHTTPHandler(BaseHTTPRequestHandler):
     
     def do_GET(self):
         """Manejar peticiones GET"""
-        if self.path == '/api/health':
-            self.send_health_response()
+        if self.path == '/metrics':
+            self.send_metrics_response()
+        elif self.path == '/api/health':
+            self.timed('/api/health', self.send_health_response)
         elif self.path.startswith('/api/analytics'):
-            self.send_analytics_response()
+            self.timed('/api/analytics', self.send_analytics_response)
         else:
-            self.send_error(404, "Not Found")
+            self.timed('unmatched', self.send_error, 404, "Not Found")
     
     def do_POST(self):
         """Manejar peticiones POST"""
         if self.path == '/api/session/start':
-            self.handle_start_session()
+            self.timed(self.path, self.handle_start_session)
         elif self.path == '/api/session/end':
-            self.handle_end_session()
+            self.timed(self.path, self.handle_end_session)
         elif self.path == '/api/track/generation':
-            self.handle_track_generation()
+            self.timed(self.path, self.handle_track_generation)
         elif self.path == '/api/track/interaction':
-            self.handle_track_interaction()
+            self.timed(self.path, self.handle_track_interaction)
+        elif self.path == '/api/track/batch':
+            self.timed(self.path, self.handle_track_batch)
         else:
-            self.send_error(404, "Not Found")
+            self.timed('unmatched', self.send_error, 404, "Not Found")
+    
+    def send_response(self, code, message=None):
+        """Recordar el código de estado para las métricas"""
+        self.status_code = code
+        super().send_response(code, message)
+    
+    def timed(self, route, handle, *args):
+        """Medir la latencia de una petición por ruta"""
+        if not METRICS_ENABLED:
+            return handle(*args)
+        self.status_code = 500
+        registry.gauge_add("http_requests_in_flight", 1, service="simple_analytics")
+        start = time.perf_counter()
+        try:
+            return handle(*args)
+        finally:
+            registry.gauge_add("http_requests_in_flight", -1, service="simple_analytics")
+            observe_request("simple_analytics", self.command, route, self.status_code,
+                            time.perf_counter() - start)
+    
+    def send_metrics_response(self):
+        """Enviar métricas en formato Prometheus"""
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def send_health_response(self):
         """Enviar respuesta de salud"""
@@ -595,6 +546,45 @@ class AnalyticsHTTPHandler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, str(e))
     
+    def handle_track_batch(self):
+        """Manejar lote de eventos (NDJSON o array JSON, gzip opcional)"""
+        try:
+            content_length = int(self.headers['Content-Length'])
+            if content_length > ANALYTICS_BATCH_MAX_BYTES:
+                raise BatchError(f"lote mayor de {ANALYTICS_BATCH_MAX_BYTES} bytes", 413)
+            events = decode_batch(self.rfile.read(content_length))
+            
+            results = self.collector.track_batch(
+                events,
+                ip_address=self.client_address[0],
+                user_agent=self.headers.get('User-Agent', '')
+            )
+            accepted = sum(1 for result in results if result['success'])
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            
+            response = {
+                'success': True,
+                'accepted': accepted,
+                'rejected': len(results) - accepted,
+                'results': results,
+                'timestamp': datetime.now().isoformat()
+            }
+            
+            self.wfile.write(json.dumps(response).encode())
+            
+        except BatchError as e:
+            self.send_response(e.status)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({'success': False, 'error': str(e)}).encode())
+        except Exception as e:
+            self.send_error(500, str(e))
+    
     def log_message(self, format, *args):
         """Suprimir logs de HTTP"""
         pass
@@ -605,6 +595,48 @@ def create_handler(collector):
         return AnalyticsHTTPHandler(collector, *args, **kwargs)
     return handler
 
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer que atiende cada conexión en un pool acotado de hilos"""
+    
+    def __init__(self, server_address, handler, workers: int = ANALYTICS_WORKERS,
+                 backlog: int = ANALYTICS_BACKLOG):
+        self.request_queue_size = backlog
+        super().__init__(server_address, handler)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analytics-http")
+        # Con todas las plazas ocupadas se deja de aceptar y la espera pasa al backlog del kernel
+        self.slots = threading.BoundedSemaphore(workers + backlog)
+    
+    def process_request(self, request, client_address):
+        """Encolar la conexión en el pool en lugar de atenderla en el bucle de accept"""
+        self.slots.acquire()
+        try:
+            self.executor.submit(self.process_request_thread, request, client_address)
+        except RuntimeError:
+            # Pool ya cerrado (apagando)
+            self.slots.release()
+            self.shutdown_request(request)
+    
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+    
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+def create_server(collector, host: str = ANALYTICS_HOST, port: int = ANALYTICS_PORT,
+                  workers: int = ANALYTICS_WORKERS) -> HTTPServer:
+    """Servidor HTTP concurrente (o de un solo hilo con workers=0)"""
+    handler = create_handler(collector)
+    if workers <= 0:
+        return HTTPServer((host, port), handler)
+    return PooledHTTPServer((host, port), handler, workers)
+
 def main():
     """Función principal"""
     print("📊 Iniciando servidor de analytics simplificado...")
@@ -613,12 +645,13 @@ def main():
     collector = SimpleAnalyticsCollector()
     
     # Crear servidor HTTP
-    handler = create_handler(collector)
-    server = HTTPServer(('localhost', 8002), handler)
+    server = create_server(collector)
+    url = f"http://{ANALYTICS_HOST}:{ANALYTICS_PORT}"
     
-    print("📊 Servidor de analytics iniciado en http://localhost:8002")
-    print("📊 Health Check: http://localhost:8002/api/health")
-    print("📊 Analytics: http://localhost:8002/api/analytics")
+    mode = f"{ANALYTICS_WORKERS} hilos" if ANALYTICS_WORKERS > 0 else "un solo hilo"
+    print(f"📊 Servidor de analytics iniciado en {url} ({mode})")
+    print(f"📊 Health Check: {url}/api/health")
+    print(f"📊 Analytics: {url}/api/analytics")
     print("📊 Presiona Ctrl+C para detener")
     
     try:
@@ -627,6 +660,10 @@ def main():
         print("\n📊 Deteniendo servidor de analytics...")
         server.shutdown()
         print("📊 Servidor detenido")
+    finally:
+        server.server_close()
+        # Escribir los eventos pendientes antes de salir
+        collector.db.close()
 
 if __name__ == "__main__":
     main()
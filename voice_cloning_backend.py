@@ -1,18 +1,26 @@
 # Voice Cloning Backend for Son1kVers3
 # Handles so-VITS, XTTR, and cloud-based voice cloning
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import httpx
 import asyncio
+import io
 import os
 import uuid
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 import json
+import hashlib
 import logging
 
+from backend.app.deadline import DeadlineExceeded, install_deadlines, remaining
+from backend.app.idempotency import IdempotencyStore, fingerprint
+from backend.app.metrics import install_fastapi, time_upstream
+from backend.app.loop_monitor import monitor_fastapi
+from backend.app.storage import close_all_storages, get_storage
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,6 +28,15 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="Voice Cloning API", version="1.0.0")
 security = HTTPBearer()
 
+# X-Request-Deadline support; cancel in-flight work when the client disconnects
+install_deadlines(app, service="voice_cloning")
+
+# Prometheus metrics on /metrics
+install_fastapi(app, service="voice_cloning")
+
+# Event-loop lag and blocking-call detection (opt-in, LOOP_MONITOR=1)
+monitor_fastapi(app, service="voice_cloning")
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "Voice Cloning API", "version": "1.0.0"}
@@ -29,6 +46,20 @@ HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 AZURE_API_KEY = os.getenv("AZURE_API_KEY")
 RESEMBLE_API_KEY = os.getenv("RESEMBLE_API_KEY")
+VOICE_DB_PATH = os.getenv("VOICE_DB_PATH", "voice_cloning.db")
+
+# Idempotency-Key store so client retries don't start a second cloning job
+idempotency = IdempotencyStore(get_storage(VOICE_DB_PATH))
+
+@app.on_event("startup")
+async def startup_event():
+    idempotency.init()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Cancel cloning jobs still running detached from their request
+    await idempotency.close()
+    close_all_storages()
 
 # Models
 class VoiceCloneRequest(BaseModel):
@@ -89,47 +120,64 @@ def check_tier_limits(tier: str, operation: str) -> bool:
 async def clone_voice(
     audio_file: UploadFile = File(...),
     request: VoiceCloneRequest = Depends(),
-    tier: str = Depends(get_user_tier)
+    tier: str = Depends(get_user_tier),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Clone voice using uploaded audio sample and text"""
     
-    if not check_tier_limits(tier, "voice_clone"):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Voice cloning not available for your tier"
-        )
-    
-    try:
-        # Select best model based on tier and preferences
-        model = select_voice_model(tier, request.model_preference)
+    async def produce():
+        if not check_tier_limits(tier, "voice_clone"):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Voice cloning not available for your tier"
+            )
         
-        # Process voice cloning
-        result = await process_voice_cloning(
-            audio_file, 
-            request.text, 
-            model, 
-            request.voice_settings
-        )
+        try:
+            # Select best model based on tier and preferences
+            model = select_voice_model(tier, request.model_preference)
         
-        # Update usage stats
-        update_usage_stats(tier, result["duration"])
+            # Process voice cloning
+            result = await process_voice_cloning(
+                sample, 
+                request.text, 
+                model, 
+                request.voice_settings
+            )
         
-        return VoiceCloneResponse(
-            success=True,
-            audio_url=result["audio_url"],
-            model_used=model["name"],
-            duration=result["duration"],
-            quality=model["quality"],
-            tier=tier,
-            usage_stats=get_usage_stats(tier)
-        )
+            # Update usage stats
+            update_usage_stats(tier, result["duration"])
         
-    except Exception as e:
-        logger.error(f"Voice cloning failed: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Voice cloning failed: {str(e)}"
-        )
+            return VoiceCloneResponse(
+                success=True,
+                audio_url=result["audio_url"],
+                model_used=model["name"],
+                duration=result["duration"],
+                quality=model["quality"],
+                tier=tier,
+                usage_stats=get_usage_stats(tier)
+            )
+        
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Voice cloning failed: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Voice cloning failed: {str(e)}"
+            )
+    
+    # Retries with the same Idempotency-Key get the first response; keys are per token.
+    # The job may outlive this request, so it works on its own copy of the upload
+    audio_content = await audio_file.read()
+    sample = UploadFile(io.BytesIO(audio_content), filename=audio_file.filename,
+                        headers=audio_file.headers)
+    owner = hashlib.sha256(credentials.credentials.encode()).hexdigest()[:16]
+    return await idempotency.run(
+        f"voice-clone:{owner}", idempotency_key,
+        fingerprint(request.text, request.voice_settings, request.model_preference, audio_content),
+        produce
+    )
 
 @app.post("/api/voice/upload-sample")
 async def upload_voice_sample(
@@ -356,12 +404,13 @@ async def process_with_huggingface(audio_file: UploadFile, text: str, model: Dic
         }
         
         # Make request
-        response = await client.post(
-            f"https://api-inference.huggingface.co/models/{model['model_id']}",
-            files=files,
-            headers=headers,
-            timeout=60.0
-        )
+        with time_upstream("huggingface"):
+            response = await client.post(
+                f"https://api-inference.huggingface.co/models/{model['model_id']}",
+                files=files,
+                headers=headers,
+                timeout=remaining(60.0)
+            )
         
         if response.status_code != 200:
             raise HTTPException(
@@ -400,12 +449,13 @@ async def process_with_elevenlabs(audio_file: UploadFile, text: str, model: Dict
         }
         
         # Make request
-        response = await client.post(
-            f"https://api.elevenlabs.io/v1/text-to-speech/{model['model_id']}",
-            files=files,
-            headers=headers,
-            timeout=60.0
-        )
+        with time_upstream("elevenlabs"):
+            response = await client.post(
+                f"https://api.elevenlabs.io/v1/text-to-speech/{model['model_id']}",
+                files=files,
+                headers=headers,
+                timeout=remaining(60.0)
+            )
         
         if response.status_code != 200:
             raise HTTPException(